@@ -0,0 +1,67 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from xfl.data.local_join import aux_index
+from xfl.data.local_join.aux_index import AuxIndex
+
+
+class TestAuxIndex(unittest.TestCase):
+  def setUp(self):
+    self.path = '/tmp/xfl-test/aux_index/table'
+    shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+
+  def test_get_batch(self):
+    items = [(os.urandom(8), os.urandom(20)) for i in range(1000)]
+    items += [(items[3][0], b'new'), (b'', b'empty')]
+    index = AuxIndex.open_or_build(self.path, lambda: iter(items))
+    expected = dict(items)
+    self.assertEqual(len(index), len(expected))
+    self.assertEqual(index.get(items[3][0]), b'new')
+    self.assertEqual(index.get(b''), b'empty')
+    self.assertIsNone(index.get(b'missing'))
+    keys = list(expected) + [b'missing', items[5][0][:4]]
+    self.assertEqual(index.get_batch(keys), [expected.get(k) for k in keys])
+    self.assertEqual(index.get_batch([]), [])
+    index.close()
+
+  def test_built_once(self):
+    AuxIndex.open_or_build(self.path, lambda: iter([(b'a', b'1')])).close()
+    # an existing index is opened without reading the table again
+    index = AuxIndex.open_or_build(self.path, lambda: self.fail("index is built again"))
+    self.assertEqual(index.get_batch([b'a', b'b']), [b'1', None])
+    index.close()
+
+  def test_hash_collision(self):
+    # all keys collide, they are told apart by the key bytes
+    with mock.patch.object(aux_index.mmh3, 'hash64', return_value=(7, 0)):
+      index = AuxIndex.open_or_build(self.path, lambda: iter([(b'a', b'1'), (b'b', b'2'), (b'a', b'3')]))
+      self.assertEqual(len(index), 2)
+      self.assertEqual(index.get_batch([b'b', b'a', b'c']), [b'2', b'3', None])
+      index.close()
+
+  def test_empty(self):
+    index = AuxIndex.open_or_build(self.path, lambda: iter([]))
+    self.assertEqual(len(index), 0)
+    self.assertEqual(index.get_batch([b'a']), [None])
+    self.assertIsNone(index.get(b'a'))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=1)
@@ -15,6 +15,7 @@
 
 import unittest
 import os
+from unittest import mock
 from test.local_join.local_data_set import LocalJoinDataset
 from xfl.data.local_join.aux_table import AuxTable
 from xfl.data.local_join.worker import LocalJoinWorker
@@ -52,6 +53,99 @@ class TestLocalDataJoin(unittest.TestCase):
     worker.run()
     self._check_output_data()
 
+  def test_record_range_join(self):
+    aux_tables = [AuxTable(self.dataset.aux1_path, self.dataset.aux1_key),
+                  AuxTable(self.dataset.aux2_path, self.dataset.aux2_key)]
+    output_dir = self.test_output_dir + '_range'
+    if tf.io.gfile.exists(output_dir):
+      tf.io.gfile.rmtree(output_dir)
+    for i in range(3):
+      worker = LocalJoinWorker(input_dir=self.dataset.primary_data_path,
+                               output_dir=output_dir,
+                               worker_idx=i,
+                               worker_num=3,
+                               left_keys=['key', 'key'],
+                               aux_tables=aux_tables,
+                               block_size=100,
+                               max_shard_records=1500
+                               )
+      worker.open()
+      worker.run()
+    res = []
+    for path in utils.list_data_file_recursively(output_dir):
+      for raw_record in tf.data.TFRecordDataset(path):
+        example = tf.train.Example()
+        example.ParseFromString(raw_record.numpy())
+        res.append(example.SerializeToString(deterministic=True))
+    self.assertEqual(sorted(res), sorted(e.SerializeToString(deterministic=True) for e in self.dataset.ans))
+
+  def test_aux_table_changed(self):
+    table_dir = '/tmp/xfl-test/local_join_changed_aux'
+    index_dir = table_dir + '_index'
+    for d in (table_dir, index_dir):
+      if tf.io.gfile.exists(d):
+        tf.io.gfile.rmtree(d)
+    tf.io.gfile.makedirs(table_dir)
+    path = os.path.join(table_dir, 'part')
+    for i, value in enumerate([b'v1', b'v2']):
+      example = tf.train.Example(features=tf.train.Features(feature={
+        'k': tf.train.Feature(bytes_list=tf.train.BytesList(value=[b'key'])),
+        'v': tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))}))
+      with tf.io.TFRecordWriter(path) as writer:
+        writer.write(example.SerializeToString())
+      # the table is rewritten with the same size, it is told apart by the modify time
+      os.utime(path, ns=((i + 1) * 10**18, (i + 1) * 10**18))
+      table = AuxTable(table_dir, 'k', index_dir=index_dir)
+      table.open()
+      self.assertEqual(table.get(b'key'), example.SerializeToString())
+    self.assertEqual(len([f for f in os.listdir(index_dir) if not f.endswith('.lock')]), 1)
+
+  def test_record_range_crc(self):
+    input_dir = '/tmp/xfl-test/local_join_corrupted'
+    if tf.io.gfile.exists(input_dir):
+      tf.io.gfile.rmtree(input_dir)
+    tf.io.gfile.makedirs(input_dir)
+    path = os.path.join(input_dir, 'part')
+    with tf.io.TFRecordWriter(path) as writer:
+      for i in range(4):
+        writer.write(b'record%d' % i)
+    worker = LocalJoinWorker(input_dir=input_dir, output_dir=input_dir + '_output', worker_idx=0, worker_num=1,
+                             left_keys=[], aux_tables=[], block_size=3, record_index_dir=input_dir + '_index')
+    self.assertEqual([r for b in worker._iter_range_blocks(path, 0, 4) for r in b],
+                     [b'record%d' % i for i in range(4)])
+    with open(path, 'r+b') as f:
+      # a byte of the data of the third record
+      f.seek(2 * 23 + 12)
+      f.write(b'R')
+    with self.assertRaises(RuntimeError):
+      list(worker._iter_range_blocks(path, 0, 4))
+
+  def test_key_check(self):
+    input_dir = '/tmp/xfl-test/local_join_bad_key'
+    def example(**features):
+      return tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString()
+    good = example(k=tf.train.Feature(bytes_list=tf.train.BytesList(value=[b'a'])))
+    bad_records = {
+      'is not in input record': example(v=tf.train.Feature(bytes_list=tf.train.BytesList(value=[b'a']))),
+      'type must be bytes_list': example(k=tf.train.Feature(int64_list=tf.train.Int64List(value=[1]))),
+      'length must be 1': example(k=tf.train.Feature(bytes_list=tf.train.BytesList(value=[b'a', b'b']))),
+    }
+    for msg, bad in bad_records.items():
+      if tf.io.gfile.exists(input_dir):
+        tf.io.gfile.rmtree(input_dir)
+      tf.io.gfile.makedirs(input_dir)
+      path = os.path.join(input_dir, 'part')
+      with tf.io.TFRecordWriter(path) as writer:
+        for r in [good, good, bad, good]:
+          writer.write(r)
+      worker = LocalJoinWorker(input_dir=input_dir, output_dir=input_dir + '_output', worker_idx=0, worker_num=1,
+                               left_keys=['k'], aux_tables=[mock.Mock()], block_size=3,
+                               record_index_dir=input_dir + '_index')
+      # whole file and record range shards
+      for args in [(), (0, 4)]:
+        with self.assertRaisesRegex(RuntimeError, msg):
+          list(worker._iter_blocks(path, *args))
+
   def _check_output_data(self):
     files = utils.list_data_file_recursively(self.test_output_dir)
     idx = 0
@@ -0,0 +1,67 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import shutil
+import unittest
+
+from xfl.data.local_join.sharding import get_record_offsets, scan_record_offsets
+from xfl.data.tfreecord.tfreecord import RecordWriter
+
+
+class TestSharding(unittest.TestCase):
+  def setUp(self):
+    self.dir = '/tmp/xfl-test/sharding'
+    shutil.rmtree(self.dir, ignore_errors=True)
+    os.makedirs(self.dir)
+    self.index_dir = os.path.join(self.dir, 'index')
+
+  def _write(self, path, records, mtime):
+    writer = RecordWriter()
+    with open(path, 'wb') as f:
+      for r in records:
+        f.write(writer.encode_example(r))
+    os.utime(path, ns=(mtime, mtime))
+
+  def _index_files(self):
+    return [f for f in os.listdir(self.index_dir) if not f.endswith('.lock')]
+
+  def test_record_offsets_of_changed_file(self):
+    path = os.path.join(self.dir, 'data')
+    self._write(path, [b'ab', b'cd'], 10**18)
+    self.assertEqual(get_record_offsets(path, self.index_dir).tolist(), [0, 18, 36])
+    # a file of the same size written again is scanned again, offsets of the old file are removed
+    self._write(path, [b'x' * 20], 2 * 10**18)
+    self.assertEqual(get_record_offsets(path, self.index_dir).tolist(), [0, 36])
+    self.assertEqual(len(self._index_files()), 1)
+
+  def test_scan_record_offsets(self):
+    path = os.path.join(self.dir, 'data')
+    records = [os.urandom(n) for n in [0, 3, 40, 1, 100, 7]]
+    self._write(path, records, 10**18)
+    expected = [0]
+    for r in records:
+      expected.append(expected[-1] + 16 + len(r))
+    # chunks shorter than a record and chunks ending inside a header
+    for chunk_size in [8, 10, 50, 1 << 20]:
+      self.assertEqual(scan_record_offsets(path, chunk_size).tolist(), expected)
+    with open(path, 'ab') as f:
+      f.write(b'\x01\x02')
+    with self.assertRaises(RuntimeError):
+      scan_record_offsets(path, 10)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=1)
@@ -0,0 +1,43 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import unittest
+
+from xfl.data.bloom_filter import BloomFilter
+from xfl.data.store import DictSampleKvStore
+
+
+class TestBloomFilter(unittest.TestCase):
+  def test_bloom_filter(self):
+    store = DictSampleKvStore()
+    keys = [os.urandom(16) for i in range(20000)]
+    for k in keys:
+      store.put(k, b'')
+    bf = BloomFilter.from_bytes(BloomFilter.from_store(store, error_rate=0.01, batch_size=3000).to_bytes())
+    self.assertTrue(bf.contains_batch(keys).all())
+    self.assertTrue(bf.contains(keys[0]))
+    others = [os.urandom(16) for i in range(20000)]
+    self.assertLess(bf.contains_batch(others).sum(), 20000 * 0.02)
+    self.assertEqual(len(bf.contains_batch([])), 0)
+
+  def test_from_bytes_error(self):
+    data = BloomFilter(capacity=100).to_bytes()
+    with self.assertRaises(ValueError):
+      BloomFilter.from_bytes(data[:-1])
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=1)
@@ -0,0 +1,81 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import tempfile
+import unittest
+
+import mmh3
+
+from xfl.data.bucket_plan import BucketPlan, sample_bucket_sizes
+from xfl.data.hash_util import get_bucket_id
+from xfl.data.tfreecord.tfreecord import RecordWriter
+
+
+class TestBucketPlan(unittest.TestCase):
+  def test_build(self):
+    plan = BucketPlan.build([100, 10, 350, 40], max_bucket_size=100)
+    self.assertEqual(plan.hash_bucket_num, 4)
+    self.assertEqual(plan.bucket_num, 7)
+    plan = BucketPlan.build([100, 10, 350, 40], max_bucket_size=100, align=4)
+    self.assertEqual(plan.bucket_num, 8)
+
+  def test_get_bucket(self):
+    plan = BucketPlan([1, 3, 1, 2])
+    keys = [os.urandom(8) for i in range(4000)]
+    buckets = [plan.get_bucket(k) for k in keys]
+    self.assertEqual(set(buckets), set(range(7)))
+    offsets = [0, 1, 4, 5]
+    for k, b in zip(keys, buckets):
+      h = mmh3.hash(k) % 4
+      self.assertTrue(offsets[h] <= b < offsets[h] + [1, 3, 1, 2][h])
+    plan = BucketPlan.from_json(plan.to_json())
+    self.assertEqual([plan.get_bucket(k) for k in keys], buckets)
+
+  def test_hash_type(self):
+    plan = BucketPlan.from_json(BucketPlan([1, 3, 1, 2], hash_type='city').to_json())
+    self.assertEqual(plan.hash_type, 'city')
+    keys = [os.urandom(8) for i in range(1000)]
+    offsets = [0, 1, 4, 5]
+    for k in keys:
+      h = get_bucket_id(k, 4, 'city')
+      self.assertTrue(offsets[h] <= plan.get_bucket(k) < offsets[h] + [1, 3, 1, 2][h])
+    # plans saved before hash types keep using murmur3
+    self.assertEqual(BucketPlan.from_json('{"split_nums": [1, 2]}').hash_type, 'murmur3')
+
+  def test_sample_bucket_sizes(self):
+    writer = RecordWriter()
+    ids = [str(i).encode() for i in range(2000)]
+    with tempfile.TemporaryDirectory() as d:
+      with open(os.path.join(d, 'a.tfrecord'), 'wb') as f:
+        for i in ids:
+          example = writer.example(features={'feature': {'example_id': writer.bytes_feature(i)}})
+          f.write(writer.encode_example(example.SerializeToString()))
+      with open(os.path.join(d, 'a.csv'), 'wb') as f:
+        f.write(b'label,example_id\n')
+        for i in ids:
+          f.write(b'0,' + i + b'\n')
+      expected = [0] * 4
+      for i in ids:
+        expected[mmh3.hash(i) % 4] += 1
+      self.assertEqual(sample_bucket_sizes([os.path.join(d, 'a.tfrecord')], 'example_id', 4, sample_rate=1.), expected)
+      self.assertEqual(sample_bucket_sizes([os.path.join(d, 'a.csv')], 'example_id', 4, 'csv', sample_rate=1.),
+                       expected)
+      self.assertAlmostEqual(sum(sample_bucket_sizes([os.path.join(d, 'a.tfrecord')], 'example_id', 4,
+                                                     sample_rate=.5)), 2000, delta=200)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,153 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from xfl.common.common import RunMode
+from xfl.data.client_no_tf import DefaultKeySelector, data_join_pipeline_local_no_tf, \
+  bucketize_tf_record_file, concat_bucket_parts, BucketMemoryBudget
+from xfl.data.store import DictSampleKvStore
+from xfl.data.tfreecord.tfreecord import RecordReader, RecordWriter
+from xfl.data.utils import get_sample_store_key
+from xfl.service import create_data_join_server
+
+PORT = 50101
+JOB_NAME = 'efls-test-local-client'
+
+
+def write_input(path, ids):
+  writer = RecordWriter()
+  with open(path, 'wb') as f:
+    for i in ids:
+      example = writer.example(features={'feature': {
+        'example_id': writer.bytes_feature(str(i).encode()), 'ts': writer.int64_feature(i)}})
+      f.write(writer.encode_example(example.SerializeToString()))
+
+
+def read_ids(path):
+  reader = RecordReader()
+  return [int(reader.decode_example(r)['ts'][0]) for r in reader.read_records(path)]
+
+
+class TestClientNoTf(unittest.TestCase):
+  def test_bucketize(self):
+    with tempfile.TemporaryDirectory() as d:
+      write_input(os.path.join(d, 'a'), range(0, 500))
+      write_input(os.path.join(d, 'b'), range(500, 1000))
+      bucket_path = os.path.join(d, 'buckets')
+      for file_idx, name in enumerate(['a', 'b']):
+        bucketize_tf_record_file(os.path.join(d, name), file_idx, bucket_path, 4, 'example_id')
+      selector = DefaultKeySelector(bucket_num=4)
+      for b in range(4):
+        concat_bucket_parts(os.path.join(bucket_path, str(b)), 'bucket.tfrecords')
+        self.assertEqual(os.listdir(os.path.join(bucket_path, str(b))), ['bucket.tfrecords'])
+        ids = read_ids(os.path.join(bucket_path, str(b), 'bucket.tfrecords'))
+        # records keep the input file order
+        self.assertEqual(ids, [i for i in range(1000) if selector.get_key((str(i).encode(),)) == b])
+
+  def test_local_client_join(self):
+    ser_store = DictSampleKvStore()
+    for i in range(0, 1000, 3):
+      ser_store.put(get_sample_store_key(str(i), i), b'')
+    data_join_server, rpc_server, _ = create_data_join_server(
+      bucket_id=0, port=PORT, job_name=JOB_NAME, run_mode=RunMode.LOCAL, sample_kv_store=ser_store)
+    data_join_server.set_is_ready(True)
+    try:
+      with tempfile.TemporaryDirectory() as d:
+        os.makedirs(os.path.join(d, 'in'))
+        write_input(os.path.join(d, 'in', 'a'), range(0, 600))
+        write_input(os.path.join(d, 'in', 'b'), range(600, 1000))
+        data_join_pipeline_local_no_tf(
+          input_path=os.path.join(d, 'in'), output_path=os.path.join(d, 'out'), job_name=JOB_NAME,
+          host='localhost', port=PORT, ip=None, bucket_num=1, run_mode='local', hash_col_name='example_id',
+          sort_col_name='ts', is_server=False, sample_store_type='memory', batch_size=100, file_part_size=1000,
+          tls_crt_path=None, rsa_pub_path=None, rsa_pri_path=None, wait_s=10, bucketing_process_num=2).run()
+        self.assertEqual(sorted(read_ids(os.path.join(d, 'out', '0', '0.tfrecords'))), list(range(0, 1000, 3)))
+    finally:
+      rpc_server.stop(None)
+
+  def test_local_client_join_bounded_workers(self):
+    bucket_num = 3
+    selector = DefaultKeySelector(bucket_num=bucket_num)
+    servers = []
+    for b in range(bucket_num):
+      ser_store = DictSampleKvStore()
+      for i in range(0, 1000, 3):
+        if selector.get_key((str(i).encode(),)) == b:
+          ser_store.put(get_sample_store_key(str(i), i), b'')
+      data_join_server, rpc_server, _ = create_data_join_server(
+        bucket_id=b, port=PORT + 1 + b, job_name=JOB_NAME, run_mode=RunMode.LOCAL, sample_kv_store=ser_store)
+      data_join_server.set_is_ready(True)
+      servers.append(rpc_server)
+    try:
+      with tempfile.TemporaryDirectory() as d:
+        os.makedirs(os.path.join(d, 'in'))
+        write_input(os.path.join(d, 'in', 'a'), range(0, 1000))
+        data_join_pipeline_local_no_tf(
+          input_path=os.path.join(d, 'in'), output_path=os.path.join(d, 'out'), job_name=JOB_NAME,
+          host='localhost', port=PORT + 1, ip=None, bucket_num=bucket_num, run_mode='local',
+          hash_col_name='example_id', sort_col_name='ts', is_server=False, sample_store_type='memory',
+          batch_size=100, file_part_size=1000, tls_crt_path=None, rsa_pub_path=None, rsa_pri_path=None, wait_s=10,
+          bucketing_process_num=1, join_worker_num=2, join_memory_budget_mb=1, max_in_flight=4).run()
+        res = []
+        for b in range(bucket_num):
+          res.extend(read_ids(os.path.join(d, 'out', str(b), '{}.tfrecords'.format(b))))
+        self.assertEqual(sorted(res), list(range(0, 1000, 3)))
+        self.assertFalse(os.path.exists(os.path.join(d, 'out', 'tmp_bucket')))
+    finally:
+      for rpc_server in servers:
+        rpc_server.stop(None)
+
+  def test_unsupported_options(self):
+    kwargs = dict(input_path='in', output_path='out', job_name=JOB_NAME, host='localhost', port=PORT, ip=None,
+                  bucket_num=1, run_mode='local', hash_col_name='example_id', sort_col_name='ts', is_server=False,
+                  sample_store_type='memory', batch_size=100, file_part_size=1000, tls_crt_path=None,
+                  rsa_pub_path=None, rsa_pri_path=None)
+    for option in [dict(use_psi=True), dict(client2multiserver=2), dict(bucket_plan_path='plan.json'),
+                   dict(incremental=True), dict(use_bloom_filter=True), dict(use_async_join=True),
+                   dict(inputfile_type='csv')]:
+      with self.assertRaises(RuntimeError, msg=str(option)):
+        data_join_pipeline_local_no_tf(**kwargs, **option)
+    with self.assertRaises(TypeError):
+      data_join_pipeline_local_no_tf(**kwargs, sort_run_size=100)
+
+  def test_memory_budget(self):
+    budget = BucketMemoryBudget(100)
+    budget.acquire(60)
+    acquired = threading.Event()
+
+    def worker():
+      budget.acquire(60)
+      acquired.set()
+      budget.release(60)
+
+    t = threading.Thread(target=worker)
+    t.start()
+    time.sleep(0.1)
+    self.assertFalse(acquired.is_set())
+    budget.release(60)
+    t.join(5)
+    self.assertTrue(acquired.is_set())
+    # a bucket larger than the budget runs alone
+    budget.acquire(1000)
+    budget.release(1000)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,271 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import grpc
+
+from proto import data_join_pb2, common_pb2
+from xfl.common.common import RunMode
+from xfl.data import utils
+from xfl.data.psi.ecc_signer import EccSigner
+from xfl.data.store import DictSampleKvStore
+from xfl.service import create_data_join_client, create_data_join_server
+
+JOB_NAME = 'efls-test-join-service'
+PORT = 50071
+
+
+def prepare_join_data(data_size=10000, batch_size=512):
+  #client ids whose intersection with server ids is about 50%.
+  raw_data = [os.urandom(16) for i in range(int(data_size / 2 * 3))]
+  ser_store = DictSampleKvStore()
+  for i in raw_data[:data_size]:
+    ser_store.put(i, os.urandom(32))
+  random.shuffle(raw_data)
+  cli_ids = raw_data[:data_size]
+  batches = [cli_ids[i:i + batch_size] for i in range(0, len(cli_ids), batch_size)]
+  return ser_store, batches
+
+
+class TestDataJoinService(unittest.TestCase):
+  def setUp(self):
+    self.ser_store, self.batches = prepare_join_data()
+    self.data_join_server, self.rpc_server, _ = create_data_join_server(
+      bucket_id=0,
+      port=PORT,
+      job_name=JOB_NAME,
+      run_mode=RunMode.LOCAL,
+      sample_kv_store=self.ser_store)
+    self.data_join_server.set_is_ready(True)
+    self.client = create_data_join_client(
+      host='localhost',
+      ip=None,
+      port=PORT,
+      job_name=JOB_NAME,
+      bucket_id=0,
+      run_mode=RunMode.LOCAL,
+      tls_crt=None,
+      client2multiserver=1)
+    self.client.wait_ready(timeout=10)
+
+  def tearDown(self):
+    self.rpc_server.stop(None)
+
+  def _expected_res(self):
+    return [utils.gather_res(b, self.ser_store.exists(b)) for b in self.batches]
+
+  def _check_server_res(self):
+    self.assertTrue(self.client.finish_join())
+    self.assertEqual(self.data_join_server.get_final_result(), self._expected_res())
+
+  def test_sync_join(self):
+    res = []
+    for b in self.batches:
+      res.append(utils.gather_res(b, self.client.sync_join(b, 0)))
+    self.assertEqual(res, self._expected_res())
+    self._check_server_res()
+
+  def test_join_without_bitmap(self):
+    #clients which do not accept bitmap get `join_res`
+    b = self.batches[0]
+    res = self.client.get_stub().SyncJoin(data_join_pb2.JoinRequest(ids=b, bucket_id=0),
+                                          metadata=self.client.get_metadata(0))
+    self.assertEqual(res.status.code, common_pb2.OK)
+    self.assertEqual(len(res.join_bitmap), 0)
+    self.assertEqual(list(res.join_res), self.ser_store.exists(b))
+
+  def test_stream_join(self):
+    res = []
+    for request_ids, existence in self.client.stream_join(iter(self.batches), 0, max_in_flight=4):
+      res.append(utils.gather_res(request_ids, existence))
+    self.assertEqual(res, self._expected_res())
+    self._check_server_res()
+
+  def test_async_join(self):
+    res = []
+    for request_ids, existence in self.client.async_join(self.batches, 0, max_in_flight=8):
+      res.append(utils.gather_res(request_ids, existence))
+    self.assertEqual(res, self._expected_res())
+    self._check_server_res()
+
+  def test_async_join_iterator(self):
+    consumed = []
+    def batches():
+      for b in self.batches:
+        consumed.append(b)
+        yield b
+    res = []
+    for request_ids, existence in self.client.async_join(batches(), 0, max_in_flight=2,
+                                                         total_batch_num=len(self.batches)):
+      # batches are taken from the iterator only when there is room in flight
+      self.assertLessEqual(len(consumed) - len(res), 3)
+      res.append(utils.gather_res(request_ids, existence))
+    self.assertEqual(res, self._expected_res())
+    self._check_server_res()
+
+  def test_async_join_batch_num(self):
+    with self.assertRaises(RuntimeError):
+      list(self.client.async_join(iter(self.batches), 0, total_batch_num=len(self.batches) - 1))
+    with self.assertRaises(RuntimeError):
+      list(self.client.async_join(iter(self.batches), 0, total_batch_num=len(self.batches) + 1))
+
+  def test_async_join_retry(self):
+    class FailedFuture(object):
+      def result(self):
+        raise grpc.RpcError()
+      def cancel(self):
+        pass
+    future = self.client._async_join_future
+    calls = []
+    def flaky_future(request, bucket_id):
+      calls.append(request.batch_idx)
+      # the first send of every other batch fails
+      if request.batch_idx % 2 == 0 and calls.count(request.batch_idx) == 1:
+        return FailedFuture()
+      return future(request, bucket_id)
+    with mock.patch.object(self.client, '_async_join_future', side_effect=flaky_future):
+      res = [utils.gather_res(ids, e) for ids, e in self.client.async_join(self.batches, 0, max_in_flight=4)]
+    self.assertEqual(res, self._expected_res())
+    self._check_server_res()
+
+  def test_async_join_batch_idx_mismatch(self):
+    future = self.client._async_join_future
+    def wrong_idx_future(request, bucket_id):
+      request = data_join_pb2.AsyncJoinRequest.FromString(request.SerializeToString())
+      request.batch_idx = (request.batch_idx + 1) % request.total_batch_num
+      return future(request, bucket_id)
+    with mock.patch.object(self.client, '_async_join_future', side_effect=wrong_idx_future):
+      with self.assertRaises(RuntimeError):
+        list(self.client.async_join(self.batches, 0))
+
+  def test_async_join_out_of_order(self):
+    stub = self.client.get_stub()
+    total = len(self.batches)
+    for i in reversed(range(total)):
+      res = stub.AsyncJoin(data_join_pb2.AsyncJoinRequest(ids=self.batches[i], bucket_id=0, batch_idx=i,
+                                                          total_batch_num=total),
+                           metadata=self.client.get_metadata(0))
+      self.assertEqual(res.status.code, common_pb2.OK)
+      self.assertEqual(res.batch_idx, i)
+      self.assertEqual(list(res.join_res), self.ser_store.exists(self.batches[i]))
+      if i == 1:
+        # batch 0 is still missing
+        self.assertFalse(self.client.finish_join())
+    self.assertEqual(self.data_join_server.get_final_result(), self._expected_res())
+
+  def test_bloom_filter(self):
+    bf = self.client.get_bloom_filter(0)
+    cli_ids = [i for b in self.batches for i in b]
+    existence = self.ser_store.exists(cli_ids)
+    self.assertTrue(all(bf.contains_batch(cli_ids)[existence]))
+
+  def test_stream_result(self):
+    data_join_server, rpc_server, _ = create_data_join_server(
+      bucket_id=0, port=PORT + 20, job_name=JOB_NAME, run_mode=RunMode.LOCAL, sample_kv_store=self.ser_store,
+      stream_result=True)
+    data_join_server.set_is_ready(True)
+    client = create_data_join_client(host='localhost', ip=None, port=PORT + 20, job_name=JOB_NAME, bucket_id=0,
+                                     run_mode=RunMode.LOCAL, tls_crt=None, client2multiserver=1)
+    try:
+      client.wait_ready(timeout=10)
+      with ThreadPoolExecutor(1) as executor:
+        server_res = executor.submit(lambda: list(data_join_server.iter_joined_res(timeout=60)))
+        for _ in client.async_join(self.batches, 0, max_in_flight=8):
+          pass
+        self.assertTrue(client.finish_join())
+        self.assertEqual(server_res.result(timeout=10), self._expected_res())
+      # streamed batches are not kept by the server
+      self.assertEqual(data_join_server.get_final_result(), [])
+    finally:
+      rpc_server.stop(None)
+
+
+
+class TestEcdhDataJoinService(unittest.TestCase):
+  def test_concurrent_server_data_signing(self):
+    ser_signer, cli_signer = EccSigner(), EccSigner()
+    raw_data = [os.urandom(16) for i in range(6000)]
+    ser_ids = raw_data[:4000]
+    ser_store, ecdh_id_map = DictSampleKvStore(), DictSampleKvStore()
+    for i in ser_ids:
+      ser_store.put(ser_signer.sign_hash(i), i)
+    data_join_server, rpc_server, _ = create_data_join_server(
+      bucket_id=0, port=PORT + 10, job_name=JOB_NAME, run_mode=RunMode.LOCAL, sample_kv_store=ser_store,
+      use_psi=True, psi_server_type='ecdh', signer=ser_signer, ecdh_id_map=ecdh_id_map)
+    data_join_server.set_is_ready(True)
+    try:
+      client = create_data_join_client(host='localhost', ip=None, port=PORT + 10, job_name=JOB_NAME, bucket_id=0,
+                                       run_mode=RunMode.LOCAL, tls_crt=None, client2multiserver=1)
+      client.wait_ready(timeout=10)
+
+      def sign_blocks():
+        while True:
+          finished, _, block_id, data = client.acquire_server_data(bucket_id=0)
+          if finished:
+            return
+          client.send_server_signed_data(cli_signer.sign_batch(data), block_id, bucket_id=0)
+
+      with ThreadPoolExecutor(max_workers=4) as pool:
+        for f in [pool.submit(sign_blocks) for _ in range(4)]:
+          f.result()
+      self.assertEqual(ecdh_id_map.size(), len(ser_ids))
+      random.shuffle(raw_data)
+      cli_ids = raw_data[:3000]
+      existence = client.sync_join(cli_signer.sign_hash_batch(cli_ids), 0)
+      ser_id_set = set(ser_ids)
+      self.assertEqual(utils.gather_res(cli_ids, existence), [i for i in cli_ids if i in ser_id_set])
+      self.assertTrue(client.finish_join())
+    finally:
+      rpc_server.stop(None)
+
+  def test_server_signed_data_sent_twice(self):
+    ser_signer, cli_signer = EccSigner(), EccSigner()
+    ser_store, ecdh_id_map = DictSampleKvStore(), DictSampleKvStore()
+    for i in [os.urandom(16) for i in range(100)]:
+      ser_store.put(ser_signer.sign_hash(i), i)
+    data_join_server, rpc_server, _ = create_data_join_server(
+      bucket_id=0, port=PORT + 11, job_name=JOB_NAME, run_mode=RunMode.LOCAL, sample_kv_store=ser_store,
+      use_psi=True, psi_server_type='ecdh', signer=ser_signer, ecdh_id_map=ecdh_id_map)
+    data_join_server.set_is_ready(True)
+    try:
+      client = create_data_join_client(host='localhost', ip=None, port=PORT + 11, job_name=JOB_NAME, bucket_id=0,
+                                       run_mode=RunMode.LOCAL, tls_crt=None, client2multiserver=1)
+      client.wait_ready(timeout=10)
+      _, _, block_id, data = client.acquire_server_data(bucket_id=0)
+      block = data_join_pb2.DataBlock(block_id=block_id, data=cli_signer.sign_batch(data))
+      put = ecdh_id_map.put
+      retried = []
+      def put_and_retry(k, v):
+        # a retry of the same block finishes while the first call is writing the map
+        if not retried:
+          retried.append(None)
+          retried[0] = data_join_server.SendServerSignedData(block, None)
+        return put(k, v)
+      with mock.patch.object(ecdh_id_map, 'put', side_effect=put_and_retry):
+        status = data_join_server.SendServerSignedData(block, None)
+      self.assertEqual(status.code, common_pb2.OK)
+      self.assertEqual(retried[0].code, common_pb2.OK)
+      self.assertEqual(ecdh_id_map.size(), len(data))
+    finally:
+      rpc_server.stop(None)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=1)
@@ -48,6 +48,16 @@ class TestEccSigner(unittest.TestCase):
         sh1 = EccSigner(secret=pk, hashfunc=user_hash_func)
         [self.assertEqual((hexlify(sh1.sign_hash(i))), target_v) for i in v]
 
+        #test batch sign
+        values = [os.urandom(16) for i in range(1000)]
+        s3 = EccSigner(private_key, process_num=2)
+        try:
+            hashed = s3.sign_hash_batch(values)
+            self.assertEqual(hashed, [s1.sign_hash(i) for i in values])
+            self.assertEqual(s3.sign_batch(hashed), [s1.sign(i) for i in hashed])
+        finally:
+            s3.close()
+
         #test illegal udf
         with self.assertRaises(TypeError):
             sh2 = EccSigner(hashfunc=user_error_hash_func)
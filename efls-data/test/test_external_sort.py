@@ -0,0 +1,79 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from xfl.data import utils
+from xfl.data.external_sort import external_sorted, ExternalSorter
+from xfl.data.utils import get_sample_store_key, split_sample_store_key
+
+
+def sort_key(key):
+  t = split_sample_store_key(key)
+  return t[1], t[0]
+
+
+class TestExternalSort(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.keys = [get_sample_store_key(os.urandom(8).hex(), str(random.randint(0, 100))) for i in range(10000)]
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_in_memory(self):
+    self.assertEqual(list(external_sorted(iter(self.keys), key=sort_key, run_size=len(self.keys) + 1,
+                                          tmp_dir=self.tmp_dir)), sorted(self.keys, key=sort_key))
+    self.assertEqual(os.listdir(self.tmp_dir), [])
+
+  def test_spilled_runs(self):
+    sorted_keys = external_sorted(iter(self.keys), key=sort_key, run_size=999, tmp_dir=self.tmp_dir)
+    batches = list(utils.batch_iter(sorted_keys, 512))
+    self.assertEqual([len(b) for b in batches], [512] * 19 + [272])
+    self.assertEqual([k for b in batches for k in b], sorted(self.keys, key=sort_key))
+    self.assertEqual(os.listdir(self.tmp_dir), [])
+
+  def test_close_early(self):
+    sorted_keys = external_sorted(iter(self.keys), key=sort_key, run_size=999, tmp_dir=self.tmp_dir)
+    next(sorted_keys)
+    sorted_keys.close()
+    self.assertEqual(os.listdir(self.tmp_dir), [])
+
+  def test_sorter_stable(self):
+    # items of equal keys come out in the order they were added, across spilled runs
+    sorter = ExternalSorter(key=lambda item: item[:1], run_size=7, tmp_dir=self.tmp_dir)
+    items = [bytes([random.randint(0, 3), i]) for i in range(100)]
+    for item in items:
+      sorter.add(item)
+    self.assertEqual(list(sorter.sorted()), sorted(items, key=lambda item: item[:1]))
+    self.assertEqual(os.listdir(self.tmp_dir), [])
+
+  def test_sorter_run_bytes(self):
+    sorter = ExternalSorter(run_size=None, run_bytes=95, tmp_dir=self.tmp_dir)
+    items = [os.urandom(10) for i in range(105)]
+    for item in items:
+      sorter.add(item)
+    # runs of 10 items are spilled by their bytes, the count bound is left off
+    self.assertEqual(len(os.listdir(self.tmp_dir)), 10)
+    self.assertEqual(list(sorter.sorted()), sorted(items))
+    self.assertEqual(os.listdir(self.tmp_dir), [])
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=1)
@@ -0,0 +1,115 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import threading
+import unittest
+
+from xfl.data.store.flink_state_kv_store import FlinkStateKvStore
+
+
+class FakeMapState(object):
+  '''dict backed MapState counting the calls made to the state.'''
+  def __init__(self):
+    self.data = {}
+    self.put_all_calls = 0
+    self.contains_calls = 0
+    self.keys_calls = 0
+
+  def contains(self, key):
+    self.contains_calls += 1
+    return key in self.data
+
+  def get(self, key):
+    return self.data.get(key)
+
+  def put_all(self, dict_value):
+    self.put_all_calls += 1
+    self.data.update(dict_value)
+
+  def keys(self):
+    self.keys_calls += 1
+    return iter(list(self.data))
+
+  def clear(self):
+    self.data = {}
+
+
+class TestFlinkStateKvStore(unittest.TestCase):
+  def setUp(self):
+    self.state = FakeMapState()
+    self.store = FlinkStateKvStore(self.state, write_batch_size=10)
+
+  def test_buffered_puts(self):
+    data = {os.urandom(8): os.urandom(16) for i in range(25)}
+    for k, v in data.items():
+      self.store.put(k, v)
+    # two full batches are written, the rest is still buffered and readable
+    self.assertEqual(self.state.put_all_calls, 2)
+    self.assertEqual(len(self.state.data), 20)
+    self.assertEqual(self.state.contains_calls, 0)
+    self.assertTrue(all(self.store.get(k) == v for k, v in data.items()))
+    self.assertEqual(self.store.exists(list(data) + [b'missing']), [True] * len(data) + [False])
+    self.assertEqual(self.state.put_all_calls, 3)
+    self.assertEqual(self.state.data, data)
+
+  def test_size(self):
+    keys = [os.urandom(8) for i in range(15)]
+    for k in keys:
+      self.store.put(k, b'v')
+    self.assertEqual(self.store.size(), 15)
+    # the count is kept until the next write
+    self.assertEqual(self.store.size(), 15)
+    self.assertEqual(self.state.keys_calls, 1)
+    # overwritten keys are counted once
+    for k in keys[:5] + [b'new']:
+      self.store.put(k, b'v2')
+    self.assertEqual(self.store.size(), 16)
+    self.assertEqual(self.state.keys_calls, 2)
+    self.assertEqual(self.state.contains_calls, 0)
+
+  def test_clear(self):
+    for i in range(15):
+      self.store.put(os.urandom(8), b'v')
+    self.store.clear()
+    self.assertEqual(self.store.size(), 0)
+    self.assertEqual(self.store.keys(), [])
+    self.assertEqual(self.state.data, {})
+
+  def test_iter(self):
+    keys = {os.urandom(8) for i in range(25)}
+    for k in keys:
+      self.store.put(k, b'v')
+    self.assertEqual(set(self.store), keys)
+    self.assertEqual(set(self.store.keys()), keys)
+
+  def test_handler_of_thread(self):
+    self.store.put(b'k', b'v')
+    self.assertEqual(self.store.exists([b'k']), [True])
+    errors = []
+    def read():
+      try:
+        self.store.get(b'k')
+      except RuntimeError as e:
+        errors.append(e)
+    # a thread without its own handler does not read state of the creating thread
+    t = threading.Thread(target=read)
+    t.start()
+    t.join()
+    self.assertEqual(len(errors), 1)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=1)
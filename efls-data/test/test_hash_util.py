@@ -0,0 +1,53 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import unittest
+
+import mmh3
+
+from xfl.data.hash_util import HASH_TYPES, get_hash_func, get_bucket_id, get_bucket_ids
+
+
+def hash_available(hash_type):
+  try:
+    get_hash_func(hash_type)
+    return True
+  except ImportError:
+    return False
+
+
+class TestHashUtil(unittest.TestCase):
+  def test_murmur3_compatible(self):
+    # buckets of jobs run before hash types were added must not move
+    keys = [os.urandom(8) for i in range(1000)]
+    self.assertEqual(get_bucket_ids(keys, 7).tolist(), [mmh3.hash(k) % 7 for k in keys])
+
+  def test_get_bucket_ids(self):
+    keys = [os.urandom(8) for i in range(1000)] + [b'', str(2 ** 40).encode()]
+    for hash_type in HASH_TYPES:
+      if not hash_available(hash_type):
+        continue
+      ids = get_bucket_ids(keys, 13, hash_type)
+      self.assertEqual(ids.tolist(), [get_bucket_id(k, 13, hash_type) for k in keys])
+      self.assertTrue(((ids >= 0) & (ids < 13)).all())
+    self.assertEqual(get_bucket_ids([], 13).tolist(), [])
+
+  def test_unsupported(self):
+    with self.assertRaises(ValueError):
+      get_hash_func('md5')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,64 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import tempfile
+import unittest
+
+from xfl.data.incremental import IngestManifest, list_input_files, bucket_start_markers, is_bucket_start_marker
+
+
+class TestIncremental(unittest.TestCase):
+  def _write(self, path, data=b'x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+      f.write(data)
+
+  def test_list_input_files(self):
+    with tempfile.TemporaryDirectory() as d:
+      for name in ['a', 'sub/b', '_SUCCESS', '.a.crc', '_tmp/c']:
+        self._write(os.path.join(d, name))
+      self.assertEqual(list_input_files('file://' + d),
+                       ['file://' + os.path.join(d, 'a'), 'file://' + os.path.join(d, 'sub/b')])
+      with self.assertRaises(ValueError):
+        list_input_files('oss://bucket/path')
+
+  def test_manifest(self):
+    with tempfile.TemporaryDirectory() as d:
+      self._write(os.path.join(d, 'in/a'))
+      manifest = IngestManifest(d, 'job', True, 4)
+      files = list_input_files(os.path.join(d, 'in'))
+      self.assertEqual(manifest.new_files(files), files)
+      manifest.commit(files)
+
+      self._write(os.path.join(d, 'in/b'))
+      manifest = IngestManifest(d, 'job', True, 4)
+      self.assertEqual(manifest.get_run_id(), 1)
+      self.assertEqual(manifest.new_files(list_input_files(os.path.join(d, 'in'))),
+                       ['file://' + os.path.join(d, 'in/b')])
+      # client runs of the same job keep their own manifest
+      self.assertEqual(IngestManifest(d, 'job', False, 4).get_run_id(), 0)
+      with self.assertRaises(ValueError):
+        IngestManifest(d, 'job', True, 8)
+
+  def test_bucket_start_markers(self):
+    markers = bucket_start_markers(3)
+    self.assertEqual([int(m[1]) for m in markers], [0, 1, 2])
+    self.assertTrue(all(is_bucket_start_marker(m) for m in markers))
+    self.assertFalse(is_bucket_start_marker((b'', b'0', b'sample')))
+
+
+if __name__ == '__main__':
+  unittest.main()
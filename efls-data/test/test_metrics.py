@@ -0,0 +1,99 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import unittest
+import urllib.request
+
+from xfl.common import metrics
+from xfl.common.common import RunMode
+from xfl.data.store import DictSampleKvStore
+from xfl.service import create_data_join_client, create_data_join_server
+from xfl.service.data_join_client import CLIENT_IDS, CLIENT_HIT_IDS, CLIENT_RPC_SECONDS, CLIENT_SENT_BYTES
+from xfl.service.data_join_server import SERVER_IDS, SERVER_HIT_IDS, SERVER_RPC_SECONDS, SERVER_RECEIVED_BYTES, \
+  SERVER_STATE, STORE_KEYS
+
+JOB_NAME = 'efls-test-metrics'
+PORT = 50111
+# bucket id not used by the other tests, metrics of a process are shared
+BUCKET_ID = 7
+
+
+class TestMetrics(unittest.TestCase):
+  def test_render(self):
+    registry = metrics.MetricsRegistry()
+    counter = registry.counter('test_ids_total', 'ids', ['bucket'])
+    self.assertIs(registry.counter('test_ids_total', 'ids', ['bucket']), counter)
+    with self.assertRaises(ValueError):
+      registry.gauge('test_ids_total', 'ids', ['bucket'])
+    counter.inc(3, bucket=1)
+    counter.inc(bucket=1)
+    histogram = registry.histogram('test_seconds', 'latency', buckets=(0.1, 1.))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5.)
+    text = registry.render()
+    self.assertIn('# TYPE test_ids_total counter\ntest_ids_total{bucket="1"} 4\n', text)
+    self.assertIn('test_seconds_bucket{le="0.1"} 2\ntest_seconds_bucket{le="1.0"} 2\n'
+                  'test_seconds_bucket{le="+Inf"} 3\ntest_seconds_sum 5.15\ntest_seconds_count 3\n', text)
+    with self.assertRaises(ValueError):
+      counter.inc(bucket=1, method='x')
+
+  def test_http_endpoint(self):
+    registry = metrics.MetricsRegistry()
+    registry.gauge('test_state', 'state').set(2)
+    server = metrics.start_metrics_server(0, registry)
+    try:
+      port = server.server_address[1]
+      self.assertIs(metrics.start_metrics_server(port, registry), server)
+      with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=5) as res:
+        self.assertEqual(res.read().decode(), registry.render())
+    finally:
+      server.shutdown()
+
+  def test_join_metrics(self):
+    ser_store = DictSampleKvStore()
+    ids = [os.urandom(8) for i in range(1000)]
+    for i in ids[:600]:
+      ser_store.put(i, b'')
+    server, rpc_server, _ = create_data_join_server(
+      bucket_id=BUCKET_ID, port=PORT, job_name=JOB_NAME, run_mode=RunMode.LOCAL, sample_kv_store=ser_store)
+    server.set_is_ready(True)
+    try:
+      client = create_data_join_client(host='localhost', ip=None, port=PORT, job_name=JOB_NAME, bucket_id=BUCKET_ID,
+                                       run_mode=RunMode.LOCAL, tls_crt=None, client2multiserver=1)
+      client.wait_ready(timeout=10)
+      batches = [ids[i:i + 100] for i in range(0, 1000, 100)]
+      for b in batches[:5]:
+        client.sync_join(b, BUCKET_ID)
+      for _ in client.stream_join(batches[5:], BUCKET_ID, max_in_flight=2):
+        pass
+      self.assertTrue(client.finish_join())
+    finally:
+      rpc_server.stop(None)
+    for ids_counter, hit_counter in ((SERVER_IDS, SERVER_HIT_IDS), (CLIENT_IDS, CLIENT_HIT_IDS)):
+      self.assertEqual(ids_counter.get(bucket=BUCKET_ID), 1000)
+      self.assertEqual(hit_counter.get(bucket=BUCKET_ID), 600)
+    self.assertEqual(STORE_KEYS.get(bucket=BUCKET_ID, op='exists'), 1000)
+    for method, count in (('SyncJoin', 5), ('StreamJoin', 5)):
+      self.assertEqual(SERVER_RPC_SECONDS.get_count(bucket=BUCKET_ID, method=method), count)
+      self.assertEqual(CLIENT_RPC_SECONDS.get_count(bucket=BUCKET_ID, method=method), count)
+      self.assertEqual(SERVER_RECEIVED_BYTES.get(bucket=BUCKET_ID, method=method),
+                       CLIENT_SENT_BYTES.get(bucket=BUCKET_ID, method=method))
+    self.assertEqual(SERVER_STATE.get(bucket=BUCKET_ID), 2)
+    self.assertIn('xfl_data_join_server_hit_ids_total{bucket="7"} 600', metrics.REGISTRY.render())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,85 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import tempfile
+import unittest
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from xfl.common.common import RunMode
+from xfl.data.client_no_tf import DefaultKeySelector, data_join_pipeline_local_no_tf
+from xfl.data.parquet_io import ParquetBucketWriter, ParquetBucketTable
+from xfl.data.store import DictSampleKvStore
+from xfl.data.utils import get_sample_store_key
+from xfl.service import create_data_join_server
+
+PORT = 50091
+
+
+def write_input(path, n):
+  table = pa.table({'example_id': [str(i) for i in range(n)], 'ts': list(range(n)),
+                    'feature': [float(i) / 2 for i in range(n)]})
+  pq.write_table(table, path)
+  return table
+
+
+class TestParquetIO(unittest.TestCase):
+  def test_bucket_write_and_read(self):
+    with tempfile.TemporaryDirectory() as d:
+      write_input(os.path.join(d, 'in.parquet'), 1000)
+      selector = DefaultKeySelector(bucket_num=3)
+      writer = ParquetBucketWriter(os.path.join(d, 'buckets'), 3, 'part.parquet')
+      writer.write_file(os.path.join(d, 'in.parquet'), 'example_id', selector, batch_size=128)
+      writer.close()
+      rows = 0
+      for b in range(3):
+        table = ParquetBucketTable(os.path.join(d, 'buckets', str(b)), 'example_id', 'ts')
+        keys = dict(table.iter_keys())
+        rows += table.num_rows()
+        for key, i in keys.items():
+          self.assertEqual(selector.get_key((key.split(b'#')[0],)), b)
+        some = sorted(keys)[:5]
+        taken = table.take([keys[k] for k in some]).to_pydict()
+        self.assertEqual([get_sample_store_key(h, s) for h, s in zip(taken['example_id'], taken['ts'])], some)
+      self.assertEqual(rows, 1000)
+
+  def test_local_client_parquet_join(self):
+    ser_store = DictSampleKvStore()
+    for i in range(0, 1000, 3):
+      ser_store.put(get_sample_store_key(str(i), i), b'')
+    data_join_server, rpc_server, _ = create_data_join_server(
+      bucket_id=0, port=PORT, job_name='efls-test-parquet', run_mode=RunMode.LOCAL, sample_kv_store=ser_store)
+    data_join_server.set_is_ready(True)
+    try:
+      with tempfile.TemporaryDirectory() as d:
+        os.makedirs(os.path.join(d, 'in'))
+        write_input(os.path.join(d, 'in', 'a.parquet'), 1000)
+        data_join_pipeline_local_no_tf(
+          input_path=os.path.join(d, 'in'), output_path=os.path.join(d, 'out'), job_name='efls-test-parquet',
+          host='localhost', port=PORT, ip=None, bucket_num=1, run_mode='local', hash_col_name='example_id',
+          sort_col_name='ts', is_server=False, sample_store_type='memory', batch_size=100, file_part_size=1000,
+          tls_crt_path=None, rsa_pub_path=None, rsa_pri_path=None, wait_s=10, inputfile_type='parquet').run()
+        out = pq.read_table(os.path.join(d, 'out', '0', '0.parquet'))
+        self.assertEqual(out.column_names, ['example_id', 'ts', 'feature'])
+        self.assertEqual(sorted(out.column('ts').to_pylist()), list(range(0, 1000, 3)))
+        self.assertEqual(out.column('feature').to_pylist(), [t / 2 for t in out.column('ts').to_pylist()])
+    finally:
+      rpc_server.stop(None)
+
+
+if __name__ == '__main__':
+  unittest.main()
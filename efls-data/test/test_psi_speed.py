@@ -16,7 +16,7 @@
 import unittest
 import os
 import time
-from xfl.data.psi.rsa_signer import ServerRsaSigner
+from xfl.data.psi.rsa_signer import RsaSigner, ServerRsaSigner, _crt_sign_list
 from xfl.data.psi.ecc_signer import EccSigner
 
 class TestRsaPsi(unittest.TestCase):
@@ -48,5 +48,24 @@ class TestRsaPsi(unittest.TestCase):
     print('sign qps: %.2f'%(self._data_size/(end-begin)))
     print('===================================================')
 
+    key = rs.rsa_private_key_
+    hashed_ids = RsaSigner.fdh_list(self._input_data, True)
+    begin = time.time()
+    RsaSigner.rsa_sign_list(hashed_ids, key.d, key.n)
+    full_cost = time.time() - begin
+    # both exponentiations run on the same hashed ints, fdh and one way hash are not timed
+    begin = time.time()
+    _crt_sign_list(hashed_ids, rs._crt_key)
+    crt_cost = time.time() - begin
+    begin = time.time()
+    rs.sign_blinded_ids_packed(self._input_data)
+    packed_cost = time.time() - begin
+    print ('')
+    print('========rsa crt sign speed result =======')
+    print('full exponent sign qps: %.2f'%(self._data_size/full_cost))
+    print('crt sign qps: %.2f, speedup: %.2fx'%(self._data_size/crt_cost, full_cost/crt_cost))
+    print('crt packed blinded sign qps: %.2f'%(self._data_size/packed_cost))
+    print('===================================================')
+
 if __name__ == '__main__':
   unittest.main(verbosity=1)
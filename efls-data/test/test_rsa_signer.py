@@ -0,0 +1,102 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from xfl.common.common import RunMode
+from xfl.data import utils
+from xfl.data.psi import process_pool
+from xfl.data.psi.rsa_signer import RsaSigner, ServerRsaSigner, ClientRsaSigner
+from xfl.data.store import DictSampleKvStore
+from xfl.service import create_data_join_client, create_data_join_server
+
+JOB_NAME = 'efls-test-rsa-signer'
+PORT = 50072
+
+
+class TestRsaSigner(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.pub_key, cls.prv_key = RsaSigner.generate_rsa_keys(key_length=1024)
+
+  def test_crt_sign(self):
+    ids = [os.urandom(16) for i in range(100)]
+    signer = ServerRsaSigner(self.pub_key, self.prv_key)
+    d, n = signer.rsa_private_key_.d, signer.rsa_private_key_.n
+    expected = RsaSigner.rsa_sign_list(RsaSigner.fdh_list(ids, True), d, n)
+    self.assertEqual(signer.sign_func(ids), RsaSigner.oneway_hash_list(expected))
+    blinded = [os.urandom(64) for i in range(100)]
+    byte_len = signer.get_signed_id_len()
+    self.assertEqual(signer.sign_blinded_ids_packed(blinded),
+                     b''.join(int(pow(int.from_bytes(i, 'little'), d, n)).to_bytes(byte_len, 'little') for i in blinded))
+
+  def test_process_pool(self):
+    ids = [os.urandom(16) for i in range(200)]
+    signer = ServerRsaSigner(self.pub_key, self.prv_key)
+    pool_signer = ServerRsaSigner(self.pub_key, self.prv_key, process_num=2)
+    expected = signer.sign_func(ids)
+    # threads mapping their first batches together share one pool
+    with mock.patch.object(process_pool, 'ProcessPoolExecutor', wraps=process_pool.ProcessPoolExecutor) as executor:
+      try:
+        with ThreadPoolExecutor(4) as threads:
+          for res in threads.map(lambda _: pool_signer.sign_func(ids), range(4)):
+            self.assertEqual(res, expected)
+      finally:
+        pool_signer.close()
+    self.assertEqual(executor.call_count, 1)
+
+  def test_psi_join(self):
+    ser_signer = ServerRsaSigner(self.pub_key, self.prv_key)
+    raw_ids = [os.urandom(16) for i in range(3000)]
+    ser_ids = raw_ids[:2000]
+    psi_id_map = DictSampleKvStore()
+    for signed_id, raw_id in zip(ser_signer.sign_func(ser_ids), ser_ids):
+      psi_id_map.put(signed_id, raw_id)
+    data_join_server, rpc_server, _ = create_data_join_server(
+      bucket_id=0,
+      port=PORT,
+      job_name=JOB_NAME,
+      run_mode=RunMode.LOCAL,
+      sample_kv_store=psi_id_map,
+      use_psi=True,
+      psi_server_type='rsa',
+      signer=ser_signer)
+    data_join_server.set_is_ready(True)
+    try:
+      client = create_data_join_client(host='localhost', ip=None, port=PORT, job_name=JOB_NAME, bucket_id=0,
+                                       run_mode=RunMode.LOCAL, tls_crt=None, client2multiserver=1)
+      client.wait_ready(timeout=10)
+      cli_signer = ClientRsaSigner(client.request_public_key_from_server(0), process_num=2)
+      random.shuffle(raw_ids)
+      cli_ids = raw_ids[:2000]
+      try:
+        signed_ids = cli_signer.sign_func(cli_ids, client, 0)
+      finally:
+        cli_signer.close()
+      existence = client.sync_join(signed_ids, 0)
+      self.assertEqual(utils.gather_res(cli_ids, existence), [i for i in cli_ids if i in set(ser_ids)])
+      self.assertTrue(client.finish_join())
+      self.assertEqual([psi_id_map.get(i) for i in data_join_server.get_final_result()[0]],
+                       utils.gather_res(cli_ids, existence))
+    finally:
+      rpc_server.stop(None)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=1)
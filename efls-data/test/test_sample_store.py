@@ -20,7 +20,7 @@ import os
 import time
 import shutil
 
-from xfl.data.store import LevelDbKvStore, DictSampleKvStore
+from xfl.data.store import LevelDbKvStore, DictSampleKvStore, CompactSampleKvStore
 
 def get_dir_size(path):
   total = 0
@@ -85,6 +85,45 @@ class TestSampleStore(unittest.TestCase):
     self.assertEqual(store.exists([b'a',b'd',b'c']), [False, False, False])
     store.clear()
 
+  def test_level_db_store_write_batch(self):
+    store = LevelDbKvStore('/tmp/xfl_test_leveldb_batch', write_batch_size=7)
+    keys = [os.urandom(8) for i in range(100)]
+    for k in keys + keys[:30]:
+      store.put(k, k + b'v')
+    self.assertEqual(store.get(keys[99]), keys[99] + b'v')
+    self.assertEqual(store.size(), 100)
+    self.assertEqual(store.exists(keys[::-1] + [b'x']), [True] * 100 + [False])
+    self.assertEqual(list(iter(store)), sorted(keys))
+    store.clear()
+
+  def test_level_db_store_bulk_load(self):
+    store = LevelDbKvStore('/tmp/xfl_test_leveldb_bulk', write_batch_size=7)
+    keys = sorted(os.urandom(8) for i in range(100))
+    self.assertEqual(store.bulk_load((k, b'v') for k in keys + keys[-1:]), 100)
+    self.assertEqual(store.keys(), keys)
+    self.assertEqual(store.size(), 100)
+    with self.assertRaises(RuntimeError):
+      store.bulk_load([])
+    store.clear()
+    store = LevelDbKvStore('/tmp/xfl_test_leveldb_bulk')
+    with self.assertRaises(ValueError):
+      store.bulk_load([(b'b', b''), (b'a', b'')])
+    store.clear()
+
+  def test_level_db_store_reuse(self):
+    path = '/tmp/xfl_test_leveldb_reuse'
+    store = LevelDbKvStore(path, reuse_existing=True)
+    store.put(b'a', b'1')
+    store.put(b'b', b'2')
+    store.close()
+    store = LevelDbKvStore(path, reuse_existing=True)
+    self.assertEqual(store.size(), 2)
+    store.put(b'b', b'3')
+    store.put(b'c', b'4')
+    self.assertEqual(store.size(), 3)
+    self.assertEqual(store.get(b'b'), b'3')
+    store.clear()
+
   def test_dict_sample_kv_store(self):
     store = DictSampleKvStore()
     store.put(b'a', b'a')
@@ -98,6 +137,48 @@ class TestSampleStore(unittest.TestCase):
     self.assertEqual(store.get(b'a'), b'c')
     store.clear()
 
+  def test_compact_sample_kv_store(self):
+    store = CompactSampleKvStore(capacity=4)
+    self.assertTrue(store.put(b'a', b'a'))
+    store.put(b'b', b'b')
+    store.put(b'c', b'a')
+    self.assertEqual(store.get(b'a'), b'a')
+    self.assertEqual(store.exists([b'a',b'd',b'c']), [True, False, True])
+    self.assertEqual(store.size(), 3)
+    self.assertEqual(store.keys(), [b'a',b'b',b'c'])
+    self.assertFalse(store.put(b'a', b'c'))
+    self.assertEqual(store.get(b'a'), b'c')
+    self.assertIsNone(store.get(b'd'))
+    data = {os.urandom(16): os.urandom(32) for i in range(5000)}
+    data[b''] = b''
+    for k, v in data.items():
+      store.put(k, v)
+    self.assertEqual(store.size(), len(data) + 3)
+    self.assertTrue(all(store.exists(list(data))))
+    self.assertTrue(all(store.get(k) == v for k, v in data.items()))
+    self.assertEqual(list(iter(store)), [b'a',b'b',b'c'] + list(data))
+    store.clear()
+    self.assertEqual(store.size(), 0)
+    self.assertEqual(store.exists([b'a']), [False])
+
+  @unittest.skipUnless(os.environ.get('XFL_TEST_ETCD'), "set XFL_TEST_ETCD=host:port of an etcd server")
+  def test_etcd_sample_kv_store(self):
+    import etcd3
+    from xfl.data.store.etcd_kv_store import EtcdSampleKvStore
+    host, port = os.environ['XFL_TEST_ETCD'].split(':')
+    store = EtcdSampleKvStore(etcd3.client(host=host, port=int(port)), 'xfl_test_etcd', txn_ops=7, page_size=9)
+    store.clear()
+    keys = [os.urandom(8) for i in range(100)]
+    for k in keys + keys[:30]:
+      store.put(k, k + b'v')
+    self.assertEqual(store.get(keys[99]), keys[99] + b'v')
+    self.assertEqual(store.size(), 100)
+    self.assertEqual(store.exists(keys[::-1] + [b'x', keys[0][:4]]), [True] * 100 + [False, False])
+    self.assertEqual(list(iter(store)), sorted(keys))
+    store.clear()
+    self.assertEqual(store.size(), 0)
+    self.assertEqual(store.keys(), [])
+
 #  def test_speed(self):
 #    buf_sizes = [4,16,64,128]
 #    for v in buf_sizes:
@@ -0,0 +1,86 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from xfl.data.tfreecord.tfreecord import RecordReader, RecordWriter, TFRecordFile
+
+
+def write_examples(path, n):
+  writer = RecordWriter()
+  records = []
+  with open(path, 'wb') as f:
+    for i in range(n):
+      example = writer.example(features={'feature': {
+        'example_id': writer.bytes_feature(str(i).encode()),
+        'label': writer.int64_feature(i % 2),
+        'emb': writer.float_feature([float(i)] * (i % 3 + 1))}})
+      records.append(example.SerializeToString())
+      f.write(writer.encode_example(records[-1]))
+  return records
+
+
+class TestTFRecord(unittest.TestCase):
+  def test_tfrecord_file(self):
+    with tempfile.TemporaryDirectory() as d:
+      path = os.path.join(d, 'a.tfrecords')
+      records = write_examples(path, 100)
+      with TFRecordFile(path, check_crc=True) as f:
+        self.assertEqual(len(f), 100)
+        self.assertEqual(list(f), records)
+        self.assertEqual(f[3], records[3])
+        self.assertEqual(f[10:20], records[10:20])
+        self.assertEqual(f.lengths.tolist(), [len(r) for r in records])
+      self.assertEqual(list(RecordReader().read_records(path)), list(RecordReader().read_from_tfrecord(path)))
+
+      with open(path, 'r+b') as f:
+        f.seek(20)
+        f.write(b'\xff')
+      with self.assertRaises(ValueError):
+        list(TFRecordFile(path, check_crc=True))
+      with self.assertWarns(UserWarning):
+        self.assertEqual(len(list(TFRecordFile(path, check_crc=True, skip_error=True))), 100)
+      # without crc check the corrupted payload is returned as is
+      self.assertEqual(len(TFRecordFile(path)), 100)
+
+      with open(path, 'ab') as f:
+        f.write(b'\x01\x02')
+      with self.assertRaises(ValueError):
+        TFRecordFile(path)
+
+      empty = os.path.join(d, 'empty.tfrecords')
+      open(empty, 'wb').close()
+      self.assertEqual(len(TFRecordFile(empty)), 0)
+
+  def test_decode_examples(self):
+    with tempfile.TemporaryDirectory() as d:
+      path = os.path.join(d, 'a.tfrecords')
+      records = write_examples(path, 10)
+      reader = RecordReader()
+      cols = reader.decode_examples(records)
+      self.assertEqual(cols['example_id'], [[str(i).encode()] for i in range(10)])
+      np.testing.assert_array_equal(cols['label'], np.arange(10) % 2)
+      self.assertEqual(cols['label'].dtype, np.int64)
+      for i, v in enumerate(cols['emb']):
+        np.testing.assert_array_equal(v, reader.decode_example(records[i])['emb'])
+      self.assertEqual(list(reader.decode_examples(records, names=['label'])), ['label'])
+
+
+if __name__ == '__main__':
+  unittest.main()
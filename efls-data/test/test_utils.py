@@ -15,7 +15,9 @@
 
 
 import unittest
+import numpy as np
 from xfl.data import utils
+from xfl.data.check_sum import CheckSum
 
 
 class TestUtils(unittest.TestCase):
@@ -28,4 +30,21 @@ class TestUtils(unittest.TestCase):
         existence = [False] * len(ids)
         res = utils.gather_res(ids, existence)
         self.assertEqual(res,[])
+        res = utils.gather_res([1,2,3,4], np.array([True,False,False,True]))
+        self.assertEqual(res,[1,4])
+
+    def test_pack_existence(self):
+        for size in [0, 1, 7, 8, 9, 2048, 2051]:
+            existence = np.random.rand(size) > 0.5
+            bitmap = utils.pack_existence(existence)
+            self.assertEqual(len(bitmap), (size + 7) // 8)
+            self.assertEqual(utils.unpack_existence(bitmap, size).tolist(), existence.tolist())
 
+    def test_check_sum(self):
+        values = [str(i).encode() for i in range(100)]
+        c1 = CheckSum()
+        for v in values:
+            c1.add(v)
+        c2 = CheckSum()
+        c2.add_list(values)
+        self.assertEqual(c1.get_check_sum(), c2.get_check_sum())
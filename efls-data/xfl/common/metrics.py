@@ -0,0 +1,225 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from xfl.common.logger import log
+
+# upper bounds of latency histograms in seconds and of size histograms in ids
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+SIZE_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 65536)
+
+
+def _label_str(label_names, label_values, extra=''):
+  pairs = ['{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+           for n, v in zip(label_names, label_values)]
+  if extra:
+    pairs.append(extra)
+  return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(v):
+  return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric(object):
+  metric_type = None
+
+  def __init__(self, name: str, documentation: str, label_names=()):
+    self.name = name
+    self.documentation = documentation
+    self.label_names = tuple(label_names)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def _key(self, labels: dict) -> tuple:
+    if len(labels) != len(self.label_names):
+      raise ValueError("metric {} expects labels {}, got {}".format(self.name, self.label_names, sorted(labels)))
+    return tuple(str(labels[n]) for n in self.label_names)
+
+  def clear(self):
+    with self._lock:
+      self._values = {}
+
+  def render(self) -> list:
+    lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.metric_type)]
+    with self._lock:
+      items = sorted(self._values.items())
+    for key, value in items:
+      lines.extend(self._render_value(key, value))
+    return lines
+
+  def _render_value(self, key, value) -> list:
+    return ['{}{} {}'.format(self.name, _label_str(self.label_names, key), _format_value(value))]
+
+
+class Counter(_Metric):
+  metric_type = 'counter'
+
+  def inc(self, value=1, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + value
+
+  def get(self, **labels):
+    with self._lock:
+      return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+  metric_type = 'gauge'
+
+  def set(self, value, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = value
+
+  def get(self, **labels):
+    with self._lock:
+      return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+  metric_type = 'histogram'
+
+  def __init__(self, name: str, documentation: str, label_names=(), buckets=LATENCY_BUCKETS):
+    super().__init__(name, documentation, label_names)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value, **labels):
+    key = self._key(labels)
+    i = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      state = self._values.get(key)
+      if state is None:
+        # per bucket counts, the last one for +Inf, then sum and count
+        state = self._values[key] = [[0] * (len(self.buckets) + 1), 0., 0]
+      state[0][i] += 1
+      state[1] += value
+      state[2] += 1
+
+  @contextmanager
+  def time(self, **labels):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, **labels)
+
+  def get_count(self, **labels) -> int:
+    with self._lock:
+      state = self._values.get(self._key(labels))
+      return 0 if state is None else state[2]
+
+  def get_sum(self, **labels) -> float:
+    with self._lock:
+      state = self._values.get(self._key(labels))
+      return 0. if state is None else state[1]
+
+  def _render_value(self, key, value) -> list:
+    counts, total, count = value
+    lines = []
+    cum = 0
+    for bound, c in zip(self.buckets + ('+Inf',), counts):
+      cum += c
+      lines.append('{}_bucket{} {}'.format(
+        self.name, _label_str(self.label_names, key, 'le="{}"'.format(bound)), cum))
+    lines.append('{}_sum{} {}'.format(self.name, _label_str(self.label_names, key), repr(float(total))))
+    lines.append('{}_count{} {}'.format(self.name, _label_str(self.label_names, key), count))
+    return lines
+
+
+class MetricsRegistry(object):
+  '''
+  metrics of a process, rendered in the prometheus text format. Registering an existing name returns
+  the registered metric, so modules may declare the metrics they share.
+  '''
+  def __init__(self):
+    self._metrics = {}
+    self._lock = threading.Lock()
+
+  def _register(self, cls, name, documentation, label_names, **kwargs):
+    with self._lock:
+      metric = self._metrics.get(name)
+      if metric is None:
+        metric = self._metrics[name] = cls(name, documentation, label_names, **kwargs)
+      elif not isinstance(metric, cls) or metric.label_names != tuple(label_names):
+        raise ValueError("metric {} is registered as another {}".format(name, metric.metric_type))
+      return metric
+
+  def counter(self, name: str, documentation: str, label_names=()) -> Counter:
+    return self._register(Counter, name, documentation, label_names)
+
+  def gauge(self, name: str, documentation: str, label_names=()) -> Gauge:
+    return self._register(Gauge, name, documentation, label_names)
+
+  def histogram(self, name: str, documentation: str, label_names=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return self._register(Histogram, name, documentation, label_names, buckets=buckets)
+
+  def clear(self):
+    with self._lock:
+      metrics = list(self._metrics.values())
+    for m in metrics:
+      m.clear()
+
+  def render(self) -> str:
+    with self._lock:
+      metrics = sorted(self._metrics.items())
+    lines = []
+    for _, m in metrics:
+      lines.extend(m.render())
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+  '''
+  serve `registry` at http://0.0.0.0:`port`/metrics from a daemon thread. A port is served once per process,
+  later calls with the same port return the running server.
+  '''
+  with _servers_lock:
+    if port in _servers:
+      return _servers[port]
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+          self.send_error(404)
+          return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-{}'.format(port), daemon=True).start()
+    _servers[server.server_address[1]] = server
+    log.info("Serve metrics at port {}".format(server.server_address[1]))
+    return server
@@ -0,0 +1,96 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import math
+import struct
+
+import mmh3
+import numpy as np
+
+from xfl.data.store.sample_kv_store import SampleKvStore
+
+
+class BloomFilter(object):
+  '''
+  Bloom filter over bytes keys, used by clients to drop ids which surely do not exist
+  in the server bucket before joining them.
+  Bit positions come from the double hashing of `mmh3.hash64`, so both parties get the same
+  filter from the serialized bytes.
+  '''
+  _HEADER = struct.Struct('<QI')
+
+  def __init__(self, capacity: int = 0, error_rate: float = 0.001, bit_num: int = None, hash_num: int = None):
+    capacity = max(capacity, 1)
+    if bit_num is None:
+      bit_num = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    self._bit_num = max(bit_num, 8)
+    if hash_num is None:
+      hash_num = int(round(self._bit_num / capacity * math.log(2)))
+    self._hash_num = max(hash_num, 1)
+    self._bits = np.zeros((self._bit_num + 7) // 8, dtype=np.uint8)
+
+  def _positions(self, keys: list):
+    hashes = np.array([mmh3.hash64(k, signed=False) for k in keys], dtype=np.uint64).reshape(-1, 2)
+    steps = np.arange(self._hash_num, dtype=np.uint64)
+    # uint64 overflow wraps around in the same way on both parties
+    return (hashes[:, 0:1] + steps * hashes[:, 1:2]) % np.uint64(self._bit_num)
+
+  def add_batch(self, keys: list):
+    if len(keys) == 0:
+      return
+    pos = self._positions(keys).ravel()
+    np.bitwise_or.at(self._bits, (pos >> np.uint64(3)).astype(np.int64),
+                     (np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8)))
+
+  def add(self, key: bytes):
+    self.add_batch([key])
+
+  def contains_batch(self, keys: list):
+    '''
+    @return: numpy bool array, False means the key surely does not exist.
+    '''
+    if len(keys) == 0:
+      return np.zeros(0, dtype=np.bool_)
+    pos = self._positions(keys)
+    bits = (self._bits[(pos >> np.uint64(3)).astype(np.int64)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+    return bits.all(axis=1)
+
+  def contains(self, key: bytes) -> bool:
+    return bool(self.contains_batch([key])[0])
+
+  def to_bytes(self) -> bytes:
+    return self._HEADER.pack(self._bit_num, self._hash_num) + self._bits.tobytes()
+
+  @classmethod
+  def from_bytes(cls, data: bytes):
+    bit_num, hash_num = cls._HEADER.unpack_from(data)
+    bf = cls(bit_num=bit_num, hash_num=hash_num)
+    bf._bits = np.frombuffer(data, dtype=np.uint8, offset=cls._HEADER.size).copy()
+    if len(bf._bits) != (bit_num + 7) // 8:
+      raise ValueError('bloom filter size error, expect {} bytes, got {}'.format((bit_num + 7) // 8, len(bf._bits)))
+    return bf
+
+  @classmethod
+  def from_store(cls, store: SampleKvStore, error_rate: float = 0.001, batch_size: int = 65536):
+    bf = cls(capacity=store.size(), error_rate=error_rate)
+    # stores return themselves from `__iter__` and reset the cursor, so they are walked only once here
+    keys = []
+    for k in store:
+      keys.append(k)
+      if len(keys) >= batch_size:
+        bf.add_batch(keys)
+        keys = []
+    bf.add_batch(keys)
+    return bf
@@ -0,0 +1,152 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import json
+import math
+import random
+import struct
+
+import mmh3
+import numpy as np
+
+from xfl.common.logger import log
+from xfl.data.hash_util import get_hash_func, get_bucket_ids
+
+# seed of the hash picking the sub bucket, independent of the hash picking the hash bucket
+SPLIT_HASH_SEED = 0x5bd1e995
+
+
+class BucketPlan(object):
+  '''
+  Maps the hash buckets `hash(id) % hash_bucket_num` to join buckets, hash is picked by `hash_type`. Hash bucket b is split into
+  `split_nums[b]` join buckets picked by a second hash of the id, join buckets of one hash bucket are
+  numbered consecutively. Both parties must use the same plan. Records of one id always go to the same
+  join bucket, so a single hot id can not be split.
+  '''
+  def __init__(self, split_nums: list, bucket_sizes: list = None, hash_type: str = 'murmur3'):
+    assert all(n >= 1 for n in split_nums), "split num should be positive"
+    self._split_nums = list(split_nums)
+    self._hash_type = hash_type
+    self._hash_func = get_hash_func(hash_type)
+    self._offsets = [0] * len(split_nums)
+    for b in range(1, len(split_nums)):
+      self._offsets[b] = self._offsets[b - 1] + self._split_nums[b - 1]
+    self._bucket_sizes = bucket_sizes
+
+  @classmethod
+  def build(cls, bucket_sizes: list, max_bucket_size: int = None, align: int = 1,
+            hash_type: str = 'murmur3') -> 'BucketPlan':
+    '''
+    split the hash buckets larger than `max_bucket_size`, which defaults to the mean bucket size.
+    @param align: buckets keep being split until the number of join buckets is a multiple of it,
+      e.g. `client2multiserver`.
+    '''
+    if max_bucket_size is None:
+      max_bucket_size = max(1, sum(bucket_sizes) // len(bucket_sizes))
+    split_nums = [max(1, math.ceil(s / max_bucket_size)) for s in bucket_sizes]
+    while sum(split_nums) % align:
+      b = max(range(len(split_nums)), key=lambda i: bucket_sizes[i] / split_nums[i])
+      split_nums[b] += 1
+    return cls(split_nums, bucket_sizes, hash_type)
+
+  @property
+  def hash_bucket_num(self) -> int:
+    return len(self._split_nums)
+
+  @property
+  def hash_type(self) -> str:
+    return self._hash_type
+
+  @property
+  def bucket_num(self) -> int:
+    return self._offsets[-1] + self._split_nums[-1]
+
+  def get_bucket(self, key: bytes) -> int:
+    b = self._hash_func(key) % len(self._split_nums)
+    split_num = self._split_nums[b]
+    if split_num == 1:
+      return self._offsets[b]
+    return self._offsets[b] + mmh3.hash(key, SPLIT_HASH_SEED) % split_num
+
+  def to_json(self) -> str:
+    return json.dumps({'split_nums': self._split_nums, 'bucket_sizes': self._bucket_sizes,
+                       'hash_type': self._hash_type})
+
+  @classmethod
+  def from_json(cls, s: str) -> 'BucketPlan':
+    plan = json.loads(s)
+    return cls(plan['split_nums'], plan.get('bucket_sizes'), plan.get('hash_type', 'murmur3'))
+
+  def save(self, path: str):
+    with open(path, 'w') as f:
+      f.write(self.to_json())
+
+  @classmethod
+  def load(cls, path: str) -> 'BucketPlan':
+    with open(path) as f:
+      return cls.from_json(f.read())
+
+  def get_bucket_sizes(self) -> list:
+    return self._bucket_sizes
+
+
+def _tfrecord_sample_ids(path: str, hash_col_name: str, sample_rate: float, rnd: random.Random):
+  # records which are not sampled are skipped by their length header without being read
+  from xfl.data.tfreecord import tfrecords_pb2
+  example = tfrecords_pb2.Example()
+  with open(path, 'rb') as f:
+    while True:
+      header = f.read(12)
+      if len(header) < 12:
+        return
+      length = struct.unpack('<Q', header[:8])[0]
+      if rnd.random() >= sample_rate:
+        f.seek(length + 4, 1)
+        continue
+      example.ParseFromString(f.read(length))
+      f.seek(4, 1)
+      feature = example.features.feature[hash_col_name]
+      if feature.bytes_list.value:
+        yield feature.bytes_list.value[0]
+      elif feature.int64_list.value:
+        yield str(feature.int64_list.value[0]).encode()
+      elif feature.float_list.value:
+        yield str(feature.float_list.value[0]).encode()
+
+
+def _csv_sample_ids(path: str, hash_col_name: str, sample_rate: float, rnd: random.Random):
+  with open(path, 'rb') as f:
+    col = f.readline().rstrip(b'\r\n').split(b',').index(hash_col_name.encode())
+    for line in f:
+      if rnd.random() < sample_rate:
+        yield line.rstrip(b'\r\n').split(b',')[col]
+
+
+def sample_bucket_sizes(files: list, hash_col_name: str, hash_bucket_num: int, inputfile_type: str = 'tfrecord',
+                        sample_rate: float = 0.01, seed: int = 0, hash_type: str = 'murmur3') -> list:
+  '''
+  estimate the number of records of each hash bucket from a random sample of the records in `files`.
+  '''
+  sample_func = _csv_sample_ids if inputfile_type == 'csv' else _tfrecord_sample_ids
+  rnd = random.Random(seed)
+  counts = [0] * hash_bucket_num
+  for path in files:
+    if path.startswith('file://'):
+      path = path[len('file://'):]
+    ids = list(sample_func(path, hash_col_name, sample_rate, rnd))
+    for b, c in zip(*np.unique(get_bucket_ids(ids, hash_bucket_num, hash_type), return_counts=True)):
+      counts[b] += int(c)
+  log.info("Sampled {} records from {} files".format(sum(counts), len(files)))
+  return [int(c / sample_rate) for c in counts]
@@ -33,11 +33,15 @@ class CheckSum(object):
     self._cur = seed
 
   def add(self, value: bytes):
-    self._cur = mmh3.hash(str(self._cur).encode('utf-8') + value)
+    self._cur = mmh3.hash(b'%d' % self._cur + value)
 
   def add_list(self, value: list):
+    # each step depends on the previous one, keep the loop tight instead of calling `add`
+    cur = self._cur
+    hash_func = mmh3.hash
     for i in value:
-      self.add(i)
+      cur = hash_func(b'%d' % cur + i)
+    self._cur = cur
 
   def get_check_sum(self):
     return self._cur
@@ -15,30 +15,38 @@
 
 import os
 import shutil
-import time
-import queue
+import struct
 import random
 import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from functools import cmp_to_key
 
-import mmh3
-
+from xfl.common import metrics
 from xfl.common.common import RunMode
 from xfl.common.logger import log
 from xfl.data import utils
-from xfl.data.check_sum import CheckSum
 from xfl.data.store.sample_kv_store import DictSampleKvStore
 from xfl.data.store.etcd_kv_store import EtcdSampleKvStore
+from xfl.data.hash_util import get_hash_func, get_bucket_ids
 from xfl.data.utils import get_sample_store_key, split_sample_store_key
-from xfl.service.data_join_client import create_data_join_client
-from xfl.data.tfreecord.tfreecord import RecordReader, RecordWriter
+from xfl.service.data_join_client import create_data_join_client, DataJoinChannelPool
+from xfl.data.tfreecord.tfreecord import RecordReader, TFRecordFile
 
 class DefaultKeySelector:
-    def __init__(self, bucket_num: int = 64):
+    def __init__(self, bucket_num: int = 64, hash_type: str = 'murmur3'):
         self._bucket_num = bucket_num
+        self._hash_type = hash_type
+        self._hash_func = get_hash_func(hash_type)
 
     def get_key(self, value):
-        return mmh3.hash(value[0]) % self._bucket_num
+        return self._hash_func(value[0]) % self._bucket_num
+
+    def get_keys(self, keys):
+        """
+        Bucket ids of a batch of hash column values as an array.
+        """
+        return get_bucket_ids(keys, self._bucket_num, self._hash_type)
 
 
 SAMPLE_STORE_TYPE = {
@@ -78,6 +86,94 @@ def get_value_from_example(example, hash_col_name, sort_col_name):
     return getKeyBytes(example.features.feature[hash_col_name]), getKeyBytes(example.features.feature[sort_col_name])
 
 
+BUCKET_PART_SUFFIX = '.part'
+BUCKETIZE_BATCH_SIZE = 65536
+
+
+def bucketize_tf_record_file(filename, file_idx, bucket_path, bucket_num, hash_col_name, hash_type='murmur3'):
+    """
+    Append the framed records of an input file to the part files of their buckets as they are,
+    only the hash column is read from each record. Run in bucketing processes.
+    """
+    key_selector = DefaultKeySelector(bucket_num=bucket_num, hash_type=hash_type)
+    example = RecordReader().example
+    part_files = [None] * bucket_num
+
+    def write_batch(keys, frames):
+        # bucket ids of a batch are computed at once, records keep their input order in each bucket
+        for bucket_id, framed in zip(key_selector.get_keys(keys).tolist(), frames):
+            if part_files[bucket_id] is None:
+                bucket_dir_path = os.path.join(bucket_path, str(bucket_id))
+                os.makedirs(bucket_dir_path, exist_ok=True)
+                part_files[bucket_id] = open(
+                    os.path.join(bucket_dir_path, '{}{}'.format(file_idx, BUCKET_PART_SUFFIX)), 'wb',
+                    buffering=1 << 20)
+            part_files[bucket_id].write(framed)
+
+    try:
+        with TFRecordFile(filename, check_crc=True) as records:
+            keys, frames = [], []
+            for record, framed in records.iter_framed():
+                example.ParseFromString(record)
+                keys.append(getKeyBytes(example.features.feature[hash_col_name]))
+                frames.append(framed)
+                if len(keys) >= BUCKETIZE_BATCH_SIZE:
+                    write_batch(keys, frames)
+                    keys, frames = [], []
+            write_batch(keys, frames)
+    finally:
+        for f in part_files:
+            if f is not None:
+                f.close()
+
+
+def concat_bucket_parts(bucket_dir_path, file_name):
+    """
+    Concatenate the part files of a bucket in input file order and remove them.
+    """
+    os.makedirs(bucket_dir_path, exist_ok=True)
+    parts = sorted((f for f in os.listdir(bucket_dir_path) if f.endswith(BUCKET_PART_SUFFIX)),
+                   key=lambda f: int(f[:-len(BUCKET_PART_SUFFIX)]))
+    with open(os.path.join(bucket_dir_path, file_name), 'ab') as out:
+        for part in parts:
+            part_path = os.path.join(bucket_dir_path, part)
+            with open(part_path, 'rb') as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+            os.remove(part_path)
+
+
+class BucketMemoryBudget(object):
+    """
+    Bytes of bucket data held in memory by the join workers. A worker waits until its bucket fits in
+    the budget, a bucket larger than the whole budget is joined alone.
+    """
+    def __init__(self, budget: int = 0):
+        self._budget = budget
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int):
+        if self._budget <= 0:
+            return
+        with self._cond:
+            self._cond.wait_for(lambda: self._used == 0 or self._used + size <= self._budget)
+            self._used += size
+
+    def release(self, size: int):
+        if self._budget <= 0:
+            return
+        with self._cond:
+            self._used -= size
+            self._cond.notify_all()
+
+
+def get_dir_size(path):
+    return sum(os.path.getsize(os.path.join(now_path, f)) for now_path, subfolder, files in os.walk(path) for f in files)
+
+
+_RECORD_REF = struct.Struct('<IQ')
+
+
 class ClientSortJoinFunc_local(object):
     def __init__(
             self,
@@ -95,7 +191,10 @@ class ClientSortJoinFunc_local(object):
             output_bucket_file='',
             bucket_id=0,
             hash_col_name='',
-            sort_col_name=''):
+            sort_col_name='',
+            inputfile_type='tfrecord',
+            channel_pool: DataJoinChannelPool = None,
+            max_in_flight: int = 0):
         self._job_name = job_name
         self._bucket_num = bucket_num
         self._state = None
@@ -113,6 +212,9 @@ class ClientSortJoinFunc_local(object):
         self._bucket_id = bucket_id
         self._hash_col_name = hash_col_name
         self._sort_col_name = sort_col_name
+        self._inputfile_type = inputfile_type
+        self._channel_pool = channel_pool
+        self._max_in_flight = max_in_flight
 
         if self._sample_store_cls is DictSampleKvStore:
             self._sample_store = DictSampleKvStore()
@@ -122,22 +224,55 @@ class ClientSortJoinFunc_local(object):
         self.cnt = 0
 
     def data_join_client_bucket_file(self, bucket_dir_path):
-        tf_reader = RecordReader()
-        tf_writer = RecordWriter()
-        for now_path, subfolder, files in os.walk(bucket_dir_path):
-            for filename in files:
-                bucket_file_path = os.path.join(now_path, filename)
-                raw_dataset = tf_reader.read_from_tfrecord(bucket_file_path)
-
-                for raw_record in raw_dataset:
-                    example = tf_reader.example
-                    example.ParseFromString(raw_record)
-                    value0, value1 = get_value_from_example(example, self._hash_col_name, self._sort_col_name)
-                    value = (value0, value1, raw_record)
-                    self._sample_store.put(get_sample_store_key(value[0], value[1]), value[2])
-                    self.cnt += 1
-
-        log.info("")
+        example = RecordReader().example
+        # the store keeps (file, record) refs, joined records are copied framed out of the bucket file maps
+        # batch by batch, the records themselves are never held in memory
+        bucket_files = []
+        try:
+            for now_path, subfolder, files in os.walk(bucket_dir_path):
+                for filename in files:
+                    # bucket files are written by this job, their CRCs are not checked again
+                    records = TFRecordFile(os.path.join(now_path, filename), check_crc=False)
+                    bucket_files.append(records)
+                    for record_idx, raw_record in enumerate(records):
+                        example.ParseFromString(raw_record)
+                        value0, value1 = get_value_from_example(example, self._hash_col_name, self._sort_col_name)
+                        self._sample_store.put(get_sample_store_key(value0, value1),
+                                               _RECORD_REF.pack(len(bucket_files) - 1, record_idx))
+                        self.cnt += 1
+
+            for res_ids in self._iter_join():
+                for i in res_ids:
+                    file_idx, record_idx = _RECORD_REF.unpack(self._sample_store.get(i))
+                    self._output_bucket_file.write(bucket_files[file_idx].get_framed(record_idx))
+        finally:
+            for records in bucket_files:
+                records.close()
+
+    def data_join_client_bucket_parquet(self, bucket_dir_path, output_file_path):
+        from xfl.data.parquet_io import ParquetBucketTable
+        table = ParquetBucketTable(bucket_dir_path, self._hash_col_name, self._sort_col_name)
+        # the store keeps row indices, joined rows are taken from the table column-wise
+        for key, row in table.iter_keys():
+            self._sample_store.put(key, row.to_bytes(8, 'little'))
+            self.cnt += 1
+        writer = None
+        try:
+            for res_ids in self._iter_join():
+                if not res_ids:
+                    continue
+                if writer is None:
+                    writer = table.open_writer(output_file_path)
+                writer.write_table(table.take([int.from_bytes(self._sample_store.get(i), 'little') for i in res_ids]))
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _iter_join(self):
+        '''
+        join all keys in sample store with server in sorted order, then clear the store.
+        @return: generator of joined id batches.
+        '''
         keys_to_join = sorted(self._sample_store.keys(), key=cmp_to_key(self._cmp_func))
         if self._run_mode == RunMode.K8S:
             if self._tls_crt is None or len(self._tls_crt) == 0:
@@ -151,25 +286,24 @@ class ClientSortJoinFunc_local(object):
                                          job_name=self._job_name,
                                          bucket_id=self._bucket_id,
                                          run_mode=self._run_mode,
-                                         tls_crt=self._tls_crt)
-        check_sum = CheckSum()
+                                         tls_crt=self._tls_crt,
+                                         client2multiserver=1,
+                                         channel=self._channel_pool.get(client_port) if self._channel_pool else None)
         client.wait_ready(timeout=self._wait_s)
         log.info(
             "Client begin to join, bucket id:{}, all size:{}, unique size:{}".format(self._bucket_id, self.cnt,
                                                                                      len(keys_to_join)))
+        batches = (keys_to_join[i:i + self._batch_size] for i in range(0, len(keys_to_join), self._batch_size))
+        if self._max_in_flight > 0:
+            joined = client.stream_join(batches, self._bucket_id, max_in_flight=self._max_in_flight)
+        else:
+            joined = ((request_ids, client.sync_join(request_ids, self._bucket_id)) for request_ids in batches)
         cur = 0
-        while cur < len(keys_to_join):
-            end = min(cur + self._batch_size, len(keys_to_join))
-            request_ids = keys_to_join[cur:end]
-            existence = client.sync_join(request_ids)
-            res_ids = utils.gather_res(request_ids, existence=existence)
-            check_sum.add_list(res_ids)
-            cur = end
-            for i in res_ids:
-                self._output_bucket_file.write(tf_writer.encode_example(self._sample_store.get(i)))
+        for request_ids, existence in joined:
+            cur += len(request_ids)
+            yield utils.gather_res(request_ids, existence=existence)
             log.info("client sync join current idx: {}, all: {}".format(cur, len(keys_to_join)))
-        log.info("End join, checkSum:{}".format(check_sum.get_check_sum()))
-        res = client.finish_join(check_sum.get_check_sum())
+        res = client.finish_join()
         self._sample_store.clear()
         if not res:
             raise ValueError("Join finish error")
@@ -198,7 +332,35 @@ class data_join_pipeline_local_no_tf(object):
                  use_psi: bool = False,
                  need_sort: bool = False,
                  inputfile_type: str = 'tfrecord',
-                 conf: dict = {}):
+                 conf: dict = {},
+                 bucketing_process_num: int = 0,
+                 join_worker_num: int = 0,
+                 join_memory_budget_mb: int = 0,
+                 channels_per_address: int = 1,
+                 hash_type: str = 'murmur3',
+                 metrics_port: int = 0,
+                 client2multiserver: int = 1,
+                 max_in_flight: int = 0,
+                 use_bloom_filter: bool = False,
+                 use_async_join: bool = False,
+                 incremental: bool = False,
+                 bucket_plan_path: str = None):
+        if inputfile_type not in ('tfrecord', 'parquet'):
+            raise RuntimeError('local client does not support input file type {}'.format(inputfile_type))
+        # options changing how ids are bucketed or joined are rejected rather than ignored
+        if use_psi:
+            raise RuntimeError('local client does not support psi join')
+        if client2multiserver != 1:
+            raise RuntimeError('local client does not support client2multiserver {}'.format(client2multiserver))
+        if bucket_plan_path is not None:
+            raise RuntimeError('local client does not support bucket plan {}'.format(bucket_plan_path))
+        if incremental:
+            raise RuntimeError('local client does not support incremental join')
+        if use_bloom_filter:
+            raise RuntimeError('local client does not support bloom filter')
+        if use_async_join:
+            raise RuntimeError('local client does not support async join')
+        self._inputfile_type = inputfile_type
         self._input_path = input_path
         self._output_path = output_path
         self._job_name = job_name
@@ -215,15 +377,15 @@ class data_join_pipeline_local_no_tf(object):
         self._sort_col_name = sort_col_name
         self._wait_s = wait_s
         self._bucket_path = os.path.join(self._output_path, 'tmp_bucket')
-        self._DefaultKeySelector = DefaultKeySelector(bucket_num=bucket_num)
+        self._hash_type = hash_type
+        self._DefaultKeySelector = DefaultKeySelector(bucket_num=bucket_num, hash_type=hash_type)
 
-        self._data_to_bucket_threads_num = self._bucket_num
-        self._data_to_bucket_file_list_sum = []
-        self._data_to_bucket_file_name = "{}_{}.tfrecords"
-        self._data_to_bucket_threads_queue = queue.Queue()
-        self._data_to_bucket_threads_data_buffer = []
-        self._data_to_bucket_now_threads = []
-        self._data_to_bucket_batch_size = batch_size
+        self._bucketing_process_num = bucketing_process_num or os.cpu_count()
+        self._join_worker_num = join_worker_num or os.cpu_count()
+        self._memory_budget = BucketMemoryBudget(join_memory_budget_mb << 20)
+        self._channels_per_address = channels_per_address
+        self._metrics_port = metrics_port
+        self._max_in_flight = max_in_flight
 
         tls_crt = b''
         if tls_crt_path is not None:
@@ -232,94 +394,40 @@ class data_join_pipeline_local_no_tf(object):
                 log.info("tls path:{} \n tls value:{}".format(tls_crt_path, tls_crt))
         self._tls_crt = tls_crt
 
-    def read_buffer_data_to_bucket(self, thread_id):
-        tf_reader = RecordReader()
-        tf_writer = RecordWriter()
-        for raw_record in self._data_to_bucket_threads_data_buffer[thread_id]:
-            example = tf_reader.example
-            example.ParseFromString(raw_record)
-            value0, value1 = get_value_from_example(example, self._hash_col_name, self._sort_col_name)
-            value = (value0, value1, raw_record)
-            bucket_id = self._DefaultKeySelector.get_key(value)
-            self._data_to_bucket_file_list_sum[thread_id][bucket_id].write(tf_writer.encode_example(example.SerializeToString()))
-        self._data_to_bucket_threads_data_buffer[thread_id].clear()
-        self._data_to_bucket_now_threads[thread_id] = None
-        self._data_to_bucket_threads_queue.put(thread_id)
-
     def read_tf_record_data_to_bucket(self):
-        # Multithreading preparation
-        if not os.path.exists(self._bucket_path):
-            os.makedirs(self._bucket_path)
-        for worker in range(self._data_to_bucket_threads_num):
-            _data_to_bucket_file_list = []
-            for i in range(self._bucket_num):
-                bucket_dir_path = os.path.join(self._bucket_path, str(i))
-                if not os.path.exists(bucket_dir_path):
-                    os.makedirs(bucket_dir_path)
-                bucket_file_path = os.path.join(bucket_dir_path, self._data_to_bucket_file_name.format(i, worker))
-                bucket_file = open(bucket_file_path, 'ab')
-                _data_to_bucket_file_list.append(bucket_file)
-            self._data_to_bucket_file_list_sum.append(_data_to_bucket_file_list)
-            self._data_to_bucket_threads_queue.put(worker)
-            self._data_to_bucket_threads_data_buffer.append([])
-            self._data_to_bucket_now_threads.append(None)
-
-        now_thread = None
-        tf_reader = RecordReader()
-        for now_path, subfolder, files in os.walk(self._input_path):
-            for _file in files:
-                filename = os.path.join(now_path, _file)
-                raw_dataset_tmp = tf_reader.read_from_tfrecord(filename)
-                raw_dataset = []
-                for raw_record in raw_dataset_tmp:
-                    raw_dataset.append(raw_record)
-
-                size_data = len(raw_dataset)
-                now_whe = 0
-
-                while True:
-                    if now_thread is None:
-                        if self._data_to_bucket_threads_queue.empty():
-                            time.sleep(1)
-                            continue
-                        now_thread = self._data_to_bucket_threads_queue.get()
-                    if len(self._data_to_bucket_threads_data_buffer[now_thread]) + size_data - now_whe \
-                            < self._data_to_bucket_batch_size:
-                        self._data_to_bucket_threads_data_buffer[now_thread] += raw_dataset[now_whe:]
-                        break
-                    elif len(self._data_to_bucket_threads_data_buffer[now_thread]) + size_data - now_whe \
-                            < 2 * self._data_to_bucket_batch_size:
-                        self._data_to_bucket_threads_data_buffer[now_thread] += raw_dataset[now_whe:]
-                        thread_worker = threading.Thread(target=self.read_buffer_data_to_bucket, args=(now_thread,))
-                        self._data_to_bucket_now_threads[now_thread] = thread_worker
-                        thread_worker.start()
-                        now_thread = None
-                        break
-                    else:
-                        empty_size = self._data_to_bucket_batch_size - \
-                                     len(self._data_to_bucket_threads_data_buffer[now_thread])
-                        self._data_to_bucket_threads_data_buffer[now_thread] += \
-                            raw_dataset[now_whe:now_whe + empty_size]
-                        thread_worker = threading.Thread(target=self.read_buffer_data_to_bucket, args=(now_thread,))
-                        self._data_to_bucket_now_threads[now_thread] = thread_worker
-                        thread_worker.start()
-                        now_whe += empty_size
-                        now_thread = None
-
-        for thread_worker in self._data_to_bucket_now_threads:
-            if thread_worker is not None:
-                thread_worker.join()
-        for _data_to_bucket_file_list in self._data_to_bucket_file_list_sum:
-            for bucket_file in _data_to_bucket_file_list:
-                bucket_file.close()
-
-    def worker_for_data_join_bucket(self, bucket_id):
+        # input files are sharded to processes, each file is bucketized into its own part files
+        input_files = sorted(os.path.join(now_path, _file)
+                             for now_path, subfolder, files in os.walk(self._input_path) for _file in files)
+        with multiprocessing.get_context('spawn').Pool(self._bucketing_process_num) as pool:
+            pool.starmap(bucketize_tf_record_file,
+                         [(filename, file_idx, self._bucket_path, self._bucket_num, self._hash_col_name,
+                           self._hash_type)
+                          for file_idx, filename in enumerate(input_files)],
+                         chunksize=1)
+            pool.starmap(concat_bucket_parts,
+                         [(os.path.join(self._bucket_path, str(i)), '{}.tfrecords'.format(i))
+                          for i in range(self._bucket_num)])
+
+    def read_parquet_data_to_bucket(self):
+        from xfl.data.parquet_io import ParquetBucketWriter, list_parquet_files
+        writer = ParquetBucketWriter(self._bucket_path, self._bucket_num, 'part.parquet')
+        try:
+            for filename in list_parquet_files(self._input_path):
+                writer.write_file(filename, self._hash_col_name, self._DefaultKeySelector)
+        finally:
+            writer.close()
+
+    def worker_for_data_join_bucket(self, bucket_id, channel_pool=None):
         bucket_dir_path = os.path.join(self._bucket_path, str(bucket_id))
         output_bucket_dir_path = os.path.join(self._output_path, str(bucket_id))
         if not os.path.exists(output_bucket_dir_path):
             os.makedirs(output_bucket_dir_path)
-        output_bucket_file_path = os.path.join(output_bucket_dir_path, str(bucket_id) + '.tfrecords')
-        output_bucket_file = open(output_bucket_file_path, 'ab')
+        if self._inputfile_type == 'parquet':
+            output_bucket_file_path = os.path.join(output_bucket_dir_path, str(bucket_id) + '.parquet')
+            output_bucket_file = None
+        else:
+            output_bucket_file_path = os.path.join(output_bucket_dir_path, str(bucket_id) + '.tfrecords')
+            output_bucket_file = open(output_bucket_file_path, 'ab')
         tmp_client = ClientSortJoinFunc_local(
             job_name=self._job_name,
             peer_host=self._peer_host,
@@ -334,24 +442,53 @@ class data_join_pipeline_local_no_tf(object):
             output_bucket_file=output_bucket_file,
             bucket_id=bucket_id,
             hash_col_name=self._hash_col_name,
-            sort_col_name=self._sort_col_name)
-        tmp_client.data_join_client_bucket_file(bucket_dir_path)
-        output_bucket_file.close()
+            sort_col_name=self._sort_col_name,
+            inputfile_type=self._inputfile_type,
+            channel_pool=channel_pool,
+            max_in_flight=self._max_in_flight)
+        if self._inputfile_type == 'parquet':
+            tmp_client.data_join_client_bucket_parquet(bucket_dir_path, output_bucket_file_path)
+        else:
+            tmp_client.data_join_client_bucket_file(bucket_dir_path)
+            output_bucket_file.close()
+
+    def _budgeted_worker(self, bucket_id, channel_pool):
+        # the on-disk size of a bucket is taken as the memory it needs while being joined
+        size = get_dir_size(os.path.join(self._bucket_path, str(bucket_id)))
+        self._memory_budget.acquire(size)
+        try:
+            self.worker_for_data_join_bucket(bucket_id, channel_pool)
+        finally:
+            self._memory_budget.release(size)
 
     def data_join_client_workers(self):
-        threads_list = []
-        for i in range(self._bucket_num):
-            thread_worker = threading.Thread(target=self.worker_for_data_join_bucket, args=(i,))
-            threads_list.append(thread_worker)
-            thread_worker.start()
-
-        for thread_worker in threads_list:
-            thread_worker.join()
+        # buckets are joined by a bounded pool of workers sharing grpc channels, a server address is
+        # multiplexed by the servicename metadata of each bucket
+        channel_pool = DataJoinChannelPool(self._peer_host, self._peer_ip, self._run_mode, self._tls_crt,
+                                           channels_per_address=self._channels_per_address)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self._join_worker_num, self._bucket_num))) as executor:
+                futures = [executor.submit(self._budgeted_worker, i, channel_pool) for i in range(self._bucket_num)]
+                for bucket_id, future in enumerate(futures):
+                    try:
+                        future.result()
+                    except Exception:
+                        log.error("Join worker of bucket {} failed".format(bucket_id))
+                        for f in futures:
+                            f.cancel()
+                        raise
+        finally:
+            channel_pool.close()
 
         shutil.rmtree(self._bucket_path)
 
     def run(self):
-        self.read_tf_record_data_to_bucket()
+        if self._metrics_port:
+            metrics.start_metrics_server(self._metrics_port)
+        if self._inputfile_type == 'parquet':
+            self.read_parquet_data_to_bucket()
+        else:
+            self.read_tf_record_data_to_bucket()
 
         self.data_join_client_workers()
         return "Program execution finished"
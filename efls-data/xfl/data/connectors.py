@@ -14,7 +14,8 @@
 # ==============================================================================
 
 from pyflink.common.serialization import Encoder
-from pyflink.datastream.connectors import FileSource, StreamFormat, FileSink, BucketAssigner, RollingPolicy
+from pyflink.datastream.connectors import FileSource, StreamFormat, FileSink, BucketAssigner, RollingPolicy, \
+  OutputFileConfig
 from pyflink.java_gateway import get_gateway
 
 
@@ -55,12 +56,14 @@ def tf_record_source(input_path: str):
     .build()
 
 
-def input_keyed_source(input_path: str, hash_col_name, sort_col_name, inputfile_type):
+def input_keyed_source(input_path, hash_col_name, sort_col_name, inputfile_type):
+  # input_path is a dir or file path, or a list of them
+  input_paths = [input_path] if isinstance(input_path, str) else input_path
   if inputfile_type == 'csv':
-    return FileSource.for_record_stream_format(csv_keyed_stream_format(hash_col_name, sort_col_name), input_path) \
+    return FileSource.for_record_stream_format(csv_keyed_stream_format(hash_col_name, sort_col_name), *input_paths) \
       .build()
   else :
-    return FileSource.for_record_stream_format(tf_record_keyed_stream_format(hash_col_name, sort_col_name), input_path) \
+    return FileSource.for_record_stream_format(tf_record_keyed_stream_format(hash_col_name, sort_col_name), *input_paths) \
       .build()
 
 
@@ -88,14 +91,15 @@ def tf_record_file_sink_rolling_policy(row_number_per_file: int):
   return RollingPolicy(j_rolling_policy)
 
 
-def input_sink(output_path: str, bucket_col_idx: int, value_col_idx: int, part_size=64, inputfile_type='tfrecord'):
+def input_sink(output_path: str, bucket_col_idx: int, value_col_idx: int, part_size=64, inputfile_type='tfrecord',
+               part_prefix: str = None):
   if inputfile_type == 'tfrecord':
-    return FileSink.for_row_format(output_path, tf_record_sink_encoder(value_col_idx)) \
-      .with_bucket_assigner(tf_record_bucket_assigner(bucket_col_idx)) \
-      .with_rolling_policy(tf_record_file_sink_rolling_policy(part_size)) \
-      .build()
+    builder = FileSink.for_row_format(output_path, tf_record_sink_encoder(value_col_idx))
   else:
-   return FileSink.for_row_format(output_path, csv_sink_encoder(value_col_idx)) \
-      .with_bucket_assigner(tf_record_bucket_assigner(bucket_col_idx)) \
-      .with_rolling_policy(tf_record_file_sink_rolling_policy(part_size)) \
-      .build()
\ No newline at end of file
+    builder = FileSink.for_row_format(output_path, csv_sink_encoder(value_col_idx))
+  builder = builder.with_bucket_assigner(tf_record_bucket_assigner(bucket_col_idx)) \
+    .with_rolling_policy(tf_record_file_sink_rolling_policy(part_size))
+  if part_prefix is not None:
+    # parts of different runs are written next to each other in the same bucket dir
+    builder = builder.with_output_file_config(OutputFileConfig.builder().with_part_prefix(part_prefix).build())
+  return builder.build()
@@ -15,6 +15,8 @@
 
 import uuid
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from pyflink.common.typeinfo import Types
 from pyflink.datastream.functions import RuntimeContext
@@ -22,8 +24,11 @@ from pyflink.datastream.state import ValueStateDescriptor
 
 from xfl.common.common import RunMode
 from xfl.data import utils
-from xfl.data.store import DictSampleKvStore, LevelDbKvStore
-from xfl.data.functions import ClientJoinFunc,ServerSortJoinFunc, record_cmp, get_local_bucket_id
+from xfl.data.store import DictSampleKvStore, LevelDbKvStore, CompactSampleKvStore
+from xfl.data.bucket_plan import BucketPlan
+from xfl.data.hash_util import get_hash_func
+from xfl.data.functions import ClientJoinFunc,ServerSortJoinFunc, record_cmp, iter_joined_samples, \
+  start_subtask_metrics_server
 from xfl.data.psi.ecc_signer import EccSigner
 from xfl.common.logger import log
 from xfl.service import create_data_join_client, create_data_join_server
@@ -45,7 +50,19 @@ class ClientEcdhJoinFunc(ClientJoinFunc):
       client2multiserver: int = 1,
       inputfile_type: str = 'tfrecord',
       run_mode: RunMode = RunMode.LOCAL,
-      db_root_path='/tmp'):
+      db_root_path='/tmp',
+      max_in_flight: int = 0,
+      use_bloom_filter: bool = False,
+      use_async_join: bool = False,
+      psi_process_num: int = 1,
+      bucket_plan: BucketPlan = None,
+      hash_type: str = 'murmur3',
+      metrics_port: int = 0,
+      **kwargs):
+    if use_bloom_filter:
+      raise RuntimeError("bloom filter is not supported in ecdh psi join")
+    if use_async_join:
+      raise RuntimeError("async join is not supported in ecdh psi join")
     self._job_name = job_name
     self._bucket_num = bucket_num
     self._state = None
@@ -62,10 +79,17 @@ class ClientEcdhJoinFunc(ClientJoinFunc):
     self._initial_bucket = None
     self._client2multiserver = client2multiserver
     self._request_buf = [{} for i in range(self._client2multiserver)]
+    self._psi_process_num = psi_process_num
+    # number of server blocks being fetched, signed and uploaded at the same time
+    self._max_in_flight = max_in_flight
+    self._bucket_plan = bucket_plan
+    self._hash_func = get_hash_func(hash_type)
+    self._metrics_port = metrics_port
+    self._signer = None
 
   def open(self, runtime_context: RuntimeContext):
     log.info("EcdhPsi Client Init...")
-    self._signer = EccSigner()
+    self._signer = EccSigner(process_num=self._psi_process_num)
     self._state = runtime_context.get_state(ValueStateDescriptor(
       "last_modified_time", Types.LONG()))
 
@@ -73,6 +97,7 @@ class ClientEcdhJoinFunc(ClientJoinFunc):
     #In c2ms mode, each client is corresponding to  #client2multiserver servers.
     #The matching rule: No. 0 client corresponds to No. 0,1,2...#{client2multiserver-1} server.
     self._initial_bucket = self._subtask_index * self._client2multiserver
+    start_subtask_metrics_server(self._metrics_port, runtime_context)
     if self._run_mode == RunMode.K8S:
       if self._tls_crt is None or len(self._tls_crt) == 0:
         raise RuntimeError("tls crt should not be empty in k8s mode client job!")
@@ -85,29 +110,73 @@ class ClientEcdhJoinFunc(ClientJoinFunc):
                                      run_mode=self._run_mode,
                                      tls_crt=self._tls_crt,
                                      client2multiserver=self._client2multiserver)
-    for i in range(self._client2multiserver):
-      cur_bucket_id = self._initial_bucket + i
-      log.info("Step1: begin to sign server data for bucket %d."%cur_bucket_id)
-      log.info("Client begin to wait... monitered ip %s, port %s, bucket %d"%(self._peer_ip, self._peer_port, cur_bucket_id))
-      self._client.wait_ready(timeout=self._wait_s)
-      log.info("Server ready bucket %d"%cur_bucket_id)
-      batch_cnt = 0
-      item_cnt = 0
-      while True:
-        finished, real_batch_size, block_id, data = self._client.acquire_server_data(bucket_id=cur_bucket_id)
-        if finished:
-          break
-        batch_cnt += 1
-        item_cnt += real_batch_size
-        if batch_cnt % 100 == 0:
-          log.info("Sign server data %d batches."%batch_cnt)
-        signed_data = [self._signer.sign(i) for i in data]
-        send_ok = self._client.send_server_signed_data(signed_data, block_id, bucket_id=cur_bucket_id)
-        #assert send_ok is True
-      log.info("Step1: Sign server data ok for bucket %d! total server data item num: %d"%(cur_bucket_id, item_cnt))
-    log.info("Step2: Begin to join data..")
+    # server data is signed in background while process_element buffers and signs client data,
+    # joining starts after it since server answers NOT_READY before all its data is signed.
+    self._sign_executor = ThreadPoolExecutor(max_workers=1)
+    self._sign_phase = self._sign_executor.submit(self._sign_all_server_data)
+    # client batches signed before the server data, joined in order once it is signed
+    self._pending_batches = deque()
     self.cnt_time = 0
 
+  def _sign_server_blocks(self, bucket_id):
+    item_cnt = 0
+    while True:
+      finished, real_batch_size, block_id, data = self._client.acquire_server_data(bucket_id=bucket_id)
+      if finished:
+        return item_cnt
+      self._client.send_server_signed_data(self._signer.sign_batch(data), block_id, bucket_id=bucket_id)
+      item_cnt += real_batch_size
+
+  def _sign_all_server_data(self):
+    log.info("Client begin to wait... monitered ip %s, port %s"%(self._peer_ip, self._peer_port))
+    self._client.wait_ready(timeout=self._wait_s)
+    workers = max(1, self._max_in_flight)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      for i in range(self._client2multiserver):
+        cur_bucket_id = self._initial_bucket + i
+        log.info("Step1: begin to sign server data for bucket %d."%cur_bucket_id)
+        # each worker keeps one block outstanding, fetching, signing and uploading of them overlap
+        futures = [pool.submit(self._sign_server_blocks, cur_bucket_id) for _ in range(workers)]
+        item_cnt = sum(f.result() for f in futures)
+        log.info("Step1: Sign server data ok for bucket %d! total server data item num: %d"%(cur_bucket_id, item_cnt))
+    log.info("Step2: Begin to join data..")
+
+  def _wait_server_data_signed(self):
+    if self._sign_phase is not None:
+      self._sign_phase.result()
+      self._sign_executor.shutdown()
+      self._sign_phase = None
+
+  def _join_batch(self, now_bucket_id, request_ids, signed_request_ids, samples):
+    existence = self._client.sync_join(signed_request_ids, now_bucket_id)
+    for i in utils.gather_res(request_ids, existence=existence):
+      if self._inputfile_type == 'tfrecord':
+        yield str(now_bucket_id), samples.get(i)
+      else :
+        yield str(now_bucket_id), samples.get(i).decode() + '\n'
+
+  def _flush_request_buf(self, bucket_id):
+    #for ecdh request_ids from client should be singed first
+    now_bucket_id = self._initial_bucket + bucket_id
+    samples = self._request_buf[bucket_id]
+    request_ids = list(samples.keys())
+    self._request_buf[bucket_id] = {}
+    batch = (now_bucket_id, request_ids, self._signer.sign_hash_batch(request_ids), samples)
+    if (self._sign_phase is not None and not self._sign_phase.done()
+        and len(self._pending_batches) < max(1, self._max_in_flight)):
+      # server data is still being signed, the signed batch is kept until joining can start,
+      # at most max_in_flight batches are kept, then it waits for server data to be signed
+      self._pending_batches.append(batch)
+      return
+    self._wait_server_data_signed()
+    yield from self._join_pending_batches()
+    yield from self._join_batch(*batch)
+    log.info("client sync join bucket {} current idx: {}".format(now_bucket_id, self.cnt[bucket_id]))
+
+  def _join_pending_batches(self):
+    while self._pending_batches:
+      yield from self._join_batch(*self._pending_batches.popleft())
+
   def process_element(self, value, ctx: 'ProcessFunction.Context'):
     if self.cnt_time % 1000 == 0:
       s = self._state.value()
@@ -117,47 +186,30 @@ class ClientEcdhJoinFunc(ClientJoinFunc):
         ctx.timer_service().register_event_time_timer(cur + self._delay)
     self.cnt_time += 1
     assert(ctx.get_current_key() == self._subtask_index)
-    bucket_id = get_local_bucket_id(value[0], self._client2multiserver)
+    bucket_id = self._local_bucket_id(value[0])
     self.cnt[bucket_id] += 1
     id_key = get_sample_store_key(value[0], value[1])
     self._request_buf[bucket_id][id_key] = value[2]
     if len(self._request_buf[bucket_id]) >= self._batch_size:
-      #for ecdh request_ids from client should be singed first
-      now_bucket_id = self._initial_bucket + bucket_id
-      request_ids = list(self._request_buf[bucket_id].keys())
-      signed_request_ids = [self._signer.sign_hash(x) for x in request_ids]
-      existence = self._client.sync_join(signed_request_ids, now_bucket_id)
-      res_ids = utils.gather_res(request_ids, existence=existence)
-      for i in res_ids:
-        if self._inputfile_type == 'tfrecord':
-          yield str(now_bucket_id), self._request_buf[bucket_id].get(i)
-        else :
-          yield str(now_bucket_id), self._request_buf[bucket_id].get(i).decode() + '\n'
-      log.info("client sync join bucket {} current idx: {}".format(now_bucket_id, self.cnt[bucket_id]))
-      self._request_buf[bucket_id].clear()
+      yield from self._flush_request_buf(bucket_id)
 
   def on_timer(self, timestamp: int, ctx: 'KeyedProcessFunction.OnTimerContext'):
     s = self._state.value()
     if timestamp >= s + self._delay:
+      self._wait_server_data_signed()
+      yield from self._join_pending_batches()
       #flush buffer
       for bucket_id in range(self._client2multiserver):
         if self._request_buf[bucket_id]:
-          #for ecdh request_ids from client should be singed first
-          now_bucket_id = self._initial_bucket + bucket_id
-          request_ids = list(self._request_buf[bucket_id].keys())
-          signed_request_ids = [self._signer.sign_hash(x) for x in request_ids]
-          existence = self._client.sync_join(signed_request_ids, now_bucket_id)
-          res_ids = utils.gather_res(request_ids, existence=existence)
-          for i in res_ids:
-            if self._inputfile_type == 'tfrecord':
-              yield str(now_bucket_id), self._request_buf[bucket_id].get(i)
-            else :
-              yield str(now_bucket_id), self._request_buf[bucket_id].get(i).decode() + '\n'
-        self._request_buf[bucket_id].clear()
+          yield from self._flush_request_buf(bucket_id)
       res = self._client.finish_join()
       if not res:
         raise ValueError("Join finish with error")
 
+  def close(self):
+    if self._signer is not None:
+      self._signer.close()
+
 class ServerEcdhJoinFunc(ServerSortJoinFunc):
   def __init__(
           self,
@@ -171,6 +223,9 @@ class ServerEcdhJoinFunc(ServerSortJoinFunc):
           inputfile_type: str = 'tfrecord',
           run_mode: RunMode = RunMode.LOCAL,
           db_root_path: str = '/tmp',
+          psi_process_num: int = 1,
+          metrics_port: int = 0,
+          sort_run_bytes: int = 64 << 20,
           **kwargs):
     super().__init__(job_name=job_name,
         port=port,
@@ -181,14 +236,19 @@ class ServerEcdhJoinFunc(ServerSortJoinFunc):
         wait_s=wait_s,
         inputfile_type=inputfile_type,
         run_mode=run_mode,
-        db_root_path=db_root_path)
+        db_root_path=db_root_path,
+        metrics_port=metrics_port,
+        sort_run_bytes=sort_run_bytes)
+    self._psi_process_num = psi_process_num
     self._ecc_signer = EccSigner()
 
   def open(self, runtime_context: RuntimeContext):
     super().open(runtime_context)
-    self._ecc_signer = EccSigner()
-    if self._sample_store_cls is DictSampleKvStore:
-      self._ecdh_id_map = DictSampleKvStore()
+    self._ecc_signer = EccSigner(process_num=self._psi_process_num)
+    # samples are hashed and signed a batch at a time
+    self._sign_buf = []
+    if self._sample_store_cls in (DictSampleKvStore, CompactSampleKvStore):
+      self._ecdh_id_map = self._sample_store_cls()
     elif self._sample_store_cls is LevelDbKvStore:
       db_path='{}-{}-bucket_{}_ecdh'.format(self._job_name, str(uuid.uuid4())[0:6], self._bucket_num)
       self._ecdh_id_map = LevelDbKvStore(path=os.path.join(self._db_root_path, db_path))
@@ -203,13 +263,25 @@ class ServerEcdhJoinFunc(ServerSortJoinFunc):
       if s is None or cur > s:
         self._state.update(cur)
         ctx.timer_service().register_event_time_timer(cur + self._delay)
-    key = self._ecc_signer.sign_hash(get_sample_store_key(value[0], value[1]))
-    self._sample_store.put(key, value[2])
+    self._sign_buf.append((get_sample_store_key(value[0], value[1]), value[2]))
+    if len(self._sign_buf) >= self._batch_size:
+      self._flush_sign_buf()
     self.cnt += 1
 
+  def _flush_sign_buf(self):
+    keys = self._ecc_signer.sign_hash_batch([k for k, _ in self._sign_buf])
+    for key, (_, v) in zip(keys, self._sign_buf):
+      self._put_sample(key, v)
+    self._sign_buf = []
+
+  def close(self):
+    self._ecc_signer.close()
+
   def on_timer(self, timestamp: int, ctx: 'KeyedProcessFunction.OnTimerContext'):
     s = self._state.value()
     if timestamp >= s + self._delay:
+      self._flush_sign_buf()
+      self._load_sorted_samples()
       # create join server and wait
       data_join_server, _, k8s_resouce_handler = create_data_join_server(
         port=self._port,
@@ -220,23 +292,20 @@ class ServerEcdhJoinFunc(ServerSortJoinFunc):
         use_psi=True,
         psi_server_type='ecdh',
         signer=self._ecc_signer,
-        ecdh_id_map=self._ecdh_id_map
+        ecdh_id_map=self._ecdh_id_map,
+        stream_result=True
       )
       data_join_server.set_is_ready(True)
-      # server wait for 1h
+      # server wait for 1h, samples are written as soon as their batch is joined
       log.info("ECDH PSI DataJoinServer for bucket {} has been ready, "
                "unique key size: {}, all key size:{}"
                .format(ctx.get_current_key(), self._sample_store.size(), self.cnt))
-      data_join_server.wait_for_finish(timeout=self._wait_s)
-      log.info("ECDH PSI DataJoinServer for bucket {} finished! "
-               "Begin to write sample".format(ctx.get_current_key()))
-      for l in data_join_server.get_final_result():
-        for i in l:
-          local_key = self._ecdh_id_map.get(i)
-          if self._inputfile_type == 'tfrecord':
-            yield str(ctx.get_current_key()), self._sample_store.get(local_key)
-          else :
-            yield str(self._subtask_index), self._sample_store.get(i).decode() + '\n'
+      bucket_key = str(ctx.get_current_key())
+      for sample in iter_joined_samples(data_join_server.iter_joined_res(timeout=self._wait_s),
+                                        self._sample_store, self._inputfile_type, id_map=self._ecdh_id_map,
+                                        bucket_id=ctx.get_current_key()):
+        yield bucket_key, sample
+      log.info("ECDH PSI DataJoinServer for bucket {} finished!".format(ctx.get_current_key()))
       self._sample_store.clear()
       self._ecdh_id_map.clear()
       if self._run_mode == RunMode.K8S:
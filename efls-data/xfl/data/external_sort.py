@@ -0,0 +1,118 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import heapq
+import os
+import struct
+import tempfile
+
+from xfl.common.logger import log
+
+_LEN = struct.Struct('<I')
+
+
+def _write_run(keys: list, tmp_dir: str) -> str:
+  fd, path = tempfile.mkstemp(prefix='xfl_sort_run_', dir=tmp_dir)
+  with os.fdopen(fd, 'wb', buffering=1 << 20) as f:
+    for k in keys:
+      f.write(_LEN.pack(len(k)))
+      f.write(k)
+  return path
+
+
+def _read_run(f):
+  while True:
+    head = f.read(_LEN.size)
+    if not head:
+      return
+    yield f.read(_LEN.unpack(head)[0])
+
+
+class ExternalSorter(object):
+  '''
+  sort bytes items added one at a time with at most `run_size` of them, or items of at most `run_bytes`
+  bytes in total, in memory. None leaves the bound off. Sorted runs are spilled to `tmp_dir` and merged
+  back by `sorted`, a single run never touches the disk. The sort is stable, equal items come out in the
+  order they were added.
+  '''
+  def __init__(self, key=None, run_size: int = 1000000, tmp_dir: str = None, run_bytes: int = None):
+    self._key = key
+    self._run_size = run_size
+    self._run_bytes = run_bytes
+    self._tmp_dir = tmp_dir
+    self._runs = []
+    self._buf = []
+    self._buf_bytes = 0
+
+  def add(self, item: bytes):
+    self._buf.append(item)
+    self._buf_bytes += len(item)
+    if ((self._run_size is not None and len(self._buf) >= self._run_size)
+        or (self._run_bytes is not None and self._buf_bytes >= self._run_bytes)):
+      self._buf.sort(key=self._key)
+      self._runs.append(_write_run(self._buf, self._tmp_dir))
+      self._buf = []
+      self._buf_bytes = 0
+
+  def sorted(self):
+    '''
+    @return: generator of the sorted items, spilled runs are removed once it is exhausted or closed.
+    '''
+    runs, buf = self._runs, self._buf
+    self._runs, self._buf, self._buf_bytes = [], [], 0
+    try:
+      buf.sort(key=self._key)
+      if not runs:
+        yield from buf
+        return
+      if buf:
+        runs.append(_write_run(buf, self._tmp_dir))
+        buf = []
+      log.info("merge {} sorted runs".format(len(runs)))
+      files = []
+      try:
+        # run files are unlinked once opened, the disk space is freed when they are closed
+        while runs:
+          files.append(open(runs[-1], 'rb', buffering=1 << 20))
+          os.remove(runs.pop())
+        yield from heapq.merge(*[_read_run(f) for f in reversed(files)], key=self._key)
+      finally:
+        for f in files:
+          f.close()
+    finally:
+      for p in runs:
+        os.remove(p)
+
+  def close(self):
+    for p in self._runs:
+      os.remove(p)
+    self._runs, self._buf, self._buf_bytes = [], [], 0
+
+
+def external_sorted(keys, key=None, run_size: int = 1000000, tmp_dir: str = None):
+  '''
+  sort bytes keys with at most `run_size` of them in memory, see `ExternalSorter`.
+  @param keys: iterable of bytes.
+  @param key: sort key function as in `sorted`.
+  @return: generator of sorted keys, spilled runs are removed once it is exhausted or closed.
+  '''
+  sorter = ExternalSorter(key=key, run_size=run_size, tmp_dir=tmp_dir)
+  try:
+    for k in keys:
+      sorter.add(k)
+  except BaseException:
+    sorter.close()
+    raise
+  yield from sorter.sorted()
@@ -13,9 +13,11 @@
 # limitations under the License.
 # ==============================================================================
 
+from collections import deque
 from functools import cmp_to_key
 
-import mmh3
+import struct
+import time
 import uuid
 import os
 from pyflink.common.typeinfo import Types
@@ -23,27 +25,85 @@ from pyflink.datastream import KeySelector
 from pyflink.datastream.functions import RuntimeContext, KeyedProcessFunction
 from pyflink.datastream.state import ValueStateDescriptor
 
+from xfl.common import metrics
 from xfl.common.common import RunMode
 from xfl.common.logger import log
 from xfl.data import utils
+from xfl.data.bucket_plan import BucketPlan
+from xfl.data.hash_util import get_hash_func
+from xfl.data.external_sort import external_sorted, ExternalSorter
+from xfl.data.incremental import get_bucket_index_path, is_bucket_start_marker
 from xfl.data.psi.rsa_signer import ServerRsaSigner, ClientRsaSigner
 from xfl.data.store.sample_kv_store import DictSampleKvStore
+from xfl.data.store.compact_kv_store import CompactSampleKvStore
 from xfl.data.store.level_db_kv_store import LevelDbKvStore
 from xfl.data.utils import get_sample_store_key, split_sample_store_key
-from xfl.service.data_join_client import create_data_join_client
-from xfl.service.data_join_server import create_data_join_server
+from xfl.service.data_join_client import create_data_join_client, StreamJoinSession
+from xfl.service.data_join_server import create_data_join_server, STORE_SECONDS, STORE_KEYS
 
 
-def get_local_bucket_id(key, local_bucket_num):
-  return mmh3.hash(key) % local_bucket_num
+_BULK_KEY_LEN = struct.Struct('<I')
+
+
+def _pack_bulk_item(key: bytes, value: bytes) -> bytes:
+  return _BULK_KEY_LEN.pack(len(key)) + key + value
+
+
+def _bulk_item_key(item: bytes) -> bytes:
+  return item[4:4 + _BULK_KEY_LEN.unpack_from(item)[0]]
+
+
+def _unpack_bulk_item(item: bytes):
+  n = _BULK_KEY_LEN.unpack_from(item)[0]
+  return item[4:4 + n], item[4 + n:]
+
+
+def get_local_bucket_id(key, local_bucket_num, hash_type: str = 'murmur3'):
+  return get_hash_func(hash_type)(key) % local_bucket_num
 
 class DefaultKeySelector(KeySelector):
-  def __init__(self, bucket_num: int = 64, client2multiserver: int = 1):
+  def __init__(self, bucket_num: int = 64, client2multiserver: int = 1, hash_type: str = 'murmur3'):
     self._bucket_num = bucket_num * client2multiserver
     self._client2multiserver = client2multiserver
+    self._hash_func = get_hash_func(hash_type)
+
+  def get_key(self, value):
+    return (self._hash_func(value[0]) % self._bucket_num) // self._client2multiserver
+
+
+class PlanKeySelector(KeySelector):
+  '''
+  key records by the join buckets of a `BucketPlan`, a client subtask serves `client2multiserver` of them.
+  '''
+  def __init__(self, bucket_plan: BucketPlan, client2multiserver: int = 1):
+    assert bucket_plan.bucket_num % client2multiserver == 0, \
+      "bucket num of plan {} is not a multiple of client2multiserver {}".format(bucket_plan.bucket_num, client2multiserver)
+    self._bucket_plan = bucket_plan
+    self._client2multiserver = client2multiserver
 
   def get_key(self, value):
-    return (mmh3.hash(value[0]) % self._bucket_num) // self._client2multiserver
+    return self._bucket_plan.get_bucket(value[0]) // self._client2multiserver
+
+
+class BucketStartKeySelector(KeySelector):
+  '''
+  key records by `key_selector`, and the bucket start markers of an incremental run by their bucket id.
+  '''
+  def __init__(self, key_selector: KeySelector):
+    self._key_selector = key_selector
+
+  def get_key(self, value):
+    if is_bucket_start_marker(value):
+      return int(value[1])
+    return self._key_selector.get_key(value)
+
+
+def start_subtask_metrics_server(metrics_port: int, runtime_context: RuntimeContext):
+  '''
+  serve the metrics of a subtask at `metrics_port` + subtask index, 0 for no metrics endpoint.
+  '''
+  if metrics_port:
+    metrics.start_metrics_server(metrics_port + runtime_context.get_index_of_this_subtask())
 
 
 def record_cmp(left, right):
@@ -59,6 +119,35 @@ def record_cmp(left, right):
     return 1
   return 0
 
+
+def record_sort_key(key):
+  '''
+  sort key giving the same order as `record_cmp`, computed once per key instead of per comparison.
+  '''
+  t = split_sample_store_key(key)
+  return t[1], t[0]
+
+
+def iter_joined_samples(joined_res, sample_store, inputfile_type: str, id_map=None, bucket_id=None):
+  '''
+  yield output samples of joined id batches one batch at a time, so that joined ids are never all held.
+  @param joined_res: iterable of joined id batches, e.g. `DataJoinServer.iter_joined_res()`.
+  @param id_map: store mapping joined ids to sample store keys, used by psi joins.
+  @param bucket_id: label of the store get metrics.
+  '''
+  for ids in joined_res:
+    start = time.perf_counter()
+    if id_map is not None:
+      ids = [id_map.get(i) for i in ids]
+    samples = list(map(sample_store.get, ids))
+    STORE_SECONDS.inc(time.perf_counter() - start, bucket=bucket_id, op='get')
+    STORE_KEYS.inc(len(ids), bucket=bucket_id, op='get')
+    if inputfile_type == 'tfrecord':
+      yield from samples
+    else:
+      for s in samples:
+        yield s.decode() + '\n'
+
 class ClientJoinFunc(KeyedProcessFunction):
   '''
   base class of Client Join Function
@@ -78,9 +167,29 @@ class ClientJoinFunc(KeyedProcessFunction):
           client2multiserver: int = 1,
           inputfile_type: str = 'tfrecord',
           run_mode: RunMode = RunMode.LOCAL,
-          db_root_path : str = '/tmp'):
+          db_root_path : str = '/tmp',
+          max_in_flight: int = 0,
+          use_bloom_filter: bool = False,
+          use_async_join: bool = False,
+          bucket_plan: BucketPlan = None,
+          hash_type: str = 'murmur3',
+          metrics_port: int = 0,
+          **kwargs):
     pass
 
+  def _local_bucket_id(self, key):
+    # index of the server bucket of key among the `client2multiserver` server buckets of this subtask
+    if self._bucket_plan is None:
+      return self._hash_func(key) % self._client2multiserver
+    return self._bucket_plan.get_bucket(key) - self._initial_bucket
+
+  def _joined_rows(self, bucket_id, request_ids, existence, samples):
+    for i in utils.gather_res(request_ids, existence=existence):
+      if self._inputfile_type == 'tfrecord':
+        yield str(bucket_id), samples.get(i)
+      else :
+        yield str(bucket_id), samples.get(i).decode() + '\n'
+
 class ClientBatchJoinFunc(ClientJoinFunc):
   '''
     this join function does not sort sample in one bucket, so it uses less memory.
@@ -88,7 +197,11 @@ class ClientBatchJoinFunc(ClientJoinFunc):
   def __init__(self, job_name: str, peer_host: str, peer_ip: str, peer_port: int, bucket_num: int = 64,
                cmp_func=None, sample_store_cls=None, batch_size: int = 2048, wait_s: int = 1800,
                tls_crt: str = '', client2multiserver: int = 1, inputfile_type: str = 'tfrecord',
-               run_mode: RunMode = RunMode.LOCAL, db_root_path: str = ''):
+               run_mode: RunMode = RunMode.LOCAL, db_root_path: str = '', max_in_flight: int = 0,
+               use_bloom_filter: bool = False, use_async_join: bool = False, bucket_plan: BucketPlan = None,
+               hash_type: str = 'murmur3', metrics_port: int = 0, **kwargs):
+    if use_async_join:
+      raise RuntimeError("async join requires need_sort, it is not supported in batch join")
     self._job_name = job_name
     self._bucket_num = bucket_num
     self._state = None
@@ -105,6 +218,16 @@ class ClientBatchJoinFunc(ClientJoinFunc):
     self._initial_bucket = None
     self._client2multiserver = client2multiserver
     self._request_buf = [{} for i in range(self._client2multiserver)]
+    # 0 means joining by unary SyncJoin, otherwise the number of batches kept in flight on a StreamJoin
+    self._max_in_flight = max_in_flight
+    self._join_sessions = [None] * self._client2multiserver
+    # ids missing in the bloom filter of server bucket are dropped before being sent
+    self._use_bloom_filter = use_bloom_filter
+    self._bloom_filters = None
+    # join buckets of records follow the plan instead of the plain hash when it is given
+    self._bucket_plan = bucket_plan
+    self._hash_func = get_hash_func(hash_type)
+    self._metrics_port = metrics_port
 
   def open(self, runtime_context: RuntimeContext):
     self._state = runtime_context.get_state(ValueStateDescriptor(
@@ -112,6 +235,7 @@ class ClientBatchJoinFunc(ClientJoinFunc):
 
     self._subtask_index = runtime_context.get_index_of_this_subtask()
     self._initial_bucket = self._subtask_index * self._client2multiserver
+    start_subtask_metrics_server(self._metrics_port, runtime_context)
     if self._run_mode == RunMode.K8S:
       if self._tls_crt is None or len(self._tls_crt) == 0:
         raise RuntimeError("tls crt should not be empty in k8s mode client job!")
@@ -128,6 +252,10 @@ class ClientBatchJoinFunc(ClientJoinFunc):
                                      client2multiserver=self._client2multiserver)
     log.info("Client begin to wait...")
     self.client.wait_ready(timeout=self._wait_s)
+    if self._use_bloom_filter:
+      self._bloom_filters = [self.client.get_bloom_filter(self._initial_bucket + i)
+                             for i in range(self._client2multiserver)]
+      self.filtered_cnt = [0 for i in range(self._client2multiserver)]
 
   def process_element(self, value, ctx: 'ProcessFunction.Context'):
     if self.cnt_time % 1000 == 0:
@@ -138,22 +266,35 @@ class ClientBatchJoinFunc(ClientJoinFunc):
         ctx.timer_service().register_event_time_timer(cur + self._delay)
     self.cnt_time += 1
     assert(ctx.get_current_key() == self._subtask_index)
-    bucket_id = get_local_bucket_id(value[0], self._client2multiserver)
+    if is_bucket_start_marker(value):
+      return
+    bucket_id = self._local_bucket_id(value[0])
     self.cnt[bucket_id] += 1
-    id_key = get_sample_store_key(value[0], value[1])
-    self._request_buf[bucket_id][id_key] = value[2]
+    self._request_buf[bucket_id][get_sample_store_key(value[0], value[1])] = value[2]
     if len(self._request_buf[bucket_id]) >= self._batch_size:
-      now_bucket_id = self._initial_bucket + bucket_id
-      request_ids = list(self._request_buf[bucket_id].keys())
-      existence = self.client.sync_join(request_ids, now_bucket_id)
-      res_ids = utils.gather_res(request_ids, existence=existence)
-      for i in res_ids:
-        if self._inputfile_type == 'tfrecord':
-          yield str(now_bucket_id), self._request_buf[bucket_id].get(i)
-        else :
-          yield str(now_bucket_id), self._request_buf[bucket_id].get(i).decode() + '\n'
-      log.info("client sync join bucket {} current idx: {}".format(now_bucket_id, self.cnt[bucket_id]))
-      self._request_buf[bucket_id].clear()
+      yield from self._join_request_buf(bucket_id)
+      log.info("client sync join bucket {} current idx: {}".format(self._initial_bucket + bucket_id, self.cnt[bucket_id]))
+
+  def _join_request_buf(self, bucket_id):
+    now_bucket_id = self._initial_bucket + bucket_id
+    samples = self._request_buf[bucket_id]
+    request_ids = list(samples.keys())
+    # the buffer is handed over to the join session, it is released when its response arrives
+    self._request_buf[bucket_id] = {}
+    if self._bloom_filters is not None:
+      # the whole buffer is tested at once, ids missing in the filter are never sent
+      request_ids = [i for i, c in zip(request_ids, self._bloom_filters[bucket_id].contains_batch(request_ids)) if c]
+      self.filtered_cnt[bucket_id] += len(samples) - len(request_ids)
+      if not request_ids:
+        return
+    if self._max_in_flight > 0:
+      if self._join_sessions[bucket_id] is None:
+        self._join_sessions[bucket_id] = StreamJoinSession(self.client, now_bucket_id, self._max_in_flight)
+      finished = self._join_sessions[bucket_id].put(request_ids, samples)
+    else:
+      finished = [(request_ids, self.client.sync_join(request_ids, now_bucket_id), samples)]
+    for request_ids, existence, samples in finished:
+      yield from self._joined_rows(now_bucket_id, request_ids, existence, samples)
 
   def on_timer(self, timestamp: int, ctx: 'KeyedProcessFunction.OnTimerContext'):
     s = self._state.value()
@@ -161,16 +302,15 @@ class ClientBatchJoinFunc(ClientJoinFunc):
       #flush buffer
       for bucket_id in range (self._client2multiserver):
         if self._request_buf[bucket_id]:
-          now_bucket_id = self._initial_bucket + bucket_id
-          request_ids = list(self._request_buf[bucket_id].keys())
-          existence = self.client.sync_join(request_ids, now_bucket_id)
-          res_ids = utils.gather_res(request_ids, existence=existence)
-          for i in res_ids:
-            if self._inputfile_type == 'tfrecord':
-              yield str(now_bucket_id), self._request_buf[bucket_id].get(i)
-            else :
-              yield str(now_bucket_id), self._request_buf[bucket_id].get(i).decode() + '\n'
-        self._request_buf[bucket_id].clear()
+          yield from self._join_request_buf(bucket_id)
+        session = self._join_sessions[bucket_id]
+        if session is not None:
+          for request_ids, existence, samples in session.close():
+            yield from self._joined_rows(self._initial_bucket + bucket_id, request_ids, existence, samples)
+          self._join_sessions[bucket_id] = None
+        if self._bloom_filters is not None:
+          log.info("bucket {} dropped {} of {} ids by bloom filter".format(
+            self._initial_bucket + bucket_id, self.filtered_cnt[bucket_id], self.cnt[bucket_id]))
       res = self.client.finish_join()
       if not res:
         raise ValueError("Join finish error")
@@ -191,7 +331,15 @@ class ClientSortJoinFunc(ClientJoinFunc):
           client2multiserver: int = 1,
           inputfile_type: str = 'tfrecord',
           run_mode: RunMode = RunMode.LOCAL,
-          db_root_path: str = '/tmp'):
+          db_root_path: str = '/tmp',
+          max_in_flight: int = 0,
+          use_bloom_filter: bool = False,
+          use_async_join: bool = False,
+          sort_run_size: int = 1000000,
+          bucket_plan: BucketPlan = None,
+          hash_type: str = 'murmur3',
+          metrics_port: int = 0,
+          **kwargs):
     self._job_name = job_name
     self._bucket_num = bucket_num
     self._state = None
@@ -211,12 +359,24 @@ class ClientSortJoinFunc(ClientJoinFunc):
     self._client2multiserver = client2multiserver
     # db root path should be a existing directory
     self._db_root_path = db_root_path
+    # 0 means joining by unary SyncJoin, otherwise the number of batches kept in flight on a StreamJoin
+    self._max_in_flight = max_in_flight
+    self._use_bloom_filter = use_bloom_filter
+    # join the batches of a bucket by concurrent AsyncJoin calls, `max_in_flight` bounds the concurrency
+    self._use_async_join = use_async_join
+    # at most `sort_run_size` keys are sorted in memory, longer buckets are merged from sorted runs spilled
+    # to `db_root_path`. the default comparator sorts by a precomputed key.
+    self._sort_run_size = sort_run_size
+    self._sort_key = record_sort_key if cmp_func is record_cmp else cmp_to_key(cmp_func)
+    self._bucket_plan = bucket_plan
+    self._hash_func = get_hash_func(hash_type)
+    self._metrics_port = metrics_port
 
   def open(self, runtime_context: RuntimeContext):
     self._state = runtime_context.get_state(ValueStateDescriptor(
       "last_modified_time", Types.LONG()))
-    if self._sample_store_cls is DictSampleKvStore:
-      self._sample_store = [DictSampleKvStore() for i in range(self._client2multiserver)]
+    if self._sample_store_cls in (DictSampleKvStore, CompactSampleKvStore):
+      self._sample_store = [self._sample_store_cls() for i in range(self._client2multiserver)]
     elif self._sample_store_cls is LevelDbKvStore:
       db_path='{}-{}-bucket_{}'.format(self._job_name, str(uuid.uuid4())[0:6], self._bucket_num)
       self._sample_store = [LevelDbKvStore(path=os.path.join(self._db_root_path, '{}_{}'.format(db_path, i))) for i in range(self._client2multiserver)]
@@ -225,6 +385,7 @@ class ClientSortJoinFunc(ClientJoinFunc):
 
     self._subtask_index = runtime_context.get_index_of_this_subtask()
     self._initial_bucket = self._subtask_index * self._client2multiserver
+    start_subtask_metrics_server(self._metrics_port, runtime_context)
     if self._run_mode == RunMode.K8S:
       if self._tls_crt is None or len(self._tls_crt) == 0:
         raise RuntimeError("tls crt should not be empty in k8s mode client job!")
@@ -232,6 +393,13 @@ class ClientSortJoinFunc(ClientJoinFunc):
     self.cnt = [0 for i in range(self._client2multiserver)]
     self.cnt_time = 0
 
+  def _batch_num(self, size):
+    return (size + self._batch_size - 1) // self._batch_size
+
+  def _sorted_keys(self, bucket_id):
+    return external_sorted(iter(self._sample_store[bucket_id]), key=self._sort_key,
+                           run_size=self._sort_run_size, tmp_dir=self._db_root_path)
+
   def process_element(self, value, ctx: 'ProcessFunction.Context'):
     if self.cnt_time % 1000 == 0:
       s = self._state.value()
@@ -241,7 +409,9 @@ class ClientSortJoinFunc(ClientJoinFunc):
         ctx.timer_service().register_event_time_timer(cur + self._delay)
     self.cnt_time += 1
     assert(ctx.get_current_key() == self._subtask_index)
-    bucket_id = get_local_bucket_id(value[0], self._client2multiserver)
+    if is_bucket_start_marker(value):
+      return
+    bucket_id = self._local_bucket_id(value[0])
     self._sample_store[bucket_id].put(get_sample_store_key(value[0], value[1]),value[2])
     self.cnt[bucket_id] += 1
 
@@ -258,24 +428,30 @@ class ClientSortJoinFunc(ClientJoinFunc):
                                        client2multiserver=self._client2multiserver)
       client.wait_ready(timeout=self._wait_s)
       for bucket_id in range (self._client2multiserver):
-        keys_to_join = sorted(self._sample_store[bucket_id].keys(), key=cmp_to_key(self._cmp_func))
+        unique_size = self._sample_store[bucket_id].size()
         now_bucket_id = self._initial_bucket + bucket_id
         log.info(
           "Client begin to join, bucket id:{}, all size:{}, unique size:{}, subtask index{}".format(now_bucket_id, self.cnt[bucket_id],
-                                                                                  len(keys_to_join), self._subtask_index))
+                                                                                  unique_size, self._subtask_index))
+        batches = utils.batch_iter(self._sorted_keys(bucket_id), self._batch_size)
+        if self._use_bloom_filter:
+          bloom_filter = client.get_bloom_filter(now_bucket_id)
+          batches = (utils.gather_res(b, bloom_filter.contains_batch(b)) for b in batches)
+          if not self._use_async_join:
+            batches = (b for b in batches if b)
+        if self._use_async_join:
+          # batches filtered to empty are still sent, so the batch num is known before sorting ends
+          joined = client.async_join(batches, now_bucket_id, max_in_flight=max(1, self._max_in_flight),
+                                     total_batch_num=self._batch_num(unique_size))
+        elif self._max_in_flight > 0:
+          joined = client.stream_join(batches, now_bucket_id, max_in_flight=self._max_in_flight)
+        else:
+          joined = ((request_ids, client.sync_join(request_ids, now_bucket_id)) for request_ids in batches)
         cur = 0
-        while cur < len(keys_to_join):
-          end = min(cur + self._batch_size, len(keys_to_join))
-          request_ids = keys_to_join[cur:end]
-          existence = client.sync_join(request_ids, now_bucket_id)
-          res_ids = utils.gather_res(request_ids, existence=existence)
-          cur = end
-          for i in res_ids:
-            if self._inputfile_type == 'tfrecord':
-              yield str(now_bucket_id), self._sample_store[bucket_id].get(i)
-            else :
-              yield str(now_bucket_id), self._sample_store[bucket_id].get(i).decode() + '\n'
-          log.info("client sync join bucket {} current idx: {}, all: {}".format(now_bucket_id, cur, len(keys_to_join)))
+        for request_ids, existence in joined:
+          cur += len(request_ids)
+          yield from self._joined_rows(now_bucket_id, request_ids, existence, self._sample_store[bucket_id])
+          log.info("client sync join bucket {} current idx: {}, all: {}".format(now_bucket_id, cur, unique_size))
         self._sample_store[bucket_id].clear()
       res = client.finish_join()
       if not res:
@@ -297,15 +473,106 @@ class ClientPsiJoinFunc(ClientSortJoinFunc):
       client2multiserver: int = 1,
       inputfile_type: str = 'tfrecord',
       run_mode: RunMode = RunMode.LOCAL,
-      db_root_path='/tmp'):
-    #The PSI version will be updated later
-    raise NotImplementedError('Method not implemented!')
-
-  def open(self, runtime_context: RuntimeContext):
-    raise NotImplementedError('Method not implemented!')
+      db_root_path='/tmp',
+      max_in_flight: int = 0,
+      use_bloom_filter: bool = False,
+      use_async_join: bool = False,
+      sort_run_size: int = 1000000,
+      psi_process_num: int = 1,
+      bucket_plan: BucketPlan = None,
+      hash_type: str = 'murmur3',
+      metrics_port: int = 0,
+      **kwargs):
+    if use_bloom_filter:
+      raise RuntimeError("bloom filter is not supported in rsa psi join")
+    super().__init__(job_name=job_name,
+        peer_host=peer_host,
+        peer_ip=peer_ip,
+        peer_port=peer_port,
+        bucket_num=bucket_num,
+        cmp_func=cmp_func,
+        sample_store_cls=sample_store_cls,
+        batch_size=batch_size,
+        wait_s=wait_s,
+        tls_crt=tls_crt,
+        client2multiserver=client2multiserver,
+        inputfile_type=inputfile_type,
+        run_mode=run_mode,
+        db_root_path=db_root_path,
+        max_in_flight=max_in_flight,
+        use_async_join=use_async_join,
+        sort_run_size=sort_run_size,
+        bucket_plan=bucket_plan,
+        hash_type=hash_type,
+        metrics_port=metrics_port)
+    # number of processes blinding and unblinding ids
+    self._psi_process_num = psi_process_num
+
+  def _sign_and_join(self, client, signer, bucket_id, raw_batches, total_batch_num=None):
+    '''
+    blind, sign by server and unblind the raw keys batch by batch, then join the signed ids.
+    @return: generator of (raw_ids, existence) in the order of `raw_batches`.
+    '''
+    if self._use_async_join:
+      # a batch is signed only when async join asks for it, so at most `max_in_flight` are kept alive
+      raw_queue = deque()
+      def signed_batches():
+        for raw_ids in raw_batches:
+          raw_queue.append(raw_ids)
+          yield signer.sign_func(raw_ids, client, bucket_id)
+      for _, existence in client.async_join(signed_batches(), bucket_id, max_in_flight=max(1, self._max_in_flight),
+                                            total_batch_num=total_batch_num):
+        yield raw_queue.popleft(), existence
+    elif self._max_in_flight > 0:
+      # the next batch is signed while the previous ones are joined
+      session = StreamJoinSession(client, bucket_id, self._max_in_flight)
+      try:
+        for raw_ids in raw_batches:
+          for _, existence, ids in session.put(signer.sign_func(raw_ids, client, bucket_id), raw_ids):
+            yield ids, existence
+        for _, existence, ids in session.close():
+          yield ids, existence
+      except BaseException:
+        session.cancel()
+        raise
+    else:
+      for raw_ids in raw_batches:
+        yield raw_ids, client.sync_join(signer.sign_func(raw_ids, client, bucket_id), bucket_id)
 
   def on_timer(self, timestamp: int, ctx: 'KeyedProcessFunction.OnTimerContext'):
-    raise NotImplementedError('Method not implemented!')
+    s = self._state.value()
+    if timestamp >= s + self._delay:
+      client = create_data_join_client(host=self._peer_host,
+                                       ip=self._peer_ip,
+                                       port=self._peer_port,
+                                       job_name=self._job_name,
+                                       bucket_id=self._subtask_index,
+                                       run_mode=self._run_mode,
+                                       tls_crt=self._tls_crt,
+                                       client2multiserver=self._client2multiserver)
+      client.wait_ready(timeout=self._wait_s)
+      for bucket_id in range (self._client2multiserver):
+        unique_size = self._sample_store[bucket_id].size()
+        now_bucket_id = self._initial_bucket + bucket_id
+        log.info(
+          "Psi client begin to join, bucket id:{}, all size:{}, unique size:{}, subtask index{}".format(now_bucket_id, self.cnt[bucket_id],
+                                                                                      unique_size, self._subtask_index))
+        # each server bucket holds its own rsa key
+        signer = ClientRsaSigner(client.request_public_key_from_server(now_bucket_id), process_num=self._psi_process_num)
+        cur = 0
+        try:
+          raw_batches = utils.batch_iter(self._sorted_keys(bucket_id), self._batch_size)
+          for raw_ids, existence in self._sign_and_join(client, signer, now_bucket_id, raw_batches,
+                                                        total_batch_num=self._batch_num(unique_size)):
+            cur += len(raw_ids)
+            yield from self._joined_rows(now_bucket_id, raw_ids, existence, self._sample_store[bucket_id])
+            log.info("psi client join bucket {} current idx: {}, all: {}".format(now_bucket_id, cur, unique_size))
+        finally:
+          signer.close()
+        self._sample_store[bucket_id].clear()
+      res = client.finish_join()
+      if not res:
+        raise ValueError("Join finish error")
 
 
 class ServerSortJoinFunc(KeyedProcessFunction):
@@ -321,6 +588,10 @@ class ServerSortJoinFunc(KeyedProcessFunction):
           inputfile_type: str = 'tfrecord',
           run_mode: RunMode = RunMode.LOCAL,
           db_root_path: str = '/tmp',
+          bloom_filter_error_rate: float = 0.001,
+          incremental: bool = False,
+          metrics_port: int = 0,
+          sort_run_bytes: int = 64 << 20,
           **kwargs):
     self._job_name = job_name
     self._bucket_num = bucket_num
@@ -335,23 +606,61 @@ class ServerSortJoinFunc(KeyedProcessFunction):
     self._batch_size = batch_size
     # db root path should be an existing directory
     self._db_root_path = db_root_path
+    self._bloom_filter_error_rate = bloom_filter_error_rate
+    # in incremental mode new samples are added to the bucket index persisted by previous runs
+    self._incremental = incremental
+    self._metrics_port = metrics_port
+    # samples for an empty leveldb store are sorted with at most `sort_run_bytes` of them in memory
+    self._sort_run_bytes = sort_run_bytes
+    self._bulk_sorter = None
 
   def open(self, runtime_context: RuntimeContext):
     self._state = runtime_context.get_state(ValueStateDescriptor(
       "last_modified_time", Types.LONG()))
 
-    if self._sample_store_cls is DictSampleKvStore:
-      self._sample_store = DictSampleKvStore()
+    if self._incremental:
+      if self._sample_store_cls is not LevelDbKvStore:
+        raise RuntimeError("incremental join requires leveldb sample store, got {}".format(self._sample_store_cls))
+      db_path = get_bucket_index_path(self._db_root_path, self._job_name, runtime_context.get_index_of_this_subtask())
+      self._sample_store = LevelDbKvStore(path=db_path, reuse_existing=True)
+    elif self._sample_store_cls in (DictSampleKvStore, CompactSampleKvStore):
+      self._sample_store = self._sample_store_cls()
     elif self._sample_store_cls is LevelDbKvStore:
       db_path='{}-{}-bucket_{}'.format(self._job_name, str(uuid.uuid4())[0:6], self._bucket_num)
       self._sample_store = LevelDbKvStore(path=os.path.join(self._db_root_path, db_path))
     else:
       raise RuntimeError("sample_store_cls is not supported by now{}".format(self._sample_store_cls))
 
+    if isinstance(self._sample_store, LevelDbKvStore) and self._sample_store.size() == 0:
+      # samples of an empty db are sorted on disk and bulk loaded in key order before serving
+      self._bulk_sorter = ExternalSorter(key=_bulk_item_key, run_size=None, run_bytes=self._sort_run_bytes,
+                                         tmp_dir=self._db_root_path)
     self._subtask_index = runtime_context.get_index_of_this_subtask()
     if self._run_mode == RunMode.LOCAL:
       self._port = self._port + runtime_context.get_index_of_this_subtask()
     self.cnt = 0
+    self._put_seconds = 0.
+    start_subtask_metrics_server(self._metrics_port, runtime_context)
+
+  def _put_sample(self, key: bytes, value: bytes):
+    if self._bulk_sorter is not None:
+      self._bulk_sorter.add(_pack_bulk_item(key, value))
+    else:
+      self._sample_store.put(key, value)
+
+  def _load_sorted_samples(self):
+    if self._bulk_sorter is None:
+      return
+    sorter, self._bulk_sorter = self._bulk_sorter, None
+    start = time.perf_counter()
+    size = self._sample_store.bulk_load(_unpack_bulk_item(item) for item in sorter.sorted())
+    log.info("Bulk load {} samples of bucket {} in {:.2f}s".format(size, self._subtask_index,
+                                                                    time.perf_counter() - start))
+
+  def _flush_put_metrics(self, put_num):
+    STORE_SECONDS.inc(self._put_seconds, bucket=self._subtask_index, op='put')
+    STORE_KEYS.inc(put_num, bucket=self._subtask_index, op='put')
+    self._put_seconds = 0.
 
   def process_element(self, value, ctx: 'ProcessFunction.Context'):
     if self.cnt % 1000 == 0:
@@ -361,13 +670,21 @@ class ServerSortJoinFunc(KeyedProcessFunction):
         self._state.update(cur)
         ctx.timer_service().register_event_time_timer(cur + self._delay)
     assert(ctx.get_current_key() == self._subtask_index)
-    self._sample_store.put(get_sample_store_key(value[0], value[1]),
-                           value[2])
+    if is_bucket_start_marker(value):
+      # the bucket is served from its persisted index even without new samples
+      return
+    start = time.perf_counter()
+    self._put_sample(get_sample_store_key(value[0], value[1]), value[2])
+    self._put_seconds += time.perf_counter() - start
     self.cnt += 1
+    if self.cnt % 1000 == 0:
+      self._flush_put_metrics(1000)
 
   def on_timer(self, timestamp: int, ctx: 'KeyedProcessFunction.OnTimerContext'):
     s = self._state.value()
     if timestamp >= s + self._delay:
+      self._flush_put_metrics(self.cnt % 1000)
+      self._load_sorted_samples()
       # create join server and wait
       data_join_server, _, k8s_resouce_handler = create_data_join_server(
         port=self._port,
@@ -375,22 +692,23 @@ class ServerSortJoinFunc(KeyedProcessFunction):
         bucket_id=self._subtask_index,
         sample_kv_store=self._sample_store,
         run_mode=self._run_mode,
+        bloom_filter_error_rate=self._bloom_filter_error_rate,
+        stream_result=True,
       )
       data_join_server.set_is_ready(True)
-      # server wait for 1h
+      # server wait for 1h, samples are written as soon as their batch is joined
       log.info("DataJoinServer for bucket {} has been ready, "
                "unique key size: {}, all key size:{}"
                .format(self._subtask_index, self._sample_store.size(), self.cnt))
-      data_join_server.wait_for_finish(timeout=self._wait_s)
-      log.info("DataJoinServer for bucket {} finished! "
-               "Begin to write sample".format(ctx.get_current_key()))
-      for l in data_join_server.get_final_result():
-        for i in l:
-          if self._inputfile_type == 'tfrecord':
-            yield str(self._subtask_index), self._sample_store.get(i)
-          else :
-            yield str(self._subtask_index), self._sample_store.get(i).decode() + '\n'
-      self._sample_store.clear()
+      bucket_key = str(self._subtask_index)
+      for sample in iter_joined_samples(data_join_server.iter_joined_res(timeout=self._wait_s),
+                                        self._sample_store, self._inputfile_type, bucket_id=self._subtask_index):
+        yield bucket_key, sample
+      log.info("DataJoinServer for bucket {} finished!".format(ctx.get_current_key()))
+      if self._incremental:
+        self._sample_store.close()
+      else:
+        self._sample_store.clear()
       if self._run_mode == RunMode.K8S:
         k8s_resouce_handler.delete()
 
@@ -408,14 +726,89 @@ class ServerPsiJoinFunc(ServerSortJoinFunc):
           inputfile_type: str = 'tfrecord',
           run_mode: RunMode = RunMode.LOCAL,
           db_root_path: str = '/tmp',
+          rsa_public_key_bytes: bytes = None,
+          rsa_private_key_bytes: bytes = None,
+          psi_process_num: int = 1,
+          metrics_port: int = 0,
+          sort_run_bytes: int = 64 << 20,
           **kwargs):
-    raise NotImplementedError('Method not implemented!')
+    super().__init__(job_name=job_name,
+        port=port,
+        bucket_num=bucket_num,
+        cmp_func=cmp_func,
+        sample_store_cls=sample_store_cls,
+        batch_size=batch_size,
+        wait_s=wait_s,
+        inputfile_type=inputfile_type,
+        run_mode=run_mode,
+        db_root_path=db_root_path,
+        metrics_port=metrics_port,
+        sort_run_bytes=sort_run_bytes)
+    self._rsa_public_key_bytes = rsa_public_key_bytes
+    self._rsa_private_key_bytes = rsa_private_key_bytes
+    # number of processes signing ids
+    self._psi_process_num = psi_process_num
+    self._rsa_signer = None
 
   def open(self, runtime_context: RuntimeContext):
-    raise NotImplementedError('Method not implemented!')
+    super().open(runtime_context)
+    self._rsa_signer = ServerRsaSigner(self._rsa_public_key_bytes, self._rsa_private_key_bytes,
+                                       process_num=self._psi_process_num)
+    # signed id -> raw sample store key, this is the store the join server looks up
+    if self._sample_store_cls in (DictSampleKvStore, CompactSampleKvStore):
+      self._psi_id_map = self._sample_store_cls()
+    elif self._sample_store_cls is LevelDbKvStore:
+      db_path='{}-{}-bucket_{}_psi'.format(self._job_name, str(uuid.uuid4())[0:6], self._bucket_num)
+      self._psi_id_map = LevelDbKvStore(path=os.path.join(self._db_root_path, db_path))
+    else:
+      raise RuntimeError("sample_store_cls is not supported by now{}".format(self._sample_store_cls))
 
-  def process_element(self, value, ctx: 'ProcessFunction.Context'):
-    raise NotImplementedError('Method not implemented!')
+  def close(self):
+    if self._rsa_signer is not None:
+      self._rsa_signer.close()
+
+  def _sign_sample_store(self):
+    keys = []
+    for k in self._sample_store:
+      keys.append(k)
+      if len(keys) >= self._batch_size * max(1, self._psi_process_num):
+        for signed_id, raw_id in zip(self._rsa_signer.sign_func(keys), keys):
+          self._psi_id_map.put(signed_id, raw_id)
+        keys = []
+    if keys:
+      for signed_id, raw_id in zip(self._rsa_signer.sign_func(keys), keys):
+        self._psi_id_map.put(signed_id, raw_id)
 
   def on_timer(self, timestamp: int, ctx: 'KeyedProcessFunction.OnTimerContext'):
-    raise NotImplementedError('Method not implemented!')
\ No newline at end of file
+    s = self._state.value()
+    if timestamp >= s + self._delay:
+      self._flush_put_metrics(self.cnt % 1000)
+      self._load_sorted_samples()
+      self._sign_sample_store()
+      log.info("Sign server data ok for bucket {}, signed key size: {}".format(self._subtask_index, self._psi_id_map.size()))
+      # create join server and wait
+      data_join_server, _, k8s_resouce_handler = create_data_join_server(
+        port=self._port,
+        job_name=self._job_name,
+        bucket_id=self._subtask_index,
+        sample_kv_store=self._psi_id_map,
+        run_mode=self._run_mode,
+        use_psi=True,
+        psi_server_type='rsa',
+        signer=self._rsa_signer,
+        stream_result=True
+      )
+      data_join_server.set_is_ready(True)
+      log.info("RSA PSI DataJoinServer for bucket {} has been ready, "
+               "unique key size: {}, all key size:{}"
+               .format(self._subtask_index, self._sample_store.size(), self.cnt))
+      bucket_key = str(self._subtask_index)
+      for sample in iter_joined_samples(data_join_server.iter_joined_res(timeout=self._wait_s),
+                                        self._sample_store, self._inputfile_type, id_map=self._psi_id_map,
+                                        bucket_id=self._subtask_index):
+        yield bucket_key, sample
+      log.info("RSA PSI DataJoinServer for bucket {} finished!".format(ctx.get_current_key()))
+      self._sample_store.clear()
+      self._psi_id_map.clear()
+      if self._run_mode == RunMode.K8S:
+        k8s_resouce_handler.delete()
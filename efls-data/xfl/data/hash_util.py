@@ -0,0 +1,53 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import mmh3
+import numpy as np
+
+# hash functions picking the bucket of an id, both parties of a join must use the same one.
+# murmur3 is the signed 32 bit mmh3 hash used by all earlier jobs.
+HASH_TYPES = ('murmur3', 'xxh3', 'city')
+
+
+def get_hash_func(hash_type: str = 'murmur3'):
+  '''
+  @return: function hashing bytes to int, xxh3 and city need the xxhash and cityhash packages.
+  '''
+  if hash_type == 'murmur3':
+    return mmh3.hash
+  if hash_type == 'xxh3':
+    import xxhash
+    return xxhash.xxh3_64_intdigest
+  if hash_type == 'city':
+    from cityhash import CityHash64
+    return CityHash64
+  raise ValueError("Unsupported hash type {}, should be one of {}".format(hash_type, HASH_TYPES))
+
+
+def _hash_dtype(hash_type: str):
+  return np.int64 if hash_type == 'murmur3' else np.uint64
+
+
+def get_bucket_id(key, bucket_num: int, hash_type: str = 'murmur3') -> int:
+  return get_hash_func(hash_type)(key) % bucket_num
+
+
+def get_bucket_ids(keys: list, bucket_num: int, hash_type: str = 'murmur3') -> np.ndarray:
+  '''
+  bucket ids of a batch of keys, the same as `get_bucket_id` of each key. The hash function is mapped over
+  the batch without a python frame per key, and the modulo is taken on the whole array.
+  '''
+  hashes = np.fromiter(map(get_hash_func(hash_type), keys), dtype=_hash_dtype(hash_type), count=len(keys))
+  return (hashes % np.asarray(bucket_num, dtype=hashes.dtype)).astype(np.int64)
@@ -0,0 +1,114 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import json
+import os
+
+from xfl.common.logger import log
+
+FILE_SCHEME = 'file://'
+
+
+def list_input_files(input_path: str) -> list:
+  '''
+  list input files the way the file source does, files and dirs starting with '_' or '.' are skipped.
+  Only local file system paths are supported.
+  @return: sorted `file://` paths.
+  '''
+  if input_path.startswith(FILE_SCHEME):
+    input_path = input_path[len(FILE_SCHEME):]
+  elif '://' in input_path:
+    raise ValueError("incremental join only supports local file system input, got {}".format(input_path))
+  if os.path.isfile(input_path):
+    return [FILE_SCHEME + os.path.abspath(input_path)]
+  res = []
+  for root, dirs, files in os.walk(input_path):
+    dirs[:] = [d for d in dirs if not d.startswith(('_', '.'))]
+    for f in files:
+      if not f.startswith(('_', '.')):
+        res.append(FILE_SCHEME + os.path.abspath(os.path.join(root, f)))
+  return sorted(res)
+
+
+def get_bucket_index_path(db_root_path: str, job_name: str, bucket_id: int) -> str:
+  '''
+  path of the persistent server key index of a bucket, shared by all incremental runs of a job.
+  '''
+  return os.path.join(db_root_path, '{}-incremental-bucket_{}'.format(job_name, bucket_id))
+
+
+def bucket_start_markers(bucket_num: int) -> list:
+  '''
+  one record per bucket with an empty sample, keyed to the bucket by `BucketStartKeySelector`. Markers
+  start the join of every bucket in an incremental run, also of those without new input records.
+  '''
+  return [(b'', str(i).encode(), b'') for i in range(bucket_num)]
+
+
+def is_bucket_start_marker(value) -> bool:
+  # samples read from the input are never empty
+  return len(value[2]) == 0
+
+
+class IngestManifest(object):
+  '''
+  Input files already joined by the previous incremental runs of a job, kept as json under `db_root_path`.
+  A file is identified by its path, size and modify time, a rewritten file is taken as new.
+  The manifest is only updated after a run succeeds, so a failed run is joined again by the next one.
+  '''
+  def __init__(self, db_root_path: str, job_name: str, is_server: bool, bucket_num: int, hash_type: str = 'murmur3'):
+    self._path = os.path.join(db_root_path, '{}-{}-manifest.json'.format(job_name, 'server' if is_server else 'client'))
+    self._bucket_num = bucket_num
+    self._hash_type = hash_type
+    self._files = {}
+    self._run_id = 0
+    if os.path.exists(self._path):
+      with open(self._path) as f:
+        manifest = json.load(f)
+      if manifest['bucket_num'] != bucket_num:
+        raise ValueError("bucket_num {} does not match {} of previous runs in {}"
+                         .format(bucket_num, manifest['bucket_num'], self._path))
+      if manifest.get('hash_type', 'murmur3') != hash_type:
+        raise ValueError("hash_type {} does not match {} of previous runs in {}"
+                         .format(hash_type, manifest.get('hash_type', 'murmur3'), self._path))
+      self._files = manifest['files']
+      self._run_id = manifest['run_id']
+    log.info("Load ingest manifest {}, ingested file num: {}, run id: {}"
+             .format(self._path, len(self._files), self._run_id))
+
+  @staticmethod
+  def _stat(file_path: str) -> list:
+    st = os.stat(file_path[len(FILE_SCHEME):])
+    return [st.st_size, st.st_mtime_ns]
+
+  def get_run_id(self) -> int:
+    return self._run_id
+
+  def new_files(self, files: list) -> list:
+    return [f for f in files if self._files.get(f) != self._stat(f)]
+
+  def commit(self, files: list):
+    '''
+    record `files` as ingested and start the next run.
+    '''
+    for f in files:
+      self._files[f] = self._stat(f)
+    self._run_id += 1
+    tmp_path = self._path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'bucket_num': self._bucket_num, 'hash_type': self._hash_type, 'run_id': self._run_id,
+                 'files': self._files}, f)
+    os.replace(tmp_path, self._path)
+    log.info("Commit ingest manifest {}, ingested file num: {}".format(self._path, len(self._files)))
@@ -0,0 +1,163 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import mmap
+import os
+import shutil
+
+import mmh3
+import numpy as np
+
+from xfl.common.logger import log
+from xfl.data.utils import file_lock
+
+_HASHES = 'hashes.npy'
+_KEY_OFFSETS = 'key_offsets.npy'
+_VALUE_OFFSETS = 'value_offsets.npy'
+_KEYS = 'keys.bin'
+_VALUES = 'values.bin'
+_SUCCESS = '_SUCCESS'
+
+
+def key_hash(key: bytes) -> int:
+  return mmh3.hash64(key)[0]
+
+
+def _key_hashes(keys: list) -> np.ndarray:
+  return np.fromiter((mmh3.hash64(k)[0] for k in keys), dtype=np.int64, count=len(keys))
+
+
+def _map(path: str):
+  with open(path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class AuxIndex(object):
+  '''
+  an on-disk index of key -> value, values are concatenated in a file mapped by all readers.
+  Keys are sorted by a 64 bit hash, a lookup is a binary search of the hash array followed by a
+  compare with the key bytes, so colliding keys are told apart. Arrays are opened with mmap, opening
+  an index does not read it.
+  '''
+  def __init__(self, path: str):
+    if not os.path.exists(os.path.join(path, _SUCCESS)):
+      raise RuntimeError("aux index {} is not built".format(path))
+    self.path = path
+    self._hashes = np.load(os.path.join(path, _HASHES), mmap_mode='r')
+    self._key_offsets = np.load(os.path.join(path, _KEY_OFFSETS), mmap_mode='r')
+    self._value_offsets = np.load(os.path.join(path, _VALUE_OFFSETS), mmap_mode='r')
+    self._keys = _map(os.path.join(path, _KEYS))
+    self._values = _map(os.path.join(path, _VALUES))
+
+  @staticmethod
+  def build(path: str, items):
+    '''
+    build an index at `path` from (key, value) pairs, a key seen again replaces its value. Values are
+    streamed to disk, only keys are kept in memory. The index is written to a temporary directory and
+    renamed, so a reader never sees a partial index.
+    '''
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+      shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    keys, value_offsets = [], [0]
+    with open(os.path.join(tmp_path, _VALUES), 'wb') as f:
+      for k, v in items:
+        keys.append(bytes(k))
+        f.write(v)
+        value_offsets.append(value_offsets[-1] + len(v))
+    hashes = _key_hashes(keys)
+    value_offsets = np.asarray(value_offsets, dtype=np.int64)
+    order = np.argsort(hashes, kind='stable')
+    sorted_hashes = hashes[order]
+    # equal hashes are duplicated keys or collisions, only those runs are compared by key bytes
+    keep = np.ones(len(order), dtype=bool)
+    end = 0
+    for start in np.flatnonzero(np.diff(sorted_hashes) == 0).tolist():
+      if start < end:
+        continue
+      end = start + 1
+      while end < len(order) and sorted_hashes[end] == sorted_hashes[start]:
+        end += 1
+      last = {}
+      for i in range(start, end):
+        if keys[order[i]] in last:
+          keep[last[keys[order[i]]]] = False
+        last[keys[order[i]]] = i
+    order = order[keep]
+    key_offsets = [0]
+    with open(os.path.join(tmp_path, _KEYS), 'wb') as f:
+      for i in order.tolist():
+        f.write(keys[i])
+        key_offsets.append(key_offsets[-1] + len(keys[i]))
+    np.save(os.path.join(tmp_path, _HASHES), hashes[order])
+    np.save(os.path.join(tmp_path, _KEY_OFFSETS), np.asarray(key_offsets, dtype=np.int64))
+    # start and end of the value of each sorted key
+    np.save(os.path.join(tmp_path, _VALUE_OFFSETS), np.stack([value_offsets[order], value_offsets[order + 1]], axis=1))
+    with open(os.path.join(tmp_path, _SUCCESS), 'w') as f:
+      f.write(str(len(order)))
+    if os.path.exists(path):
+      shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    log.info("Build aux index {}, size: {}".format(path, len(order)))
+
+  @classmethod
+  def open_or_build(cls, path: str, items_func) -> 'AuxIndex':
+    '''
+    open the index at `path`, building it from `items_func()` first if it does not exist. Processes of a
+    node sharing `path` build it once, the others wait on a file lock and then open the built index.
+    '''
+    with file_lock(path + '.lock'):
+      if not os.path.exists(os.path.join(path, _SUCCESS)):
+        cls.build(path, items_func())
+    return cls(path)
+
+  def __len__(self):
+    return len(self._hashes)
+
+  def _find(self, key: bytes, h: int, pos: int):
+    n = len(self._hashes)
+    while pos < n and self._hashes[pos] == h:
+      if self._keys[self._key_offsets[pos]:self._key_offsets[pos + 1]] == key:
+        start, end = self._value_offsets[pos]
+        return self._values[start:end]
+      pos += 1
+    return None
+
+  def get(self, key: bytes):
+    h = key_hash(key)
+    return self._find(key, h, int(np.searchsorted(self._hashes, h)))
+
+  def get_batch(self, keys: list) -> list:
+    '''
+    values of `keys`, None for a missing key. Hashes of the batch are searched by one vectorized binary
+    search, and keys whose hash is absent are skipped without touching the key file.
+    '''
+    if len(keys) == 0 or len(self._hashes) == 0:
+      return [None] * len(keys)
+    hashes = _key_hashes(keys)
+    pos = np.searchsorted(self._hashes, hashes)
+    hit = self._hashes[np.minimum(pos, len(self._hashes) - 1)] == hashes
+    res = [None] * len(keys)
+    for i in np.flatnonzero(hit).tolist():
+      res[i] = self._find(keys[i], hashes[i], int(pos[i]))
+    return res
+
+  def close(self):
+    for m in (self._keys, self._values):
+      if isinstance(m, mmap.mmap):
+        m.close()
@@ -13,19 +13,63 @@
 # limitations under the License.
 # ==============================================================================
 
+import hashlib
+import os
+import tempfile
+
 import tensorflow_io
 from tensorflow.python.platform import gfile
 from xfl.data.local_join import utils
+from xfl.data.local_join.aux_index import AuxIndex
 import tensorflow as tf
 from xfl.common.logger import log
+
+DEFAULT_INDEX_DIR = os.path.join(tempfile.gettempdir(), 'xfl_aux_index')
+
+
 class AuxTable(object):
+  '''
+  an auxiliary table looked up by `key_col`. The table is loaded into an on-disk index under `index_dir`
+  once per node, workers on the node open the built index by mmap instead of loading the table again.
+  The index is named by the path and key col of the table, and the names, sizes and modify times of its
+  files. A changed table is indexed again and the indexes of its earlier versions are removed.
+  '''
   def __init__(self,
                path: str,
-               key_col: str):
+               key_col: str,
+               index_dir: str = DEFAULT_INDEX_DIR):
     self.path = path
     self.key_col = key_col
-    self.store = {}
+    self.index_dir = index_dir
+    self.index = None
     self._inited = False
+
+  def _index_prefix(self) -> str:
+    return hashlib.md5('{}:{}'.format(self.path, self.key_col).encode()).hexdigest() + '-'
+
+  def _index_path(self, files: list) -> str:
+    sig = hashlib.md5()
+    for f in files:
+      sig.update(utils.file_signature(f).encode())
+    return os.path.join(self.index_dir, self._index_prefix() + sig.hexdigest())
+
+  def _iter_records(self, files: list):
+    for f in files:
+      dataset = tf.data.TFRecordDataset(f)
+      for raw_record in dataset:
+        raw_record = raw_record.numpy()
+        example = tf.train.Example()
+        example.ParseFromString(raw_record)
+        if self.key_col not in example.features.feature:
+          raise RuntimeError("key col {} is not in input record, please check your data.".format(self.key_col))
+        if not example.features.feature[self.key_col].WhichOneof('kind') == 'bytes_list':
+          raise RuntimeError(
+            "key col {} type must be bytes_list, but got {}".format(self.key_col, example.features.feature[self.key_col].WhichOneof('kind')))
+        if not len(example.features.feature[self.key_col].bytes_list.value) == 1:
+          raise RuntimeError(
+            "key col {} length must be 1, but got {}".format(self.key_col, len(example.features.feature[self.key_col].bytes_list.value)))
+        yield example.features.feature[self.key_col].bytes_list.value[0], raw_record
+
   def open(self):
     if not self._inited:
       utils.assert_valid_dir(path=self.path)
@@ -33,27 +77,17 @@ class AuxTable(object):
       for f in files:
         if not gfile.Exists(f):
           raise RuntimeError("path {} does not exist. please check your config!".format(f))
-        dataset = tf.data.TFRecordDataset(f)
-        for raw_record in dataset:
-          example = tf.train.Example()
-          example.ParseFromString(raw_record.numpy())
-          if self.key_col not in example.features.feature:
-            raise RuntimeError("key col {} is not in input record, please check your data.".format(self.key_col))
-          if not example.features.feature[self.key_col].WhichOneof('kind') == 'bytes_list':
-            raise RuntimeError(
-              "key col {} type must be bytes_list, but got {}".format(self.key_col, example.features.feature[self.key_col].WhichOneof('kind')))
-          if not len(example.features.feature[self.key_col].bytes_list.value) == 1:
-            raise RuntimeError(
-              "key col {} length must be 1, but got {}".format(self.key_col, len(example.features.feature[self.key_col].bytes_list.value)))
-          self.store[example.features.feature[self.key_col].bytes_list.value[0]] = raw_record.numpy()
-      log.info("Aux table {} load successfully, size:{}".format(self.path, len(self.store)))
+      index_path = self._index_path(files)
+      self.index = AuxIndex.open_or_build(index_path, lambda: self._iter_records(files))
+      utils.remove_stale_indexes(self.index_dir, self._index_prefix(), os.path.basename(index_path))
+      log.info("Aux table {} load successfully, size:{}".format(self.path, len(self.index)))
       self._inited = True
     else:
       log.info("Aux table {} has been inited. skip it!".format(self.path))
 
 
   def get(self, key):
-    return self.store.get(key, None)
+    return self.index.get(key)
 
   def get_batch(self, keys: list):
-    return [self.store.get(i) for i in keys]
+    return self.index.get_batch(keys)
@@ -14,8 +14,67 @@
 # ==============================================================================
 
 
+import hashlib
+import os
+import struct
+import tempfile
 from typing import List
+
+import numpy as np
+from tensorflow.python.platform import gfile
+
+from xfl.common.logger import log
 from xfl.data.local_join import utils
+from xfl.data.utils import file_lock
+
+DEFAULT_RECORD_INDEX_DIR = os.path.join(tempfile.gettempdir(), 'xfl_record_index')
+
+_LENGTH = struct.Struct('<Q')
+
+
+def scan_record_offsets(path: str, chunk_size: int = 4 * 1024 * 1024) -> np.ndarray:
+  '''
+  byte offsets of the records of a tfrecord file followed by the file size, found by reading the
+  length headers only. The file is read by chunks of `chunk_size` bytes and headers are parsed from the
+  chunk, a record longer than the chunk is skipped by a seek.
+  '''
+  size = gfile.Stat(path).length
+  unpack_from = _LENGTH.unpack_from
+  offsets = []
+  pos = 0
+  buf, buf_start = b'', 0
+  with gfile.GFile(path, 'rb') as f:
+    while pos < size:
+      if pos + 8 > buf_start + len(buf):
+        if pos != buf_start + len(buf):
+          f.seek(pos)
+        buf, buf_start = f.read(chunk_size), pos
+        if len(buf) < 8:
+          raise RuntimeError("truncated record header at {} of {}".format(len(offsets), path))
+      offsets.append(pos)
+      pos += 16 + unpack_from(buf, pos - buf_start)[0]
+  if pos != size:
+    raise RuntimeError("truncated record at {} of {}".format(len(offsets) - 1, path))
+  offsets.append(size)
+  return np.asarray(offsets, dtype=np.int64)
+
+
+def get_record_offsets(path: str, index_dir: str = DEFAULT_RECORD_INDEX_DIR) -> np.ndarray:
+  '''
+  record offsets of `path`, scanned once and kept under `index_dir`, named by the path, size and modify
+  time of the file. Offsets of earlier versions of the file are removed when it is scanned again.
+  '''
+  prefix = hashlib.md5(path.encode()).hexdigest() + '-'
+  name = prefix + hashlib.md5(utils.file_signature(path).encode()).hexdigest() + '.npy'
+  index_path = os.path.join(index_dir, name)
+  with file_lock(index_path + '.lock'):
+    if not os.path.exists(index_path):
+      offsets = scan_record_offsets(path)
+      np.save(index_path + '.tmp.npy', offsets)
+      os.rename(index_path + '.tmp.npy', index_path)
+      log.info("Build record index of {}, record num: {}".format(path, len(offsets) - 1))
+      utils.remove_stale_indexes(index_dir, prefix, name)
+  return np.load(index_path)
 
 
 class FileSharding(object):
@@ -28,3 +87,26 @@ class FileSharding(object):
         o_file_path = f.replace(input_path.rstrip("/"), output_path.rstrip("/"), 1)
         shards_to_process.append((f, o_file_path))
     return shards_to_process
+
+
+class RecordRangeSharding(object):
+  '''
+  split files into shards of at most `max_shard_records` records, so one large file is joined by several
+  workers. A shard is (input file, output file, first record, end record), the output file of a split
+  file is suffixed with the index of the range.
+  '''
+  def __init__(self, max_shard_records: int, index_dir: str = DEFAULT_RECORD_INDEX_DIR):
+    self.max_shard_records = max_shard_records
+    self.index_dir = index_dir
+
+  def shard(self, worker_idx, worker_num, input_path, output_path) -> List[tuple]:
+    shards = []
+    utils.assert_valid_dir(input_path)
+    for f in utils.list_data_file_recursively(input_path):
+      o_file_path = f.replace(input_path.rstrip("/"), output_path.rstrip("/"), 1)
+      record_num = len(get_record_offsets(f, self.index_dir)) - 1
+      starts = list(range(0, record_num, self.max_shard_records)) or [0]
+      for j, start in enumerate(starts):
+        end = min(start + self.max_shard_records, record_num)
+        shards.append((f, o_file_path if len(starts) == 1 else '{}-{:05d}'.format(o_file_path, j), start, end))
+    return [s for i, s in enumerate(shards) if i % worker_num == worker_idx]
@@ -14,7 +14,9 @@
 # ==============================================================================
 
 import os
+import shutil
 from tensorflow.python.platform import gfile
+from xfl.data.tfreecord.tfreecord import RecordWriter
 
 
 def assert_valid_dir(path):
@@ -32,3 +34,56 @@ def list_data_file_recursively(path):
         continue
       res.append(os.path.join(tuple[0], f))
   return res
+
+
+def file_signature(path: str) -> str:
+  stat = gfile.Stat(path)
+  return '{}:{}:{}'.format(path, stat.length, stat.mtime_nsec)
+
+
+def remove_stale_indexes(index_dir: str, prefix: str, keep: str):
+  '''
+  remove the indexes under `index_dir` built for earlier versions of a source, they are named by `prefix`
+  of the source and differ from `keep`. Locks are kept, a process may still wait on one.
+  '''
+  for name in os.listdir(index_dir):
+    if not name.startswith(prefix) or name.startswith(keep) or name.endswith('.lock'):
+      continue
+    path = os.path.join(index_dir, name)
+    if os.path.isdir(path):
+      shutil.rmtree(path, ignore_errors=True)
+    else:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+
+class BufferedTFRecordWriter(object):
+  """
+  write framed records to a gfile path, records are framed in python and written by one call every
+  `buffer_size` bytes.
+  """
+  def __init__(self, path, buffer_size=4*1024*1024):
+    self._file = gfile.GFile(path, 'wb')
+    self._encoder = RecordWriter()
+    self._buffer_size = buffer_size
+    self._buf = []
+    self._buf_len = 0
+
+  def write(self, record: bytes):
+    framed = self._encoder.encode_example(record)
+    self._buf.append(framed)
+    self._buf_len += len(framed)
+    if self._buf_len >= self._buffer_size:
+      self.flush()
+
+  def flush(self):
+    if self._buf:
+      self._file.write(b''.join(self._buf))
+      self._buf = []
+      self._buf_len = 0
+
+  def close(self):
+    self.flush()
+    self._file.close()
@@ -14,16 +14,23 @@
 # ==============================================================================
 
 import os
+import struct
 from typing import List
+import crc32c
+import numpy as np
 import tensorflow_io
 import tensorflow as tf
 from tensorflow.python.platform import gfile
 from xfl.data.local_join.aux_table import AuxTable
 from xfl.data.local_join import utils
-from xfl.data.local_join.sharding import FileSharding
+from xfl.data.local_join.sharding import FileSharding, RecordRangeSharding, get_record_offsets, \
+  DEFAULT_RECORD_INDEX_DIR
+from xfl.data.tfreecord.tfreecord import mask_crc
 from xfl.common.logger import log
 tf.compat.v1.enable_eager_execution()
 
+_CRC = struct.Struct('<I')
+
 class LocalJoinWorker(object):
   def __init__(self,
                input_dir: str,
@@ -32,6 +39,9 @@ class LocalJoinWorker(object):
                worker_num: int,
                left_keys: list,
                aux_tables: List[AuxTable],
+               block_size: int = 1024,
+               max_shard_records: int = 0,
+               record_index_dir: str = DEFAULT_RECORD_INDEX_DIR,
                ):
     self.input_dir = input_dir
     self.output_dir = output_dir
@@ -39,6 +49,11 @@ class LocalJoinWorker(object):
     self.worker_idx = worker_idx
     self.worker_num = worker_num
     self.left_keys = left_keys
+    # number of records joined at a time
+    self.block_size = block_size
+    # files of more records are split into record ranges, 0 to shard by whole files
+    self.max_shard_records = max_shard_records
+    self.record_index_dir = record_index_dir
     self.shard_to_process = []
     if not len(left_keys) == len(aux_tables):
       raise RuntimeError('left_keys size must be equal with aux_table size {}, got {}'
@@ -49,13 +64,78 @@ class LocalJoinWorker(object):
       gfile.MakeDirs(self.output_dir)
     for t in self.aux_tables:
       t.open()
-    sharding = FileSharding()
+    if self.max_shard_records > 0:
+      sharding = RecordRangeSharding(self.max_shard_records, self.record_index_dir)
+    else:
+      sharding = FileSharding()
     self.shard_to_process = sharding.shard(worker_idx=self.worker_idx,
                                            worker_num=self.worker_num,
                                            input_path=self.input_dir,
                                            output_path=self.output_dir)
     log.info("worker {} will process {} shards...".format(self.worker_idx, len(self.shard_to_process)))
 
+  def _check_key(self, record: bytes, k: str):
+    example = tf.train.Example()
+    example.ParseFromString(record)
+    if k not in example.features.feature:
+      raise RuntimeError("key col {} is not in input record, please check your data.".format(k))
+    if not example.features.feature[k].WhichOneof('kind')=='bytes_list':
+      raise RuntimeError("key col {} type must be bytes_list, but got {}".format(k, example.features.feature[k].WhichOneof('kind')))
+    if not len(example.features.feature[k].bytes_list.value) == 1:
+      raise RuntimeError("key col {} length must be 1, but got {}".format(k, len(example.features.feature[k].bytes_list.value)))
+
+  def _iter_file_blocks(self, path: str):
+    for records in tf.data.TFRecordDataset(path).batch(self.block_size):
+      yield records.numpy()
+
+  def _iter_range_blocks(self, path: str, start: int, end: int):
+    """
+    records [start, end) of a file, sliced from one read per block by the record offset index. The length
+    and data CRCs of every record are checked, as TFRecordDataset does for whole file shards.
+    """
+    offsets = get_record_offsets(path, self.record_index_dir)
+    with gfile.GFile(path, 'rb') as f:
+      f.seek(int(offsets[start]))
+      for i in range(start, end, self.block_size):
+        j = min(i + self.block_size, end)
+        base = int(offsets[i])
+        data = f.read(int(offsets[j]) - base)
+        records = []
+        for idx, (o, e) in enumerate(zip((offsets[i:j] - base).tolist(), (offsets[i + 1:j + 1] - base).tolist())):
+          length_crc, = _CRC.unpack_from(data, o + 8)
+          data_crc, = _CRC.unpack_from(data, e - 4)
+          record = data[o + 12:e - 4]
+          if mask_crc(crc32c.crc32c(data[o:o + 8])) != length_crc or mask_crc(crc32c.crc32c(record)) != data_crc:
+            raise RuntimeError("corrupted record {} of {}".format(i + idx, path))
+          records.append(record)
+        yield records
+
+  def _iter_blocks(self, path: str, start: int = 0, end: int = None):
+    """
+    yield (records, {key col: keys}) of blocks of `block_size` records, key cols of a block are parsed
+    by one parse_example. Blocks are numpy arrays or lists of serialized records read outside of tf.data,
+    parse_example runs eagerly on each of them. The whole file is read when `end` is None.
+    """
+    spec = {k: tf.io.VarLenFeature(tf.string) for k in set(self.left_keys)}
+    blocks = self._iter_file_blocks(path) if end is None else self._iter_range_blocks(path, start, end)
+    for records in blocks:
+      try:
+        parsed = tf.io.parse_example(records, spec)
+      except tf.errors.InvalidArgumentError:
+        # a key col of another type, the record is found by the per record check
+        for r in records:
+          for k in spec:
+            self._check_key(r, k)
+        raise
+      keys = {}
+      for k, v in parsed.items():
+        rows = v.indices.numpy()[:, 0]
+        if len(rows) != len(records) or np.any(rows != np.arange(len(records))):
+          counts = np.bincount(rows, minlength=len(records))
+          self._check_key(records[int(np.flatnonzero(counts != 1)[0])], k)
+        keys[k] = v.values.numpy().tolist()
+      yield records, keys
+
   def run(self):
     for shard in self.shard_to_process:
       log.info("read file {}, and begin writing to file {}.".format(shard[0], shard[1]))
@@ -63,23 +143,14 @@ class LocalJoinWorker(object):
         raise RuntimeError("file {} does not exist, please check input data.".format(shard[0]))
       if not gfile.Exists(os.path.dirname((shard[1]))):
         gfile.MakeDirs(os.path.dirname(shard[1]))
-      writer = tf.io.TFRecordWriter(shard[1])
-      dataset = tf.data.TFRecordDataset(shard[0])
-      for raw_record in dataset:
-        example = tf.train.Example()
-        example.ParseFromString(raw_record.numpy())
-        for k, t in zip(self.left_keys, self.aux_tables):
-          if k not in example.features.feature:
-            raise RuntimeError("key col {} is not in input record, please check your data.".format(k))
-          if not example.features.feature[k].WhichOneof('kind')=='bytes_list':
-            raise RuntimeError("key col {} type must be bytes_list, but got {}".format(k, example.features.feature[k].WhichOneof('kind')))
-          if not len(example.features.feature[k].bytes_list.value) == 1:
-            raise RuntimeError("key col {} length must be 1, but got {}".format(k, len(example.features.feature[k].bytes_list.value)))
-          example_right_str = t.get(example.features.feature[k].bytes_list.value[0])
-          if example_right_str is not None:
-            example_right = tf.train.Example()
-            example_right.ParseFromString(example_right_str)
-            example.MergeFrom(example_right)
-        writer.write(example.SerializeToString())
+      writer = utils.BufferedTFRecordWriter(shard[1])
+      # whole file shards are (input, output), record range shards add the first and end record
+      for records, keys in self._iter_blocks(shard[0], *shard[2:]):
+        matches = [t.get_batch(keys[k]) for k, t in zip(self.left_keys, self.aux_tables)]
+        # a serialized Example followed by another parses as their merge, so matched aux records
+        # are appended to the record in the order of aux tables, as MergeFrom would apply them
+        for i, record in enumerate(records):
+          right = [m[i] for m in matches if m[i] is not None]
+          writer.write(b''.join([record] + right) if right else record)
       writer.close()
       log.info("write to file {} end.".format(shard[1]))
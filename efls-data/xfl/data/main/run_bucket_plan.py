@@ -0,0 +1,66 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import argparse
+
+from xfl.common.logger import log
+from xfl.data.bucket_plan import BucketPlan, sample_bucket_sizes
+from xfl.data.hash_util import HASH_TYPES
+from xfl.data.incremental import list_input_files
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='make the bucket plan of a data join job by sampling its input')
+  parser.add_argument('-i', '--input_path', type=str,
+                      help='the input_path of data join, should be a local dir, eg `file:///home/xxx`',
+                      required=True)
+  parser.add_argument('-o', '--output_path', type=str,
+                      help='path of the plan json file.',
+                      required=True)
+  parser.add_argument('--hash_col_name', type=str,
+                      help='name of record col which used for generating hash-bucket.',
+                      default='example_id')
+  parser.add_argument('--bucket_num', type=int,
+                      help='number of hash buckets, the bucket_num of server job.',
+                      required=True)
+  parser.add_argument('--inputfile_type', type=str, default='tfrecord',
+                      choices=['tfrecord', 'csv'],
+                      help='the type of input file.')
+  parser.add_argument('--sample_rate', type=float, default=0.01,
+                      help='the fraction of records sampled.')
+  parser.add_argument('--max_bucket_size', type=int, default=None,
+                      help='buckets larger than it are split, default to the mean bucket size.')
+  parser.add_argument('--align', type=int, default=1,
+                      help='the number of join buckets is made a multiple of it, use client2multiserver of client job.')
+  parser.add_argument('--hash_type', type=str, default='murmur3', choices=HASH_TYPES,
+                      help='hash function of bucketing, should be the same as the data join jobs.')
+  parser.add_argument('--peer_plan_path', type=str, default=None,
+                      help='plan made by the other party, the larger sampled size of each bucket is used.')
+
+  args = parser.parse_args()
+  sizes = sample_bucket_sizes(list_input_files(args.input_path), args.hash_col_name, args.bucket_num,
+                              inputfile_type=args.inputfile_type, sample_rate=args.sample_rate,
+                              hash_type=args.hash_type)
+  if args.peer_plan_path:
+    peer_plan = BucketPlan.load(args.peer_plan_path)
+    if peer_plan.hash_type != args.hash_type:
+      raise RuntimeError('peer plan {} uses hash type {}'.format(args.peer_plan_path, peer_plan.hash_type))
+    peer_sizes = peer_plan.get_bucket_sizes()
+    if peer_sizes is None or len(peer_sizes) != len(sizes):
+      raise RuntimeError('peer plan {} does not hold sizes of {} buckets'.format(args.peer_plan_path, len(sizes)))
+    sizes = [max(a, b) for a, b in zip(sizes, peer_sizes)]
+  plan = BucketPlan.build(sizes, max_bucket_size=args.max_bucket_size, align=args.align, hash_type=args.hash_type)
+  plan.save(args.output_path)
+  log.info("Bucket plan of {} hash buckets and {} join buckets is saved to {}"
+           .format(plan.hash_bucket_num, plan.bucket_num, args.output_path))
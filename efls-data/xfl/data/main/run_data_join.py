@@ -16,6 +16,7 @@ import argparse
 
 from xfl.common.argutil import str_to_bool
 from xfl.common.logger import log
+from xfl.data.hash_util import HASH_TYPES
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='data join job start command')
@@ -37,7 +38,7 @@ if __name__ == '__main__':
   parser.add_argument('--bucket_num', type=int,
                       help='bucket number for data join.')
   parser.add_argument('--sample_store_type', type=str, default='memory',
-                      choices=['memory', 'state', 'etcd', 'leveldb'],
+                      choices=['memory', 'state', 'etcd', 'leveldb', 'compact'],
                       help='the backend for sample store.')
   parser.add_argument('--db_root_path', type=str,
                       help='db will be created to this path while using `leveldb` as sample_store_type.',
@@ -89,13 +90,24 @@ if __name__ == '__main__':
                       choices=['rsa', 'ecdh'],
                       help='psi join encrpytion type.')
 
+  parser.add_argument('--psi_process_num', type=int, default=1,
+                      help='the number of processes signing ids of each psi join task.')
+
   parser.add_argument('--need_sort', type=str_to_bool,
                       const=True, nargs='?',
                       help="True if you need sort samples in client. Sorting samples leeds to high cost of memory")
 
+  parser.add_argument('--sort_run_size', type=int, default=1000000,
+                      help='the number of keys sorted in memory by client, longer buckets are sorted by merging runs '
+                           'spilled to db_root_path.')
+
+  parser.add_argument('--sort_run_bytes', type=int, default=64 << 20,
+                      help='the bytes of samples sorted in memory by leveldb server before bulk loading, longer buckets '
+                           'are sorted by merging runs spilled to db_root_path.')
+
   parser.add_argument('--inputfile_type', type=str, default='tfrecord',
-                      choices=['tfrecord', 'csv'],
-                      help='the type of input file.')
+                      choices=['tfrecord', 'csv', 'parquet'],
+                      help='the type of input file, parquet is only supported by local_no_tf client.')
 
   parser.add_argument('--loaddata_parallelism', type=int, default=0,
                       help='the parallelism when loading data.')
@@ -103,23 +115,76 @@ if __name__ == '__main__':
   parser.add_argument('--client2multiserver', type=int, default=1,
                       help='the number of servers that a client correspond to.')
 
+  parser.add_argument('--max_in_flight', type=int, default=0,
+                      help='the number of join batches in flight on a StreamJoin stream, 0 for unary SyncJoin '
+                           'which is retried on rpc errors. ecdh psi client signs as many server blocks at once.')
+
+  parser.add_argument('--use_bloom_filter', type=str_to_bool,
+                      const=True, nargs='?', default=False,
+                      help="True if client drops ids missing in the bloom filter of server bucket before joining.")
+
+  parser.add_argument('--use_async_join', type=str_to_bool,
+                      const=True, nargs='?', default=False,
+                      help="True if sort join client sends the batches of a bucket by concurrent AsyncJoin calls.")
+
+  parser.add_argument('--bloom_filter_error_rate', type=float, default=0.001,
+                      help='false positive rate of the bloom filter built by server.')
+
+  parser.add_argument('--incremental', type=str_to_bool,
+                      const=True, nargs='?', default=False,
+                      help="True if only input files not joined by previous runs of the job are joined, "
+                           "server joins them against the bucket index kept in db_root_path. Client records of "
+                           "previous runs are not joined against new server records.")
+
+  parser.add_argument('--bucket_plan_path', type=str, default=None,
+                      help='the bucket plan json made by run_bucket_plan.py, should be the same for both parties.')
+
+  parser.add_argument('--hash_type', type=str, default='murmur3', choices=HASH_TYPES,
+                      help='hash function picking the bucket of an id, should be the same for both parties.')
+
+  parser.add_argument('--metrics_port', type=int, default=0,
+                      help='serve prometheus metrics of join buckets at http port metrics_port + subtask index, '
+                           '0 for no metrics endpoint.')
+
   parser.add_argument('--local_client', type=str, default='no',
                       choices=['local_no_tf', 'local', 'no'],
                       help='running client without pyflink')
 
+  parser.add_argument('--bucketing_process_num', type=int, default=0,
+                      help='the number of processes bucketizing input of local_no_tf client, 0 for cpu count.')
+  parser.add_argument('--join_worker_num', type=int, default=0,
+                      help='the number of buckets joined at the same time by local_no_tf client, 0 for cpu count.')
+  parser.add_argument('--join_memory_budget_mb', type=int, default=0,
+                      help='memory of buckets joined at the same time by local_no_tf client, 0 for no limit.')
+  parser.add_argument('--channels_per_address', type=int, default=1,
+                      help='the number of grpc channels shared by the buckets of a server address in local_no_tf client.')
+
   args = parser.parse_args()
   conf = {}
+  local_kwargs = {}
   if args.jars and len(args.jars) > 0:
     conf['jars'] = args.jars.split(',')
   if args.local_client == 'local_no_tf':
     from xfl.data.client_no_tf import data_join_pipeline_local_no_tf
     pipeline_func = data_join_pipeline_local_no_tf
+    local_kwargs['bucketing_process_num'] = args.bucketing_process_num
+    local_kwargs['join_worker_num'] = args.join_worker_num
+    local_kwargs['join_memory_budget_mb'] = args.join_memory_budget_mb
+    local_kwargs['channels_per_address'] = args.channels_per_address
   elif args.local_client == 'local':
     from xfl.data.client_local import data_join_pipeline_local
     pipeline_func = data_join_pipeline_local
   else:
     from xfl.data.pipelines import data_join_pipeline
     pipeline_func = data_join_pipeline
+    # options only used by the flink pipeline
+    local_kwargs['psi_type'] = args.psi_type
+    local_kwargs['psi_process_num'] = args.psi_process_num
+    local_kwargs['sort_run_size'] = args.sort_run_size
+    local_kwargs['sort_run_bytes'] = args.sort_run_bytes
+    local_kwargs['db_root_path'] = args.db_root_path
+    local_kwargs['loaddata_parallelism'] = args.loaddata_parallelism
+    local_kwargs['bloom_filter_error_rate'] = args.bloom_filter_error_rate
   pipeline = pipeline_func(
     input_path=args.input_path,
     output_path=args.output_path,
@@ -140,13 +205,18 @@ if __name__ == '__main__':
     rsa_pri_path=args.rsa_pri_path,
     wait_s=args.wait_s,
     use_psi=args.use_psi,
-    psi_type=args.psi_type,
     need_sort=args.need_sort,
-    db_root_path=args.db_root_path,
     inputfile_type=args.inputfile_type,
-    loaddata_parallelism=args.loaddata_parallelism,
     client2multiserver=args.client2multiserver,
-    conf=conf)
+    max_in_flight=args.max_in_flight,
+    use_bloom_filter=args.use_bloom_filter,
+    use_async_join=args.use_async_join,
+    incremental=args.incremental,
+    bucket_plan_path=args.bucket_plan_path,
+    hash_type=args.hash_type,
+    metrics_port=args.metrics_port,
+    conf=conf,
+    **local_kwargs)
   if args.job_plan_output_path:
     with open(args.job_plan_output_path, "w") as f:
       f.write(pipeline.get_execution_plan())
@@ -15,7 +15,8 @@
 
 import argparse
 from xfl.data.local_join.worker import LocalJoinWorker
-from xfl.data.local_join.aux_table import AuxTable
+from xfl.data.local_join.sharding import DEFAULT_RECORD_INDEX_DIR
+from xfl.data.local_join.aux_table import AuxTable, DEFAULT_INDEX_DIR
 import os
 
 if __name__ == "__main__":
@@ -40,17 +41,29 @@ if __name__ == "__main__":
   parser.add_argument('--left_key', action='append')
   parser.add_argument('--right_key', action='append')
   parser.add_argument('--aux_table', action='append')
+  parser.add_argument('--aux_index_dir', type=str, default=DEFAULT_INDEX_DIR,
+                      help='local dir of aux table indexes, shared by the workers of a node')
+  parser.add_argument('--block_size', type=int, default=1024,
+                      help='number of records joined at a time')
+  parser.add_argument('--max_shard_records', type=int, default=0,
+                      help='input files of more records are split into record ranges joined by different workers, '
+                           '0 to shard by whole files')
+  parser.add_argument('--record_index_dir', type=str, default=DEFAULT_RECORD_INDEX_DIR,
+                      help='local dir of input record offset indexes')
 
   args = parser.parse_args()
 
   assert len(args.left_key) == len(args.right_key) == len(args.aux_table)
-  aux_tables = [AuxTable(path=t, key_col=k) for k, t in zip(args.right_key, args.aux_table)]
+  aux_tables = [AuxTable(path=t, key_col=k, index_dir=args.aux_index_dir) for k, t in zip(args.right_key, args.aux_table)]
   worker = LocalJoinWorker(input_dir=args.input_dir,
                            output_dir=args.output_dir,
                            worker_idx=args.worker_idx,
                            worker_num=args.worker_num,
                            left_keys=args.left_key,
-                           aux_tables=aux_tables
+                           aux_tables=aux_tables,
+                           block_size=args.block_size,
+                           max_shard_records=args.max_shard_records,
+                           record_index_dir=args.record_index_dir
                            )
   worker.open()
   worker.run()
\ No newline at end of file
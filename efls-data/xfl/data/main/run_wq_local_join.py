@@ -15,12 +15,47 @@
 
 import argparse
 from xfl.data.local_join.worker import LocalJoinWorker
-from xfl.data.local_join.aux_table import AuxTable
+from xfl.data.local_join.sharding import DEFAULT_RECORD_INDEX_DIR
+from xfl.data.local_join.aux_table import AuxTable, DEFAULT_INDEX_DIR
 from xfl.data.redis.rediswq import RedisWQ
 from xfl.common.logger import log
 from xfl.data.redis.redis_lock import RedisLock
+import multiprocessing
 import time
 
+
+def lease_and_join(args):
+  """
+  lease tasks from the work queue and join them until the queue is empty, a task is the worker index
+  of `split_num` workers.
+  """
+  work_queue = RedisWQ(name=args.job_name, host='redis')
+  # fetch task idx from work queue
+  log.info("Job {} begins to run, session id: {}.".format(args.job_name, work_queue.session_id()))
+  aux_tables = [AuxTable(path=t, key_col=k, index_dir=args.aux_index_dir) for k, t in zip(args.right_key, args.aux_table)]
+  while not work_queue.empty():
+    work_item = work_queue.lease(lease_secs=args.timeout_s, block=False, timeout=None)
+    if work_item is not None:
+      log.info("Begin to process task {}.".format(work_item))
+      worker = LocalJoinWorker(input_dir=args.input_dir,
+                               output_dir=args.output_dir,
+                               worker_idx=int(work_item),
+                               worker_num=args.split_num,
+                               left_keys=args.left_key,
+                               aux_tables=aux_tables,
+                               block_size=args.block_size,
+                               max_shard_records=args.max_shard_records,
+                               record_index_dir=args.record_index_dir
+                               )
+      worker.open()
+      worker.run()
+      work_queue.complete(item=work_item)
+      log.info("Task {} finished. Try to fetch next task.".format(work_item))
+    else:
+      log.info("Waiting other processing workers finish..")
+      time.sleep(5)
+
+
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(description='local join worker start command')
   parser.add_argument('-n', '--job_name', type=str,
@@ -45,6 +80,17 @@ if __name__ == "__main__":
   parser.add_argument('--left_key', action='append')
   parser.add_argument('--right_key', action='append')
   parser.add_argument('--aux_table', action='append')
+  parser.add_argument('--aux_index_dir', type=str, default=DEFAULT_INDEX_DIR,
+                      help='local dir of aux table indexes, shared by the workers of a node')
+  parser.add_argument('--block_size', type=int, default=1024,
+                      help='number of records joined at a time')
+  parser.add_argument('--max_shard_records', type=int, default=0,
+                      help='input files of more records are split into record ranges joined by different tasks, '
+                           '0 to shard by whole files')
+  parser.add_argument('--record_index_dir', type=str, default=DEFAULT_RECORD_INDEX_DIR,
+                      help='local dir of input record offset indexes')
+  parser.add_argument('--process_num', type=int, default=1,
+                      help='number of processes leasing tasks in this worker, 0 for the cpu count')
 
   args = parser.parse_args()
 
@@ -66,27 +112,20 @@ if __name__ == "__main__":
     log.warning("Worker Queue inited with some errors.")
     raise RuntimeError("Worker Queue inited fail.")
 
-  # fetch task idx from work queue
-  log.info("Job {} begins to run, session id: {}.".format(args.job_name, work_queue.session_id()))
-  aux_tables = [AuxTable(path=t, key_col=k) for k, t in zip(args.right_key, args.aux_table)]
-  while not work_queue.empty():
-    work_item = work_queue.lease(lease_secs=args.timeout_s, block=False, timeout=None)
-    if work_item is not None:
-      log.info("Begin to process task {}.".format(work_item))
-      worker = LocalJoinWorker(input_dir=args.input_dir,
-                               output_dir=args.output_dir,
-                               worker_idx=int(work_item),
-                               worker_num=args.split_num,
-                               left_keys=args.left_key,
-                               aux_tables=aux_tables
-                               )
-      worker.open()
-      worker.run()
-      work_queue.complete(item=work_item)
-      log.info("Task {} finished. Try to fetch next task.".format(work_item))
-    else:
-      log.info("Waiting other processing workers finish..")
-      time.sleep(5)
+  process_num = args.process_num if args.process_num > 0 else multiprocessing.cpu_count()
+  if process_num == 1:
+    lease_and_join(args)
+  else:
+    # tensorflow is not fork safe, each process starts a fresh interpreter and leases its own tasks
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=lease_and_join, args=(args,)) for _ in range(process_num)]
+    for p in processes:
+      p.start()
+    for p in processes:
+      p.join()
+    failed = [p.exitcode for p in processes if p.exitcode != 0]
+    if failed:
+      raise RuntimeError("{} of {} join processes failed, exit codes: {}".format(len(failed), process_num, failed))
 
   if lock.acquire(blocking=False):
     log.info("Begin to clear WorkQueue..")
@@ -0,0 +1,106 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from xfl.data.utils import to_bytes, get_sample_store_key
+
+PARQUET_SUFFIX = '.parquet'
+
+
+def column_keys(batch, col_name: str) -> list:
+  '''
+  decode one column of a record batch or table to key bytes, the same as the keys of tfrecord and csv input.
+  '''
+  return [to_bytes(v) for v in batch.column(col_name).to_pylist()]
+
+
+def list_parquet_files(path: str) -> list:
+  res = []
+  for root, dirs, files in os.walk(path):
+    for f in files:
+      if f.endswith(PARQUET_SUFFIX):
+        res.append(os.path.join(root, f))
+  return sorted(res)
+
+
+class ParquetBucketWriter(object):
+  '''
+  write rows of input record batches to per bucket parquet files, rows are moved as column slices
+  and only the hash column is decoded.
+  '''
+  def __init__(self, bucket_path: str, bucket_num: int, file_name: str):
+    self._bucket_path = bucket_path
+    self._bucket_num = bucket_num
+    self._file_name = file_name
+    self._writers = [None] * bucket_num
+
+  def _writer(self, bucket_id: int, schema):
+    if self._writers[bucket_id] is None:
+      bucket_dir = os.path.join(self._bucket_path, str(bucket_id))
+      os.makedirs(bucket_dir, exist_ok=True)
+      self._writers[bucket_id] = pq.ParquetWriter(os.path.join(bucket_dir, self._file_name), schema)
+    return self._writers[bucket_id]
+
+  def write_file(self, path: str, hash_col_name: str, key_selector, batch_size: int = 65536):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+      buckets = key_selector.get_keys(column_keys(batch, hash_col_name))
+      order = np.argsort(buckets, kind='stable')
+      bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+      for idx in np.split(order, bounds):
+        if len(idx) > 0:
+          self._writer(int(buckets[idx[0]]), batch.schema).write_table(
+            pa.Table.from_batches([batch.take(pa.array(idx))]))
+
+  def close(self):
+    for w in self._writers:
+      if w is not None:
+        w.close()
+
+
+class ParquetBucketTable(object):
+  '''
+  rows of one bucket in memory, indexed by sample store key. Joined rows are written by `take`
+  without decoding the other columns.
+  '''
+  def __init__(self, bucket_dir: str, hash_col_name: str, sort_col_name: str):
+    files = list_parquet_files(bucket_dir)
+    self._table = pa.concat_tables([pq.read_table(f) for f in files]) if files else None
+    self._hash_col_name = hash_col_name
+    self._sort_col_name = sort_col_name
+
+  def num_rows(self) -> int:
+    return 0 if self._table is None else self._table.num_rows
+
+  def iter_keys(self):
+    '''
+    @return: generator of (sample store key, row index).
+    '''
+    if self._table is None:
+      return
+    hash_keys = column_keys(self._table, self._hash_col_name)
+    sort_keys = column_keys(self._table, self._sort_col_name)
+    for i, (h, s) in enumerate(zip(hash_keys, sort_keys)):
+      yield get_sample_store_key(h, s), i
+
+  def take(self, row_indices: list):
+    return self._table.take(pa.array(row_indices, type=pa.int64()))
+
+  def open_writer(self, path: str):
+    return pq.ParquetWriter(path, self._table.schema)
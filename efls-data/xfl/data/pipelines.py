@@ -24,10 +24,13 @@ from xfl.common.common import RunMode
 from xfl.common.logger import log
 from xfl.data.connectors import input_sink, input_keyed_source
 from xfl.data.functions import DefaultKeySelector, ClientSortJoinFunc, ServerSortJoinFunc, ServerPsiJoinFunc, \
-  ClientPsiJoinFunc, ClientBatchJoinFunc
+  ClientPsiJoinFunc, ClientBatchJoinFunc, PlanKeySelector, BucketStartKeySelector
+from xfl.data.bucket_plan import BucketPlan
 
 from xfl.data.ecdh_psi import ClientEcdhJoinFunc, ServerEcdhJoinFunc
+from xfl.data.incremental import IngestManifest, list_input_files, bucket_start_markers
 from xfl.data.store.sample_kv_store import DictSampleKvStore
+from xfl.data.store.compact_kv_store import CompactSampleKvStore
 from xfl.data.store.flink_state_kv_store import FlinkStateKvStore
 from xfl.data.store.etcd_kv_store import EtcdSampleKvStore
 from xfl.data.store.level_db_kv_store import LevelDbKvStore
@@ -38,7 +41,8 @@ SAMPLE_STORE_TYPE = {
   "memory": DictSampleKvStore,
   "state": FlinkStateKvStore,
   "etcd": EtcdSampleKvStore,
-  "leveldb": LevelDbKvStore
+  "leveldb": LevelDbKvStore,
+  "compact": CompactSampleKvStore
 }
 
 def get_flink_batch_env(conf: dict = {}) -> StreamExecutionEnvironment:
@@ -77,19 +81,65 @@ class data_join_pipeline(object):
                inputfile_type: str = 'tfrecord',
                loaddata_parallelism: int = 0,
                client2multiserver: int = 1,
+               max_in_flight: int = 0,
+               use_bloom_filter: bool = False,
+               use_async_join: bool = False,
+               bloom_filter_error_rate: float = 0.001,
+               psi_process_num: int = 1,
+               sort_run_size: int = 1000000,
+               sort_run_bytes: int = 64 << 20,
+               incremental: bool = False,
+               bucket_plan_path: str = None,
+               hash_type: str = 'murmur3',
+               metrics_port: int = 0,
                conf: dict = {}):
+    if inputfile_type not in ('tfrecord', 'csv'):
+      raise RuntimeError('input file type {} is only supported by local client'.format(inputfile_type))
     self._job_name = job_name
+    self._incremental = incremental
+    part_prefix = None
+    if incremental:
+      if use_psi:
+        raise RuntimeError('incremental join does not support psi')
+      if is_server and sample_store_type != 'leveldb':
+        raise RuntimeError('incremental join server requires leveldb sample store')
+      # only input files not joined by previous runs are read
+      self._manifest = IngestManifest(db_root_path, job_name, is_server, bucket_num, hash_type)
+      self._new_files = self._manifest.new_files(list_input_files(input_path))
+      log.info('incremental run {}, new input file num: {}'.format(self._manifest.get_run_id(), len(self._new_files)))
+      input_path = self._new_files
+      part_prefix = 'part-run{}'.format(self._manifest.get_run_id())
+    bucket_plan = None
+    hash_bucket_num = bucket_num if is_server else bucket_num * client2multiserver
+    if bucket_plan_path is not None:
+      # join buckets follow the plan shared by both parties, bucket_num is its hash bucket num
+      bucket_plan = BucketPlan.load(bucket_plan_path)
+      if bucket_plan.hash_type != hash_type:
+        raise RuntimeError('hash type of plan {} does not match {}'.format(bucket_plan.hash_type, hash_type))
+      if bucket_plan.hash_bucket_num != hash_bucket_num:
+        raise RuntimeError('hash bucket num of plan {} does not match {}'.format(bucket_plan.hash_bucket_num,
+                                                                                hash_bucket_num))
+      bucket_num = bucket_plan.bucket_num if is_server else bucket_plan.bucket_num // client2multiserver
     env = get_flink_batch_env(conf)
     self._loaddata_parallelism = loaddata_parallelism
     if self._loaddata_parallelism == 0:
       self._loaddata_parallelism = bucket_num
     env.set_max_parallelism(max(bucket_num, self._loaddata_parallelism))
     env.set_parallelism(bucket_num)
-    ds = env.from_source(
-      source=input_keyed_source(input_path, hash_col_name, sort_col_name, inputfile_type),
-      watermark_strategy=WatermarkStrategy.for_monotonous_timestamps(),
-      type_info=Types.TUPLE([TYPE_BYTE_ARRAY] * 3),
-      source_name=job_name + "_tf_record_source_with_key").set_parallelism(self._loaddata_parallelism)
+    ds = None
+    if not incremental or self._new_files:
+      ds = env.from_source(
+        source=input_keyed_source(input_path, hash_col_name, sort_col_name, inputfile_type),
+        watermark_strategy=WatermarkStrategy.for_monotonous_timestamps(),
+        type_info=Types.TUPLE([TYPE_BYTE_ARRAY] * 3),
+        source_name=job_name + "_tf_record_source_with_key").set_parallelism(self._loaddata_parallelism)
+    if incremental:
+      # every bucket gets a marker, so a bucket without new records still joins: the server serves
+      # its persisted index and the client finishes the join. Markers carry no timestamp like the
+      # records of the file source, so they do not start a bucket before its records are read.
+      markers = env.from_collection(bucket_start_markers(bucket_num), type_info=Types.TUPLE([TYPE_BYTE_ARRAY] * 3)) \
+        .assign_timestamps_and_watermarks(WatermarkStrategy.for_monotonous_timestamps())
+      ds = markers if ds is None else ds.union(markers)
 
     log.info('=================Data join pipeline info================')
     log.info('job_name: %s'%job_name)
@@ -101,10 +151,20 @@ class data_join_pipeline(object):
     log.info('use_psi: %s'%use_psi)
     log.info('need_sort: %s'%need_sort)
     log.info('psi_type: %s'%psi_type)
+    log.info('psi_process_num: %d'%psi_process_num)
     log.info('sample_store_type: %s'%sample_store_type)
     log.info('db_root_path: %s'%db_root_path)
     log.info('client2multiserver num: %d'% client2multiserver)
     log.info('inputfile_type: %s'% inputfile_type)
+    log.info('max_in_flight: %d'% max_in_flight)
+    log.info('use_bloom_filter: %s'% use_bloom_filter)
+    log.info('use_async_join: %s'% use_async_join)
+    log.info('sort_run_size: %d'% sort_run_size)
+    log.info('sort_run_bytes: %d'% sort_run_bytes)
+    log.info('incremental: %s'% incremental)
+    log.info('bucket_plan_path: %s'% bucket_plan_path)
+    log.info('hash_type: %s'% hash_type)
+    log.info('metrics_port: %d'% metrics_port)
     log.info('========================================================')
     tls_crt = b''
     if tls_crt_path is not None:
@@ -135,7 +195,13 @@ class data_join_pipeline(object):
           raise RuntimeError('Unsupported psi type %s'%psi_type)
       else:
         server_func = ServerSortJoinFunc
-      ds = ds.key_by(DefaultKeySelector(bucket_num=bucket_num), key_type=Types.INT()) \
+      if bucket_plan is None:
+        key_selector = DefaultKeySelector(bucket_num=bucket_num, hash_type=hash_type)
+      else:
+        key_selector = PlanKeySelector(bucket_plan)
+      if incremental:
+        key_selector = BucketStartKeySelector(key_selector)
+      ds = ds.key_by(key_selector, key_type=Types.INT()) \
         .process(server_func(
         job_name=job_name,
         bucket_num=bucket_num,
@@ -147,7 +213,12 @@ class data_join_pipeline(object):
         rsa_public_key_bytes=rsa_pub,
         rsa_private_key_bytes=rsa_pri,
         inputfile_type=inputfile_type,
-        db_root_path=db_root_path),
+        db_root_path=db_root_path,
+        bloom_filter_error_rate=bloom_filter_error_rate,
+        psi_process_num=psi_process_num,
+        incremental=incremental,
+        metrics_port=metrics_port,
+        sort_run_bytes=sort_run_bytes),
         output_type=output_type) \
         .name(job_name + "_merge_sort_join_server")
     else:
@@ -164,7 +235,14 @@ class data_join_pipeline(object):
           client_func = ClientSortJoinFunc
         else:
           client_func = ClientBatchJoinFunc
-      ds = ds.key_by(DefaultKeySelector(bucket_num=bucket_num, client2multiserver=client2multiserver), key_type=Types.INT()) \
+      if bucket_plan is None:
+        key_selector = DefaultKeySelector(bucket_num=bucket_num, client2multiserver=client2multiserver,
+                                          hash_type=hash_type)
+      else:
+        key_selector = PlanKeySelector(bucket_plan, client2multiserver=client2multiserver)
+      if incremental:
+        key_selector = BucketStartKeySelector(key_selector)
+      ds = ds.key_by(key_selector, key_type=Types.INT()) \
         .process(client_func(
         job_name=job_name,
         peer_host=host,
@@ -178,15 +256,27 @@ class data_join_pipeline(object):
         tls_crt=tls_crt,
         client2multiserver=client2multiserver,
         inputfile_type=inputfile_type,
-        db_root_path=db_root_path),
+        db_root_path=db_root_path,
+        max_in_flight=max_in_flight,
+        use_bloom_filter=use_bloom_filter,
+        use_async_join=use_async_join,
+        psi_process_num=psi_process_num,
+        sort_run_size=sort_run_size,
+        bucket_plan=bucket_plan,
+        hash_type=hash_type,
+        metrics_port=metrics_port),
         output_type=output_type) \
         .name(job_name + "_merge_sort_join_cli")
 
-    ds.sink_to(input_sink(output_path, 0, 1, part_size=file_part_size, inputfile_type=inputfile_type))
+    ds.sink_to(input_sink(output_path, 0, 1, part_size=file_part_size, inputfile_type=inputfile_type,
+                          part_prefix=part_prefix))
     self._env = env
 
   def run(self):
-    return self._env.execute(self._job_name)
+    res = self._env.execute(self._job_name)
+    if self._incremental:
+      self._manifest.commit(self._new_files)
+    return res
 
   def get_execution_plan(self):
     return self._env.get_execution_plan()
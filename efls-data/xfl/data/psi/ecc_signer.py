@@ -18,12 +18,25 @@ import os
 from hashlib import sha256
 from curve25519 import _curve25519
 
+from xfl.data.psi.process_pool import BatchProcessPool
+
 
 def _hash_value(value):
     return sha256(b"curve25519"+value).digest()
 
+def _sign_list(values, private):
+    make_shared = _curve25519.make_shared
+    return [make_shared(private, v) for v in values]
+
+def _sign_hash_list(values, private, hashfunc):
+    make_shared = _curve25519.make_shared
+    return [make_shared(private, hashfunc(v)) for v in values]
+
 class EccSigner(object):
-    def __init__(self, secret=None, hashfunc=None):
+    '''
+    `process_num` > 1 spreads the batch apis over worker processes, `hashfunc` should be picklable then.
+    '''
+    def __init__(self, secret=None, hashfunc=None, process_num=1):
         if secret is not None:
             if not isinstance(secret, bytes) or len(secret) != 32:
                 raise TypeError("secret must be 32-byte string")
@@ -39,6 +52,7 @@ class EccSigner(object):
             t = self._hashfunc(b'test')
             if not isinstance(t, bytes) or len(t) != 32:
                 raise TypeError("the return value of hashfunc  must be 32 bytes!")
+        self._pool = BatchProcessPool(process_num, min_chunk_size=256)
 
     '''
     sign random baytes array, return 32-bytes
@@ -54,3 +68,18 @@ class EccSigner(object):
         #if not isinstance(value, bytes) or len(value) != 32:
         #    raise TypeError("secret must be 32-byte string")
         return _curve25519.make_shared(self._private, value)
+
+    '''
+    sign a list of random bytes arrays, return list of 32-bytes
+    '''
+    def sign_hash_batch(self, values):
+        return self._pool.map_batch(_sign_hash_list, list(values), self._private, self._hashfunc)
+
+    '''
+    sign a list of 32-bytes arrays, return list of 32-bytes
+    '''
+    def sign_batch(self, values):
+        return self._pool.map_batch(_sign_list, list(values), self._private)
+
+    def close(self):
+        self._pool.close()
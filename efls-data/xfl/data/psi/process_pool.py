@@ -0,0 +1,68 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+class BatchProcessPool(object):
+  '''
+  Splits a batch over `process_num` worker processes, signing holds the GIL so threads do not help.
+  Workers are started lazily, so the owner can still be pickled before its first batch.
+  '''
+  def __init__(self, process_num: int = 1, min_chunk_size: int = 1):
+    self._process_num = process_num
+    self._min_chunk_size = max(1, min_chunk_size)
+    self._pool = None
+    # the pool is created once even when threads, e.g. grpc handlers, map their first batches together
+    self._pool_lock = threading.Lock()
+
+  def map_batch(self, func, ids, *args):
+    '''
+    call `func(chunk, *args)` on chunks of `ids` and concatenate the returned lists.
+    `func` and `args` must be picklable.
+    '''
+    chunk_num = min(self._process_num, len(ids) // self._min_chunk_size)
+    if chunk_num <= 1:
+      return func(ids, *args)
+    with self._pool_lock:
+      if self._pool is None:
+        # forking a process with running grpc threads is unsafe, start clean workers instead
+        self._pool = ProcessPoolExecutor(max_workers=self._process_num,
+                                         mp_context=multiprocessing.get_context('spawn'))
+      pool = self._pool
+    chunk_size = (len(ids) + chunk_num - 1) // chunk_num
+    futures = [pool.submit(func, ids[i:i + chunk_size], *args) for i in range(0, len(ids), chunk_size)]
+    res = []
+    for f in futures:
+      res.extend(f.result())
+    return res
+
+  def close(self):
+    with self._pool_lock:
+      pool, self._pool = self._pool, None
+    if pool is not None:
+      pool.shutdown()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['_pool'] = None
+    del state['_pool_lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._pool_lock = threading.Lock()
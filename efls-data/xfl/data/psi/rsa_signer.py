@@ -24,6 +24,7 @@ import rsa
 from cityhash import CityHash64 as OneWayHash
 from gmpy2 import powmod, divm
 
+from xfl.data.psi.process_pool import BatchProcessPool
 from xfl.service.data_join_client import DataJoinClient
 
 
@@ -33,12 +34,52 @@ def bytes2int(byte, byteorder='little'):
 def int2bytes(digit, byte_len, byteorder='little'):
   return int(digit).to_bytes(byte_len, byteorder)
 
+def _crt_sign_list(ids, crt_key):
+  '''
+  x^d mod n from two half size exponentiations, crt_key is (p, q, d mod (p-1), d mod (q-1), q^-1 mod p).
+  '''
+  p, q, exp1, exp2, coef = crt_key
+  res = []
+  for x in ids:
+    m2 = powmod(x, exp2, q)
+    res.append(int(m2 + (coef * (powmod(x, exp1, p) - m2)) % p * q))
+  return res
+
+def _sign_ids(ids, crt_key):
+  hashed_ids = RsaSigner.fdh_list(ids, True)
+  signed_hashed_ids = _crt_sign_list(hashed_ids, crt_key)
+  return RsaSigner.oneway_hash_list(signed_hashed_ids)
+
+def _sign_blinded_ids(ids, crt_key, byte_len):
+  signed_ids = _crt_sign_list([bytes2int(item) for item in ids], crt_key)
+  return [b''.join(int2bytes(x, byte_len) for x in signed_ids)]
+
+def _blind_ids(ids, e, n):
+  rand = random.SystemRandom()
+  byte_len = n.bit_length() // 8
+  res = []
+  for x in RsaSigner.fdh_list(ids, True):
+    r = rand.getrandbits(256)
+    res.append((int2bytes((powmod(powmod(r, e, n) * x, 1, n)).digits(), byte_len), r))
+  return res
+
+def _deblind_ids(pairs, n):
+  signed_hashed_ids = [int(divm(bytes2int(x), r, n).digits()) for x, r in pairs]
+  return RsaSigner.oneway_hash_list(signed_hashed_ids)
+
+
 class RsaSigner(object):
   """
   RSA signer base
   """
-  def __init__(self):
-    pass
+  def __init__(self, process_num: int = 1):
+    self._pool = BatchProcessPool(process_num, min_chunk_size=8)
+
+  def _map_batch(self, func, ids, *args):
+    return self._pool.map_batch(func, ids, *args)
+
+  def close(self):
+    self._pool.close()
 
   @staticmethod
   def load_key(key_bytes, is_public):
@@ -73,51 +114,53 @@ class RsaSigner(object):
 
 
 class ServerRsaSigner(RsaSigner):
-  def __init__(self, rsa_public_key_bytes: str = None, rsa_private_key_bytes: str = None, ):
+  def __init__(self, rsa_public_key_bytes: str = None, rsa_private_key_bytes: str = None, process_num: int = 1):
     '''
       When keys are not specified, RsaSignner will generate a pair of keys everytime.
     '''
+    super().__init__(process_num)
     if rsa_public_key_bytes is None or rsa_private_key_bytes is None:
       self.pub_key_bytes_, self.prv_key_bytes_ = self.generate_rsa_keys()
     else:
       self.pub_key_bytes_, self.prv_key_bytes_ = rsa_public_key_bytes, rsa_private_key_bytes
     self.rsa_public_key_ = RsaSigner.load_key(self.pub_key_bytes_, True)
     self.rsa_private_key_ = RsaSigner.load_key(self.prv_key_bytes_, False)
+    key = self.rsa_private_key_
+    self._crt_key = (key.p, key.q, key.exp1, key.exp2, key.coef)
+    self._byte_len = key.n.bit_length() // 8
 
   def sign_func(self, ids):
-    hashed_ids = RsaSigner.fdh_list(ids, True)
-    signed_hashed_ids = RsaSigner.rsa_sign_list(hashed_ids, self.rsa_private_key_.d, self.rsa_private_key_.n)
-    hashed_signed_hashed_ids = RsaSigner.oneway_hash_list(signed_hashed_ids)
-    return hashed_signed_hashed_ids
+    return self._map_batch(_sign_ids, ids, self._crt_key)
+
+  def sign_blinded_ids_packed(self, ids) -> bytes:
+    '''
+    sign blinded ids, return the signatures packed in `get_signed_id_len()` bytes each.
+    '''
+    return b''.join(self._map_batch(_sign_blinded_ids, list(ids), self._crt_key, self._byte_len))
 
   def sign_blinded_ids_from_client(self, ids):
-    d, n = self.rsa_private_key_.d, self.rsa_private_key_.n
-    byte_len = n.bit_length() // 8
-    return [int2bytes(powmod(bytes2int(item), d, n).digits(), byte_len) for item in ids]
+    packed = self.sign_blinded_ids_packed(ids)
+    return [packed[i:i + self._byte_len] for i in range(0, len(packed), self._byte_len)]
+
+  def get_signed_id_len(self):
+    return self._byte_len
 
   def get_public_key_bytes(self):
     return self.pub_key_bytes_
 
 class ClientRsaSigner(RsaSigner):
-  def __init__(self, rsa_public_key_bytes):
+  def __init__(self, rsa_public_key_bytes, process_num: int = 1):
+    super().__init__(process_num)
     self.rsa_public_key_ = RsaSigner.load_key(rsa_public_key_bytes, True)
 
   def sign_func(self, ids, data_join_cli: DataJoinClient, bucket_id):
-    hashed_ids = RsaSigner.fdh_list(ids, True)
-    blinded_hashed_ids, blind_numbers = self._blind_ids(hashed_ids)
+    blinded_hashed_ids, blind_numbers = self._blind_ids(ids)
     signed_blinded_hashed_ids = data_join_cli.sign_blinded_ids_from_server(blinded_hashed_ids, bucket_id)
     return self._deblind_signed_ids(signed_blinded_hashed_ids, blind_numbers)
 
   def _blind_ids(self, ids):
-    e, n = self.rsa_public_key_.e, self.rsa_public_key_.n
-    blind_numbers = [random.SystemRandom().getrandbits(256) for _ in range(len(ids))]
-    byte_len = n.bit_length() // 8
-    blinded_hashed_ids = [int2bytes((powmod(powmod(r, e, n) * x, 1, n)).digits(), byte_len) for x, r in zip(ids, blind_numbers)]
-    return blinded_hashed_ids, blind_numbers
+    res = self._map_batch(_blind_ids, ids, self.rsa_public_key_.e, self.rsa_public_key_.n)
+    return [x for x, _ in res], [r for _, r in res]
 
   def _deblind_signed_ids(self, signed_blinded_hashed_ids, blind_numbers):
-    n = self.rsa_public_key_.n
-    signed_blinded_hashed_ids = [bytes2int(item) for item in signed_blinded_hashed_ids]
-    signed_hashed_ids = [int(divm(x, r, n).digits()) for x, r in zip(signed_blinded_hashed_ids, blind_numbers)]
-    hashed_signed_hashed_ids = RsaSigner.oneway_hash_list(signed_hashed_ids)
-    return hashed_signed_hashed_ids
+    return self._map_batch(_deblind_ids, list(zip(signed_blinded_hashed_ids, blind_numbers)), self.rsa_public_key_.n)
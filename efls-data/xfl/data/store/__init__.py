@@ -15,3 +15,4 @@
 
 from xfl.data.store.sample_kv_store import DictSampleKvStore
 from xfl.data.store.level_db_kv_store import LevelDbKvStore
+from xfl.data.store.compact_kv_store import CompactSampleKvStore
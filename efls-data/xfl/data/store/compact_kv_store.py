@@ -0,0 +1,129 @@
+# Copyright 2021 Alibaba Group Holding Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from abc import ABCMeta
+from array import array
+
+import mmh3
+
+from xfl.data.store.sample_kv_store import SampleKvStore
+
+
+class CompactSampleKvStore(SampleKvStore, metaclass=ABCMeta):
+  '''
+  In-memory store without per record python objects. Each record is a key followed by its
+  value in one bytearray arena, flat arrays keep record offsets and lengths, and an open
+  addressing index of 32-bit key fingerprints maps keys to records. Besides the payload a
+  record costs 16 bytes of tables and 13 to 27 bytes of index.
+  Overwriting a value appends the record again, the old copy stays in the arena until `clear`.
+  '''
+  def __init__(self, capacity: int = 1024) -> None:
+    super().__init__()
+    self._init_capacity = capacity
+    self.clear()
+
+  def clear(self):
+    self._arena = bytearray()
+    self._offs = array('q')
+    self._key_lens = array('i')
+    self._val_lens = array('i')
+    self._reset_index(self._init_capacity * 2)
+
+  def _reset_index(self, slot_num: int):
+    slot_num = 1 << max(4, (slot_num - 1).bit_length())
+    self._mask = slot_num - 1
+    self._fps = array('I', bytes(4 * slot_num))
+    # record index + 1 of each slot, 0 for empty slots
+    self._slots = array('i', bytes(4 * slot_num))
+
+  def _find(self, key: bytes, fp: int):
+    '''
+    @return: (slot, record index), record index is -1 if key does not exist and slot is where it goes.
+    '''
+    slot = fp & self._mask
+    fps, slots, offs, arena = self._fps, self._slots, self._offs, self._arena
+    key_len = len(key)
+    while True:
+      idx = slots[slot] - 1
+      if idx < 0:
+        return slot, -1
+      if fps[slot] == fp and self._key_lens[idx] == key_len and arena[offs[idx]:offs[idx] + key_len] == key:
+        return slot, idx
+      slot = (slot + 1) & self._mask
+
+  def _rehash(self):
+    old_fps, old_slots = self._fps, self._slots
+    self._reset_index(len(old_slots) * 2)
+    fps, slots, mask = self._fps, self._slots, self._mask
+    for fp, idx in zip(old_fps, old_slots):
+      if not idx:
+        continue
+      slot = fp & mask
+      while slots[slot]:
+        slot = (slot + 1) & mask
+      fps[slot] = fp
+      slots[slot] = idx
+
+  def _append(self, key, value):
+    self._offs.append(len(self._arena))
+    self._key_lens.append(len(key))
+    self._val_lens.append(len(value))
+    self._arena += key
+    self._arena += value
+
+  def put(self, key, value) -> bool:
+    fp = mmh3.hash(key, signed=False)
+    slot, idx = self._find(key, fp)
+    if idx >= 0:
+      self._offs[idx] = len(self._arena)
+      self._val_lens[idx] = len(value)
+      self._arena += key
+      self._arena += value
+      return False
+    self._append(key, value)
+    self._fps[slot] = fp
+    self._slots[slot] = len(self._offs)
+    # linear probing stays short under 0.6 load factor
+    if len(self._offs) * 5 > len(self._slots) * 3:
+      self._rehash()
+    return True
+
+  def exists(self, ids: list) -> list:
+    find, hash_func = self._find, mmh3.hash
+    return [find(i, hash_func(i, signed=False))[1] >= 0 for i in ids]
+
+  def get(self, key):
+    _, idx = self._find(key, mmh3.hash(key, signed=False))
+    if idx < 0:
+      return None
+    off = self._offs[idx] + self._key_lens[idx]
+    return bytes(self._arena[off:off + self._val_lens[idx]])
+
+  def _key(self, idx: int) -> bytes:
+    off = self._offs[idx]
+    return bytes(self._arena[off:off + self._key_lens[idx]])
+
+  def keys(self) -> list:
+    return [self._key(i) for i in range(len(self._offs))]
+
+  def size(self) -> int:
+    return len(self._offs)
+
+  def __iter__(self):
+    self._it = iter(range(len(self._offs)))
+    return self
+
+  def __next__(self):
+    return self._key(next(self._it))
@@ -13,32 +13,129 @@
 # limitations under the License.
 # ==============================================================================
 
+import threading
 from abc import ABCMeta
 
 import etcd3
+from etcd3 import etcdrpc
+from etcd3.utils import increment_last_byte
 
 from xfl.data.store.sample_kv_store import SampleKvStore
+from xfl.data.utils import to_bytes
+
+# the default limit of operations in one etcd transaction, `--max-txn-ops` of the etcd server
+ETCD_MAX_TXN_OPS = 128
 
 
 class EtcdSampleKvStore(SampleKvStore, metaclass=ABCMeta):
-  def __init__(self, client: etcd3.Etcd3Client, prefix: str) -> None:
+  '''
+  samples stored as keys `prefix/id` of etcd. Puts are buffered and written by transactions of
+  `txn_ops` puts, existence of up to `txn_ops` ids is checked by one transaction of count only ranges,
+  and keys are iterated by pages of `page_size` keys.
+  The count of keys is read once and then maintained from the previous values of puts, so writes of
+  other clients to the same prefix are not counted.
+  '''
+  def __init__(self, client: etcd3.Etcd3Client, prefix, txn_ops: int = ETCD_MAX_TXN_OPS,
+               page_size: int = 10000) -> None:
+    super().__init__()
     self._cli = client
-    self._prefix = prefix
+    self._prefix = to_bytes(prefix)
+    self._key_prefix = self._prefix + b'/'
+    self._range_end = increment_last_byte(self._key_prefix)
+    self._txn_ops = txn_ops
+    self._page_size = page_size
+    self._pending = {}
+    self._lock = threading.Lock()
+    self._size = None
 
   def _get_key(self, id):
-    return self._prefix + b'/' + id
+    return self._key_prefix + id
 
-  def exists(self, ids: list) -> list:
-    return [len(list(self._cli.get_prefix(self._get_key(i), keys_only=True))) > 0 for i in ids]
+  def _txn(self, ops: list):
+    request = etcdrpc.TxnRequest(compare=[], success=ops, failure=[])
+    return self._cli.kvstub.Txn(request, self._cli.timeout, credentials=self._cli.call_credentials,
+                                metadata=self._cli.metadata)
 
-  def keys(self) -> list:
-    return [i[1].key[len(self._prefix) + 1:] for i in self._cli.get_prefix(self._prefix, keys_only=True)]
+  def _count(self) -> int:
+    request = etcdrpc.RangeRequest(key=self._key_prefix, range_end=self._range_end, count_only=True)
+    return self._cli.kvstub.Range(request, self._cli.timeout, credentials=self._cli.call_credentials,
+                                  metadata=self._cli.metadata).count
+
+  def _flush(self):
+    with self._lock:
+      if not self._pending:
+        return
+      if self._size is None:
+        self._size = self._count()
+      items = list(self._pending.items())
+      # keys are unique in a transaction, the pending dict dedups puts of the same key
+      for i in range(0, len(items), self._txn_ops):
+        ops = [etcdrpc.RequestOp(request_put=etcdrpc.PutRequest(key=self._get_key(k), value=v, prev_kv=True))
+               for k, v in items[i:i + self._txn_ops]]
+        resp = self._txn(ops)
+        self._size += sum(1 for r in resp.responses if not r.response_put.HasField('prev_kv'))
+      self._pending = {}
+
+  def put(self, key, value) -> bool:
+    res = True
+    with self._lock:
+      self._pending[key] = value
+      full = len(self._pending) >= self._txn_ops
+    if full:
+      self._flush()
+    return res
+
+  def exists(self, ids: list) -> list:
+    self._flush()
+    res = []
+    for i in range(0, len(ids), self._txn_ops):
+      ops = [etcdrpc.RequestOp(request_range=etcdrpc.RangeRequest(key=self._get_key(id), count_only=True))
+             for id in ids[i:i + self._txn_ops]]
+      res.extend(r.response_range.count > 0 for r in self._txn(ops).responses)
+    return res
 
   def get(self, key):
+    with self._lock:
+      value = self._pending.get(key)
+    if value is not None:
+      return value
     return self._cli.get(self._get_key(key))[0]
 
-  def put(self, key, value) -> bool:
-    self._cli.put(self._get_key(key), value)
+  def _iter_keys(self):
+    start = self._key_prefix
+    while True:
+      request = etcdrpc.RangeRequest(key=start, range_end=self._range_end, limit=self._page_size,
+                                     keys_only=True, sort_order=etcdrpc.RangeRequest.ASCEND,
+                                     sort_target=etcdrpc.RangeRequest.KEY)
+      resp = self._cli.kvstub.Range(request, self._cli.timeout, credentials=self._cli.call_credentials,
+                                    metadata=self._cli.metadata)
+      for kv in resp.kvs:
+        yield kv.key[len(self._key_prefix):]
+      if not resp.more or not resp.kvs:
+        return
+      start = resp.kvs[-1].key + b'\x00'
+
+  def keys(self) -> list:
+    self._flush()
+    return list(self._iter_keys())
 
   def size(self) -> int:
-    return len(self.keys())
+    self._flush()
+    with self._lock:
+      if self._size is None:
+        self._size = self._count()
+      return self._size
+
+  def clear(self):
+    with self._lock:
+      self._pending = {}
+      self._cli.delete_prefix(self._key_prefix)
+      self._size = 0
+
+  def __iter__(self):
+    self._flush()
+    self._it = self._iter_keys()
+    return self
+
+  def __next__(self):
+    return next(self._it)
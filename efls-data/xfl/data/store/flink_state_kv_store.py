@@ -17,37 +17,99 @@ import threading
 from abc import ABCMeta
 
 import cardinality
-from pyflink.datastream.state import MapState
+from pyflink.common.typeinfo import Types
+from pyflink.datastream.functions import RuntimeContext
+from pyflink.datastream.state import MapState, MapStateDescriptor
 
 from xfl.common.logger import log
 from xfl.data.store.sample_kv_store import SampleKvStore
 
 
 class FlinkStateKvStore(SampleKvStore, metaclass=ABCMeta):
-  def __init__(self, state: MapState):
+  '''
+  samples kept in the keyed MapState of the current key. Puts are buffered and written by one `put_all`
+  every `write_batch_size` keys. The count of unique keys is scanned from the state when asked and kept
+  until the next write, puts do not look keys up to maintain it.
+  The state client is not thread safe, every thread reads and writes through the handler it added.
+  '''
+  def __init__(self, state: MapState, write_batch_size: int = 10000):
+    super().__init__()
     self._state_handler = {threading.current_thread().ident: state}
+    self._write_batch_size = write_batch_size
+    self._pending = {}
+    self._lock = threading.RLock()
+    self._size = None
+
+  @classmethod
+  def from_runtime_context(cls, runtime_context: RuntimeContext, name: str,
+                           write_batch_size: int = 10000) -> 'FlinkStateKvStore':
+    byte_array = Types.PRIMITIVE_ARRAY(Types.BYTE())
+    return cls(runtime_context.get_map_state(MapStateDescriptor(name, byte_array, byte_array)), write_batch_size)
 
   def add_handler(self, thread_id, state):
     log.info("add handler thread_id {}, state id{}".format(thread_id, id(state)))
     self._state_handler[thread_id] = state
 
   def get_handler(self):
-    return self._state_handler[threading.current_thread().ident]
+    handler = self._state_handler.get(threading.current_thread().ident)
+    if handler is None:
+      raise RuntimeError("no state handler is added for thread {}".format(threading.current_thread().ident))
+    return handler
+
+  def _flush(self):
+    with self._lock:
+      if not self._pending:
+        return
+      self.get_handler().put_all(self._pending)
+      self._pending = {}
+      self._size = None
 
   def exists(self, ids: list) -> list:
-    log.info("get handler id {}".format(id(self.get_handler())))
-    return [self.get_handler().contains(i) for i in ids]
+    self._flush()
+    with self._lock:
+      handler = self.get_handler()
+      return [handler.contains(i) for i in ids]
 
   def keys(self) -> list:
-    return list(self.get_handler().keys())
+    self._flush()
+    with self._lock:
+      return list(self.get_handler().keys())
 
   def put(self, key, value) -> bool:
-    res = not self.get_handler().contains(key)
-    self.get_handler().put(key, value)
+    res = True
+    with self._lock:
+      self._pending[key] = value
+      full = len(self._pending) >= self._write_batch_size
+    if full:
+      self._flush()
     return res
 
   def size(self) -> int:
-    return cardinality.count(self.get_handler().keys())
+    self._flush()
+    with self._lock:
+      if self._size is None:
+        self._size = cardinality.count(self.get_handler().keys())
+      return self._size
 
   def get(self, key):
-    return self.get_handler().get(key)
+    with self._lock:
+      value = self._pending.get(key)
+      if value is not None:
+        return value
+      return self.get_handler().get(key)
+
+  def clear(self):
+    with self._lock:
+      self._pending = {}
+      self.get_handler().clear()
+      self._size = 0
+
+  def __iter__(self):
+    self._flush()
+    # keys are read lazily from the state, one page of the state iterator at a time
+    self._it = iter(self.get_handler().keys())
+    return self
+
+  def __next__(self):
+    with self._lock:
+      return next(self._it)
@@ -14,6 +14,7 @@
 # ==============================================================================
 
 import abc
+import threading
 import plyvel
 from abc import ABCMeta
 from xfl.data.store.sample_kv_store import SampleKvStore
@@ -22,44 +23,125 @@ class LevelDbKvStore(SampleKvStore, metaclass=ABCMeta):
   def __init__(self, path,
           write_buffer_size=128*1024*1024,
           max_open_files=1000,
-          max_file_size=32*1024*1024) -> None:
+          max_file_size=32*1024*1024,
+          write_batch_size=10000,
+          reuse_existing=False) -> None:
     super().__init__()
     self._path = path
     self._db = plyvel.DB(name=path,
             create_if_missing=True,
-            error_if_exists=True,
+            error_if_exists=not reuse_existing,
             write_buffer_size=write_buffer_size,
             max_open_files=max_open_files,
             max_file_size=max_file_size)
+    # puts are buffered and written by one write batch every `write_batch_size` keys
+    self._write_batch_size = write_batch_size
+    self._pending = {}
+    self._lock = threading.Lock()
+    # the count of unique keys is maintained instead of scanned, a reused db is counted once here
+    self._size = 0
+    if reuse_existing:
+      with self._db.iterator(include_value=False) as it:
+        self._size = sum(1 for _ in it)
+
+  def _exists_sorted(self, keys: list) -> list:
+    # one forward key-only iterator seeks through sorted keys, values are never copied
+    res = []
+    with self._db.iterator(include_value=False) as it:
+      for k in keys:
+        it.seek(k)
+        res.append(next(it, None) == k)
+    return res
+
+  def _flush(self):
+    with self._lock:
+      if not self._pending:
+        return
+      keys = sorted(self._pending)
+      self._size += len(keys) - sum(self._exists_sorted(keys))
+      with self._db.write_batch() as wb:
+        for k in keys:
+          wb.put(k, self._pending[k])
+      self._pending = {}
 
   def put(self, key, value) -> bool:
     res = True
-    self._db.put(key, value)
+    with self._lock:
+      self._pending[key] = value
+      full = len(self._pending) >= self._write_batch_size
+    if full:
+      self._flush()
     return res
 
+  def bulk_load(self, items) -> int:
+    """
+    load (key, value) pairs sorted by key ascending into an empty store. duplicated keys
+    are detected against the previous key, so no lookup is needed, and every write batch
+    covers a contiguous key range.
+    @return: the number of unique keys loaded.
+    """
+    self._flush()
+    if self._size != 0:
+      raise RuntimeError("bulk load requires an empty store, size: {}".format(self._size))
+    last_key = None
+    wb = self._db.write_batch()
+    batch_cnt = 0
+    for k, v in items:
+      if last_key is not None and k < last_key:
+        raise ValueError("bulk load input is not sorted, {} after {}".format(k, last_key))
+      if k != last_key:
+        self._size += 1
+      wb.put(k, v)
+      last_key = k
+      batch_cnt += 1
+      if batch_cnt >= self._write_batch_size:
+        wb.write()
+        wb = self._db.write_batch()
+        batch_cnt = 0
+    wb.write()
+    return self._size
+
   def exists(self, ids: list) -> list:
-    return [self._db.get(i) is not None for i in ids]
+    self._flush()
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    res = [False] * len(ids)
+    for i, e in zip(order, self._exists_sorted([ids[i] for i in order])):
+      res[i] = e
+    return res
 
   def get(self, key):
+    with self._lock:
+      value = self._pending.get(key)
+    if value is not None:
+      return value
     return self._db.get(key)
 
   def keys(self) -> list:
-    res = []
-    with self._db.iterator() as it:
-      for k, v in it:
-        res.append(k)
-    return res
+    self._flush()
+    with self._db.iterator(include_value=False) as it:
+      return list(it)
 
   def size(self) -> int:
-    return len(self.keys())
+    self._flush()
+    return self._size
+
+  def close(self):
+    '''
+    flush pending puts and close the db, the data is kept for reopening with `reuse_existing`.
+    '''
+    self._flush()
+    self._db.close()
 
   def clear(self):
+    self._pending = {}
+    self._size = 0
     self._db.close()
     plyvel.destroy_db(self._path)
 
   def __iter__(self):
-    self._it = self._db.iterator()
+    self._flush()
+    self._it = self._db.iterator(include_value=False)
     return self
 
   def __next__(self):
-    return next(self._it)[0]
+    return next(self._it)
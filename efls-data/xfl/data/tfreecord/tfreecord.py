@@ -39,6 +39,7 @@
 # limitations under the License.
 # ==============================================================================
 
+import mmap
 import struct
 import warnings
 
@@ -54,6 +55,100 @@ def mask_crc(crc):
     return (((crc >> 15) | (crc << 17)) + kmask_delta) & 0xFFFFFFFF
 
 
+_HEADER = struct.Struct("<QI")
+_CRC = struct.Struct("<I")
+
+
+class TFRecordFile:
+    """
+    A mmap'd tfrecord file. Record boundaries are found by one scan over the length headers, records
+    are sliced out of the map on demand, no per record file reads are made.
+    With `check_crc`, the CRCs of a record are verified when it is sliced out, a misframed file fails
+    at the first record read after the corruption.
+    """
+    def __init__(self, filename, check_crc=False, skip_error=False):
+        self._file = open(filename, "rb")
+        size = self._file.seek(0, 2)
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+        self._check_crc = check_crc
+        self._skip_error = skip_error
+        self.offsets, self.lengths = self._scan(size)
+
+    def _scan(self, size):
+        mm = self._mm
+        unpack_from = _HEADER.unpack_from
+        offsets, lengths = [], []
+        pos = 0
+        # only the last record can be truncated, so the bound is checked once after the scan
+        try:
+            while pos < size:
+                length = unpack_from(mm, pos)[0]
+                offsets.append(pos + 12)
+                lengths.append(length)
+                pos += 16 + length
+        except struct.error:
+            raise ValueError(f"truncated record header at {len(offsets)}")
+        if pos > size:
+            raise ValueError(f"truncated record at {len(offsets) - 1}")
+        return np.asarray(offsets, dtype=np.int64), np.asarray(lengths, dtype=np.int64)
+
+    def _records(self, offsets, lengths):
+        mm = self._mm
+        check_crc = self._check_crc
+        crc = crc32c.crc32c
+        crc_from = _CRC.unpack_from
+        for o, n in zip(offsets.tolist(), lengths.tolist()):
+            record = mm[o:o + n]
+            # mask_crc is inlined, this loop is the hot path of reading
+            if check_crc:
+                h = crc(mm[o - 12:o - 4])
+                d = crc(record)
+                if (((h >> 15) | (h << 17)) + kmask_delta) & 0xFFFFFFFF != crc_from(mm, o - 4)[0] or \
+                        (((d >> 15) | (d << 17)) + kmask_delta) & 0xFFFFFFFF != crc_from(mm, o + n)[0]:
+                    if not self._skip_error:
+                        raise ValueError(f"corrupted record at offset {o}")
+                    warnings.warn(f"corrupted record at offset {o}")
+            yield record
+
+    def iter_framed(self):
+        """
+        Yield (record, framed record), the framed record keeps its length header and CRCs and can be
+        written to another tfrecord file as is.
+        """
+        mm = self._mm
+        for o, n, record in zip(self.offsets.tolist(), self.lengths.tolist(), self):
+            yield record, mm[o - 12:o + n + 4]
+
+    def get_framed(self, i):
+        """
+        The i-th record with its length header and CRCs.
+        """
+        o, n = int(self.offsets[i]), int(self.lengths[i])
+        return self._mm[o - 12:o + n + 4]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self._records(self.offsets[i], self.lengths[i]))
+        return next(self._records(self.offsets[i:i + 1], self.lengths[i:i + 1]))
+
+    def __iter__(self):
+        return self._records(self.offsets, self.lengths)
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class RecordReader:
     def __init__(self):
         self.example = tfrecords_pb2.Example()
@@ -71,6 +166,51 @@ class RecordReader:
                 ret[name] = np.asarray(list(feature.float_list.value), dtype=np.float32)
         return ret
 
+    def decode_examples(self, buffers, names=None):
+        """
+        Decode serialized examples column-wise.
+        @param names: features to decode, all features of the first example by default.
+        @return: dict of feature name to column. Numeric features of one value per example are 1-D
+          arrays, other columns hold the values of each example as in `decode_example`.
+        """
+        example = self.example
+        columns = None
+        for buffer in buffers:
+            example.ParseFromString(buffer)
+            feature_map = example.features.feature
+            if columns is None:
+                columns = {name: [] for name in (feature_map.keys() if names is None else names)}
+            # values are copied out, the message is reused by the next example
+            for name, col in columns.items():
+                feature = feature_map[name]
+                if len(feature.bytes_list.value) > 0:
+                    col.append(list(feature.bytes_list.value))
+                elif len(feature.int64_list.value) > 0:
+                    col.append(list(feature.int64_list.value))
+                elif len(feature.float_list.value) > 0:
+                    col.append(list(feature.float_list.value))
+                else:
+                    col.append([])
+        ret = {}
+        for name, col in (columns or {}).items():
+            kind = next((type(v[0]) for v in col if len(v) > 0), bytes)
+            if kind is bytes:
+                ret[name] = col
+                continue
+            dtype = np.int64 if kind is int else np.float32
+            if all(len(v) == 1 for v in col):
+                ret[name] = np.fromiter((v[0] for v in col), dtype=dtype, count=len(col))
+            else:
+                ret[name] = [np.asarray(v, dtype=dtype) for v in col]
+        return ret
+
+    def read_records(self, filename, check_crc=True, skip_error=False):
+        """
+        Yield records of a file from its map, CRCs are checked as records are yielded when `check_crc`.
+        """
+        with TFRecordFile(filename, check_crc=check_crc, skip_error=skip_error) as records:
+            yield from records
+
     # From https://github.com/jongwook/tfrecord_lite
     def read_from_tfrecord(self, filename, skip_error=False):
         i = 0
@@ -13,7 +13,12 @@
 # limitations under the License.
 # ==============================================================================
 
+import fcntl
+import os
 from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
 
 from xfl.common.logger import log
 
@@ -47,11 +52,37 @@ def check_path(filenames):
 def gather_res(ids, existence):
   assert len(ids) == len(existence), \
     'ids size {}, existence size {}'.format(len(ids), len(existence))
-  res = []
-  for i in range(0, len(existence)):
-    if existence[i]:
-      res.append(ids[i])
-  return res
+  if isinstance(existence, np.ndarray):
+    return [ids[i] for i in np.flatnonzero(existence)]
+  return [ids[i] for i, e in enumerate(existence) if e]
+
+
+def batch_iter(iterable, batch_size: int):
+  '''
+  split an iterable to lists of `batch_size` items, the last one may be shorter.
+  '''
+  batch = []
+  for i in iterable:
+    batch.append(i)
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def pack_existence(existence) -> bytes:
+  '''
+  pack a list of bools to a bitmap, 8 per byte, most significant bit first.
+  '''
+  return np.packbits(np.asarray(existence, dtype=np.bool_)).tobytes()
+
+
+def unpack_existence(bitmap: bytes, size: int):
+  '''
+  unpack the bitmap made by `pack_existence` to a numpy bool array of length `size`.
+  '''
+  return np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8))[:size].astype(np.bool_)
 
 
 def to_bytes(v):
@@ -67,3 +98,17 @@ def get_sample_store_key(hash_col_value, sort_col_value: int):
 def split_sample_store_key(sample_store_key: bytes):
   t = sample_store_key.split(b'#')
   return t
+
+
+@contextmanager
+def file_lock(path: str):
+  '''
+  an exclusive lock of the processes of a node on the file `path`, released when the block exits.
+  '''
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  with open(path, 'w') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
@@ -15,18 +15,137 @@
 
 import time
 import json
+import queue
+import threading
+from collections import deque
+
 import grpc
+import numpy as np
 from google.protobuf.empty_pb2 import Empty
 
 from proto import data_join_pb2_grpc, data_join_pb2, common_pb2
 from proto.data_join_pb2 import BucketIdRequest
+from xfl.data.bloom_filter import BloomFilter
 from xfl.data.check_sum import CheckSum
 from xfl.data import utils
+from xfl.common import metrics
 from xfl.common.common import RunMode
 from xfl.common.decorator import retry_fn
 from xfl.common.logger import log
 from xfl.service.proxy import get_insecure_channel
 
+CLIENT_RPC_SECONDS = metrics.REGISTRY.histogram(
+  'xfl_data_join_client_rpc_seconds', 'round trip time of a join batch', ['bucket', 'method'])
+CLIENT_SENT_BYTES = metrics.REGISTRY.counter(
+  'xfl_data_join_client_sent_bytes_total', 'bytes of join requests sent', ['bucket', 'method'])
+CLIENT_RECEIVED_BYTES = metrics.REGISTRY.counter(
+  'xfl_data_join_client_received_bytes_total', 'bytes of join responses received', ['bucket', 'method'])
+CLIENT_IDS = metrics.REGISTRY.counter('xfl_data_join_client_ids_total', 'ids sent to join', ['bucket'])
+CLIENT_HIT_IDS = metrics.REGISTRY.counter('xfl_data_join_client_hit_ids_total', 'ids found by server', ['bucket'])
+CLIENT_BATCH_IDS = metrics.REGISTRY.histogram('xfl_data_join_client_batch_ids', 'ids of a join request', ['bucket'],
+                                              buckets=metrics.SIZE_BUCKETS)
+CLIENT_WAIT_READY_SECONDS = metrics.REGISTRY.counter(
+  'xfl_data_join_client_wait_ready_seconds_total', 'time spent waiting for server to be ready', ['bucket'])
+
+
+def record_join_rpc(method: str, bucket_id: int, request, response, seconds: float = None):
+  if seconds is not None:
+    CLIENT_RPC_SECONDS.observe(seconds, bucket=bucket_id, method=method)
+  CLIENT_SENT_BYTES.inc(request.ByteSize(), bucket=bucket_id, method=method)
+  CLIENT_RECEIVED_BYTES.inc(response.ByteSize(), bucket=bucket_id, method=method)
+
+
+def create_data_join_channel(host: str, ip: str, port: int, run_mode: RunMode, tls_crt: str = ''):
+  service_config_json = json.dumps({
+    "methodConfig": [{
+      "name": [
+        {
+          "service": "xfl.DataJoinService",
+          "method": "IsReady"
+        },
+        {
+          "service": "xfl.DataJoinService",
+          "method": "SyncJoin"
+        },
+        {
+          "service": "xfl.DataJoinService",
+          "method": "AsyncJoin"
+        },
+        {
+          "service": "xfl.DataJoinService",
+          "method": "FinishJoin"
+        },
+        {
+          "service": "xfl.DataJoinService",
+          "method": "AcquireServerData"
+        },
+        {
+          "service": "xfl.DataJoinService",
+          "method": "SendServerSignedData"
+        }
+      ],
+      "retryPolicy": {
+        "maxAttempts": 5,
+        "initialBackoff": "0.2s",
+        "maxBackoff": "10s",
+        "backoffMultiplier": 2,
+        "retryableStatusCodes": ["UNAVAILABLE"],
+      },
+    }]
+  })
+  if run_mode == RunMode.LOCAL:
+    address = "{}:{}".format(host, port)
+    channel = get_insecure_channel(address,
+                                   options=[('grpc.max_send_message_length', 2 ** 31 - 1),
+                                            ('grpc.max_receive_message_length', 2 ** 31 - 1),
+                                            ("grpc.enable_retries", 1),
+                                            ("grpc.service_config", service_config_json)])
+  elif run_mode == RunMode.K8S:
+    credentials = grpc.ssl_channel_credentials(root_certificates=tls_crt)
+    address = "{}:{}".format(ip, port)
+    log.info("Data Join Client TLS host: {}".format(host))
+    channel = grpc.secure_channel(address, credentials,
+                                  options=(('grpc.ssl_target_name_override', host),
+                                           ('grpc.max_send_message_length', 2 ** 31 - 1),
+                                           ('grpc.max_receive_message_length', 2 ** 31 - 1),
+                                           ("grpc.enable_retries", 1),
+                                           ("grpc.service_config", service_config_json)))
+  return channel
+
+
+class DataJoinChannelPool(object):
+  '''
+  gRPC channels shared by the clients of many buckets. Buckets behind one address are routed by the
+  `servicename` metadata of each request, so their clients can multiplex a few channels.
+  '''
+  def __init__(self, host: str, ip: str, run_mode: RunMode, tls_crt: str = '', channels_per_address: int = 1):
+    self._host = host
+    self._ip = ip
+    self._run_mode = run_mode
+    self._tls_crt = tls_crt
+    self._channels_per_address = channels_per_address
+    self._channels = {}
+    self._next = {}
+    self._lock = threading.Lock()
+
+  def get(self, port: int) -> grpc.Channel:
+    with self._lock:
+      channels = self._channels.setdefault(port, [])
+      if len(channels) < self._channels_per_address:
+        channels.append(create_data_join_channel(self._host, self._ip, port, self._run_mode, self._tls_crt))
+        return channels[-1]
+      i = self._next.get(port, 0)
+      self._next[port] = (i + 1) % len(channels)
+      return channels[i]
+
+  def close(self):
+    with self._lock:
+      for channels in self._channels.values():
+        for c in channels:
+          c.close()
+      self._channels = {}
+
+
 class DataJoinClient(object):
   def __init__(self,
                host: str,
@@ -36,7 +155,8 @@ class DataJoinClient(object):
                bucket_id: int,
                run_mode: RunMode = RunMode.LOCAL,
                tls_crt: str = '',
-               client2multiserver: int = 1):
+               client2multiserver: int = 1,
+               channel: grpc.Channel = None):
 
     log.info("Client run mode: {}".format(run_mode))
     log.info("Start a DataJoinClient at host:{}, ip:{}, port:{}".format(host, ip, port))
@@ -48,56 +168,9 @@ class DataJoinClient(object):
     #Grpc requests will be forwarded through servicename in part configuration-snippet of nginx-ingress
     log.info("metadata:{}".format(self._metadata))
 
-    service_config_json = json.dumps({
-      "methodConfig": [{
-        "name": [
-          {
-            "service": "xfl.DataJoinService",
-            "method": "IsReady"
-          },
-          {
-            "service": "xfl.DataJoinService",
-            "method": "SyncJoin"
-          },
-          {
-            "service": "xfl.DataJoinService",
-            "method": "FinishJoin"
-          },
-          {
-            "service": "xfl.DataJoinService",
-            "method": "AcquireServerData"
-          },
-          {
-            "service": "xfl.DataJoinService",
-            "method": "SendServerSignedData"
-          }
-        ],
-        "retryPolicy": {
-          "maxAttempts": 5,
-          "initialBackoff": "0.2s",
-          "maxBackoff": "10s",
-          "backoffMultiplier": 2,
-          "retryableStatusCodes": ["UNAVAILABLE"],
-        },
-      }]
-    })
-    if run_mode == RunMode.LOCAL:
-      address = "{}:{}".format(host, port)
-      self._channel = get_insecure_channel(address,
-                                           options=[('grpc.max_send_message_length', 2 ** 31 - 1),
-                                                    ('grpc.max_receive_message_length', 2 ** 31 - 1),
-                                                    ("grpc.enable_retries", 1),
-                                                    ("grpc.service_config", service_config_json)])
-    elif run_mode == RunMode.K8S:
-      credentials = grpc.ssl_channel_credentials(root_certificates=tls_crt)
-      address = "{}:{}".format(ip, port)
-      log.info("Data Join Client TLS host: {}".format(host))
-      self._channel = grpc.secure_channel(address, credentials,
-                                          options=(('grpc.ssl_target_name_override', host),
-                                                   ('grpc.max_send_message_length', 2 ** 31 - 1),
-                                                   ('grpc.max_receive_message_length', 2 ** 31 - 1),
-                                                   ("grpc.enable_retries", 1),
-                                                   ("grpc.service_config", service_config_json)))
+    if channel is None:
+      channel = create_data_join_channel(host, ip, port, run_mode, tls_crt)
+    self._channel = channel
     self._stub = data_join_pb2_grpc.DataJoinServiceStub(self._channel)
 
   def get_stub(self):
@@ -107,6 +180,7 @@ class DataJoinClient(object):
     bucket_id = self._init_bucket_id
     for t in range(self._client2multiserver):
       cnt = 0
+      start = time.perf_counter()
       while True:
         try:
           log.info("client waiting ...")
@@ -123,6 +197,7 @@ class DataJoinClient(object):
 
           if timeout is not None and cnt > timeout:
             raise InterruptedError("Client wait server ready time out!")
+      CLIENT_WAIT_READY_SECONDS.inc(time.perf_counter() - start, bucket=bucket_id)
       bucket_id += 1
     return True
 
@@ -140,29 +215,126 @@ class DataJoinClient(object):
       bucket_id += 1
     return True
 
-  @retry_fn(retry_times=10, needed_exceptions=[grpc.RpcError], retry_interval=0.2)
-  def sync_join(self, request_ids, bucket_id):
-    join_res = None
-    res = self._stub.SyncJoin(
-      data_join_pb2.JoinRequest(ids=request_ids, bucket_id=bucket_id),
-      metadata=(("servicename", '{}-{}'.format(self._job_name, bucket_id)), ("app", self._job_name))
-    )
+  def get_metadata(self, bucket_id):
+    return (("servicename", '{}-{}'.format(self._job_name, bucket_id)), ("app", self._job_name))
 
-    if res.status.code == common_pb2.OK:
-      join_res = list(res.join_res)
-      res_ids = utils.gather_res(request_ids, existence=join_res)
-      self._checksumlist[bucket_id - self._init_bucket_id].add_list(res_ids)
-    else:
+  def check_join_response(self, request_ids, bucket_id, res):
+    '''
+    check the JoinResponse of `request_ids`, update check sum of `bucket_id` and return the existence
+    as a numpy bool array.
+    '''
+    if res.status.code != common_pb2.OK:
       raise RuntimeError('Sync Join Error:%s' % str(res))
+    if res.join_bitmap:
+      join_res = utils.unpack_existence(res.join_bitmap, len(request_ids))
+    else:
+      # servers without bitmap support answer with `join_res`
+      join_res = np.asarray(res.join_res, dtype=np.bool_)
+    res_ids = utils.gather_res(request_ids, existence=join_res)
+    self._checksumlist[bucket_id - self._init_bucket_id].add_list(res_ids)
+    CLIENT_IDS.inc(len(request_ids), bucket=bucket_id)
+    CLIENT_HIT_IDS.inc(len(res_ids), bucket=bucket_id)
+    CLIENT_BATCH_IDS.observe(len(request_ids), bucket=bucket_id)
     return join_res
 
+  @retry_fn(retry_times=10, needed_exceptions=[grpc.RpcError], retry_interval=0.2)
+  def sync_join(self, request_ids, bucket_id):
+    request = data_join_pb2.JoinRequest(ids=request_ids, bucket_id=bucket_id, accept_bitmap=True)
+    start = time.perf_counter()
+    res = self._stub.SyncJoin(request, metadata=self.get_metadata(bucket_id))
+    record_join_rpc('SyncJoin', bucket_id, request, res, time.perf_counter() - start)
+    return self.check_join_response(request_ids, bucket_id, res)
+
+  def stream_join(self, batches, bucket_id, max_in_flight=4):
+    '''
+    join an iterable of id batches through one StreamJoin stream. unlike sync_join it is not retried,
+    an rpc error of the stream fails the join.
+    @return: generator of (request_ids, existence) in the order of `batches`.
+    '''
+    session = StreamJoinSession(self, bucket_id, max_in_flight=max_in_flight)
+    try:
+      for request_ids in batches:
+        for request_ids, existence, _ in session.put(request_ids):
+          yield request_ids, existence
+      for request_ids, existence, _ in session.close():
+        yield request_ids, existence
+    except BaseException:
+      session.cancel()
+      raise
+
+  def async_join(self, batches, bucket_id, max_in_flight=8, total_batch_num=None):
+    '''
+    join id batches by concurrent AsyncJoin calls, the server may answer them in any order. `batches` is
+    consumed lazily and at most `max_in_flight` batches are kept alive, an iterator must be given with
+    `total_batch_num`, the number of batches it yields.
+    @return: generator of (request_ids, existence) in the order of `batches`.
+    '''
+    if total_batch_num is None:
+      total_batch_num = len(batches)
+    pending = deque()
+    batch_num = 0
+    try:
+      for batch_idx, request_ids in enumerate(batches):
+        if batch_idx >= total_batch_num:
+          raise RuntimeError('async join bucket {} got more than {} batches'.format(bucket_id, total_batch_num))
+        request = data_join_pb2.AsyncJoinRequest(ids=request_ids, bucket_id=bucket_id, batch_idx=batch_idx,
+                                                 total_batch_num=total_batch_num, accept_bitmap=True)
+        pending.append((request_ids, request, self._async_join_future(request, bucket_id)))
+        batch_num += 1
+        while len(pending) > max(1, max_in_flight):
+          # results are consumed in batch order, so the check sum matches the one folded by server
+          yield self._async_join_result(bucket_id, *pending.popleft())
+      if batch_num != total_batch_num:
+        raise RuntimeError('async join bucket {} got {} batches, expect {}'.format(bucket_id, batch_num, total_batch_num))
+      while pending:
+        yield self._async_join_result(bucket_id, *pending.popleft())
+    except BaseException:
+      for _, _, future in pending:
+        future.cancel()
+      raise
+
+  def _async_join_future(self, request, bucket_id):
+    future = self._stub.AsyncJoin.future(request, metadata=self.get_metadata(bucket_id))
+    # latency is taken when the response arrives, not when it is consumed
+    future.add_done_callback(lambda f, start=time.perf_counter(): CLIENT_RPC_SECONDS.observe(
+      time.perf_counter() - start, bucket=bucket_id, method='AsyncJoin'))
+    return future
+
+  @retry_fn(retry_times=10, needed_exceptions=[grpc.RpcError], retry_interval=0.2)
+  def _resend_async_join(self, request, bucket_id):
+    # the server answers a batch sent again but counts it only once
+    return self._async_join_future(request, bucket_id).result()
+
+  def _async_join_result(self, bucket_id, request_ids, request, future):
+    try:
+      res = future.result()
+    except grpc.RpcError:
+      log.error('AsyncJoin batch %s of bucket %s failed, retrying...', request.batch_idx, bucket_id)
+      res = self._resend_async_join(request, bucket_id)
+    record_join_rpc('AsyncJoin', bucket_id, request, res)
+    if res.status.code == common_pb2.OK and res.batch_idx != request.batch_idx:
+      raise RuntimeError('Async Join Error: batch idx not match, expect {}, got {}'.format(request.batch_idx,
+                                                                                          res.batch_idx))
+    return request_ids, self.check_join_response(request_ids, bucket_id, res)
+
+  @retry_fn(retry_times=10, needed_exceptions=[grpc.RpcError], retry_interval=0.2)
+  def get_bloom_filter(self, bucket_id):
+    res = self._stub.GetBloomFilter(data_join_pb2.BucketIdRequest(bucket_id=bucket_id),
+                                    metadata=self.get_metadata(bucket_id))
+    if res.status.code != common_pb2.OK:
+      raise RuntimeError('Get bloom filter Error:%s' % str(res.status))
+    return BloomFilter.from_bytes(res.object)
+
   @retry_fn(retry_times=10, needed_exceptions=[grpc.RpcError], retry_interval=0.2)
   def sign_blinded_ids_from_server(self, request_ids, bucket_id):
     res = self._stub.PsiSign(
-      data_join_pb2.PsiSignRequest(ids=request_ids),
+      data_join_pb2.PsiSignRequest(ids=request_ids, accept_packed=True),
       metadata=(("servicename", '{}-{}'.format(self._job_name, bucket_id)), ("app", self._job_name))
     )
     if res.status.code == common_pb2.OK:
+      if res.packed_signed_ids:
+        id_len = len(res.packed_signed_ids) // len(request_ids)
+        return [res.packed_signed_ids[i:i + id_len] for i in range(0, len(res.packed_signed_ids), id_len)]
       return list(res.signed_ids)
     else:
       log.error("Psi Sign Error:%s", str(res))
@@ -199,6 +371,84 @@ class DataJoinClient(object):
       raise RuntimeError('send_server_signed_data error:%s'%status.message)
     return True
 
+class StreamJoinSession(object):
+  """
+  Pipelines SyncJoin batches of one bucket over a bidirectional StreamJoin stream.
+  At most `max_in_flight` batches wait for their response after `put` returns, so
+  the join is limited by bandwidth instead of round trip time. The server answers
+  the batches of a stream in order, which keeps the bucket order and the check sum
+  the same as with `DataJoinClient.sync_join`.
+  """
+  def __init__(self, client: DataJoinClient, bucket_id: int, max_in_flight: int = 4):
+    self._client = client
+    self._bucket_id = bucket_id
+    self._max_in_flight = max(1, max_in_flight)
+    self._requests = queue.Queue()
+    self._pending = deque()
+    self._batch_idx = 0
+    self._closed = False
+    self._responses = client.get_stub().StreamJoin(self._request_iterator(),
+                                                   metadata=client.get_metadata(bucket_id))
+
+  def _request_iterator(self):
+    while True:
+      request = self._requests.get()
+      if request is None:
+        return
+      yield request
+
+  def _receive(self):
+    batch_idx, request_ids, context, request, start = self._pending.popleft()
+    try:
+      res = next(self._responses)
+    except StopIteration:
+      raise RuntimeError('Stream Join Error: stream of bucket {} closed with {} batches pending'
+                         .format(self._bucket_id, len(self._pending) + 1))
+    if res.status.code == common_pb2.OK and res.batch_idx != batch_idx:
+      raise RuntimeError('Stream Join Error: expect batch {}, got {}'.format(batch_idx, res.batch_idx))
+    record_join_rpc('StreamJoin', self._bucket_id, request, res, time.perf_counter() - start)
+    existence = self._client.check_join_response(request_ids, self._bucket_id, res)
+    return request_ids, existence, context
+
+  def put(self, request_ids, context=None):
+    """
+    send a batch of ids.
+    @param request_ids: ids to join.
+    @param context: any object, returned together with the result of this batch.
+    @return: list of (request_ids, existence, context) of the batches finished so far, in sending order.
+    """
+    if self._closed:
+      raise RuntimeError('StreamJoinSession of bucket {} has been closed'.format(self._bucket_id))
+    request = data_join_pb2.JoinRequest(ids=request_ids, bucket_id=self._bucket_id,
+                                        batch_idx=self._batch_idx, accept_bitmap=True)
+    self._requests.put(request)
+    self._pending.append((self._batch_idx, request_ids, context, request, time.perf_counter()))
+    self._batch_idx += 1
+    finished = []
+    while len(self._pending) > self._max_in_flight:
+      finished.append(self._receive())
+    return finished
+
+  def close(self):
+    """
+    close the stream and wait for all pending batches.
+    @return: list of (request_ids, existence, context) of the remaining batches.
+    """
+    if self._closed:
+      return []
+    self._closed = True
+    self._requests.put(None)
+    finished = []
+    while self._pending:
+      finished.append(self._receive())
+    return finished
+
+  def cancel(self):
+    self._closed = True
+    self._requests.put(None)
+    self._responses.cancel()
+
+
 def create_data_join_client(host,
                             ip,
                             port,
@@ -207,7 +457,9 @@ def create_data_join_client(host,
                             run_mode,
                             tls_crt,
                             client2multiserver,
+                            channel=None,
                             ):
   client = DataJoinClient(host=host, ip=ip, port=port, job_name=job_name, bucket_id=bucket_id,
-                          run_mode=run_mode, tls_crt=tls_crt, client2multiserver=client2multiserver)
+                          run_mode=run_mode, tls_crt=tls_crt, client2multiserver=client2multiserver,
+                          channel=channel)
   return client
@@ -13,43 +13,136 @@
 # limitations under the License.
 # ==============================================================================
 import os
+import queue
 import threading
+import time
+from collections import deque
 from concurrent import futures
 
 import grpc
+import numpy as np
 
 from proto import data_join_pb2, data_join_pb2_grpc, common_pb2
+from xfl.common import metrics
 from xfl.common.common import RunMode
 from xfl.common.logger import log
 from xfl.data import utils
+from xfl.data.bloom_filter import BloomFilter
 from xfl.data.check_sum import CheckSum
 from xfl.data.store.sample_kv_store import SampleKvStore
 from xfl.k8s.k8s_client import K8sClient
 from xfl.k8s.k8s_resource import create_data_join_service, release_data_join_service
 
+SERVER_RPC_SECONDS = metrics.REGISTRY.histogram(
+  'xfl_data_join_server_rpc_seconds', 'time of handling a request, a batch of a stream for StreamJoin',
+  ['bucket', 'method'])
+SERVER_RECEIVED_BYTES = metrics.REGISTRY.counter(
+  'xfl_data_join_server_received_bytes_total', 'bytes of requests received', ['bucket', 'method'])
+SERVER_SENT_BYTES = metrics.REGISTRY.counter(
+  'xfl_data_join_server_sent_bytes_total', 'bytes of responses sent', ['bucket', 'method'])
+SERVER_IDS = metrics.REGISTRY.counter('xfl_data_join_server_ids_total', 'ids requested by clients', ['bucket'])
+SERVER_HIT_IDS = metrics.REGISTRY.counter('xfl_data_join_server_hit_ids_total', 'requested ids found', ['bucket'])
+SERVER_BATCH_IDS = metrics.REGISTRY.histogram('xfl_data_join_server_batch_ids', 'ids of a join request', ['bucket'],
+                                              buckets=metrics.SIZE_BUCKETS)
+SERVER_STATE = metrics.REGISTRY.gauge('xfl_data_join_server_state', '0 not ready, 1 ready, 2 finished', ['bucket'])
+# sample store access, the mean latency of an op is seconds / keys
+STORE_SECONDS = metrics.REGISTRY.counter('xfl_data_join_store_seconds_total', 'time spent in sample store',
+                                         ['bucket', 'op'])
+STORE_KEYS = metrics.REGISTRY.counter('xfl_data_join_store_keys_total', 'keys accessed in sample store',
+                                      ['bucket', 'op'])
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+  '''
+  record latency and wire bytes of the rpcs of a bucket server. Bytes are counted by the (de)serializers,
+  so messages are not serialized again.
+  '''
+  def __init__(self, bucket_id):
+    self._bucket_id = bucket_id
+
+  def intercept_service(self, continuation, handler_call_details):
+    handler = continuation(handler_call_details)
+    if handler is None or not (handler.unary_unary or handler.stream_stream):
+      return handler
+    bucket = self._bucket_id
+    method = handler_call_details.method.rsplit('/', 1)[-1]
+    deserializer, serializer = handler.request_deserializer, handler.response_serializer
+
+    def request_deserializer(data):
+      SERVER_RECEIVED_BYTES.inc(len(data), bucket=bucket, method=method)
+      return deserializer(data)
+
+    def response_serializer(message):
+      data = serializer(message)
+      SERVER_SENT_BYTES.inc(len(data), bucket=bucket, method=method)
+      return data
+
+    if handler.unary_unary:
+      behavior = handler.unary_unary
+
+      def unary_unary(request, context):
+        with SERVER_RPC_SECONDS.time(bucket=bucket, method=method):
+          return behavior(request, context)
+      return grpc.unary_unary_rpc_method_handler(unary_unary, request_deserializer=request_deserializer,
+                                                 response_serializer=response_serializer)
+
+    behavior = handler.stream_stream
+
+    def stream_stream(request_iterator, context):
+      # responses of a stream follow its requests in order, a batch is timed from its arrival
+      arrivals = deque()
+
+      def requests():
+        for request in request_iterator:
+          arrivals.append(time.perf_counter())
+          yield request
+      for response in behavior(requests(), context):
+        if arrivals:
+          SERVER_RPC_SECONDS.observe(time.perf_counter() - arrivals.popleft(), bucket=bucket, method=method)
+        yield response
+    return grpc.stream_stream_rpc_method_handler(stream_stream, request_deserializer=request_deserializer,
+                                                 response_serializer=response_serializer)
+
 
 class DataJoinServer(data_join_pb2_grpc.DataJoinServiceServicer):
-  def __init__(self, sample_kv_store: SampleKvStore, bucket_id, is_async_join=False):
+  def __init__(self, sample_kv_store: SampleKvStore, bucket_id, is_async_join=False, bloom_filter_error_rate=0.001,
+               stream_result=False):
     self._finished = threading.Event()
     self._bucket_id = bucket_id
     self._ready = False
     self._is_async_join = is_async_join
     self._joined_res_lock = threading.Lock()
     self._joined_res = []
+    # with stream_result, joined batches are handed out by `iter_joined_res` instead of kept in `_joined_res`
+    self._stream_result = stream_result
+    self._joined_res_queue = queue.Queue()
     self._check_sum = CheckSum(0)
+    # AsyncJoin results that arrived ahead of their predecessors, keyed by batch_idx.
+    # batches are folded into the check sum and the result in batch order.
+    self._async_res = {}
+    self._async_next_idx = 0
+    self._async_total_batch_num = None
     self._sample_kv_store = sample_kv_store
     self._request_cnt = 0
     self._hit_cnt = 0
     self._all_cnt = 0
+    self._bloom_filter_error_rate = bloom_filter_error_rate
+    self._bloom_filter_lock = threading.Lock()
+    self._bloom_filter = None
     assert isinstance(self._sample_kv_store, SampleKvStore)
 
   @staticmethod
-  def _join_response(code, message: str, res: list) -> data_join_pb2.JoinResponse:
-    return data_join_pb2.JoinResponse(status=common_pb2.Status(code=code, message=message),
-                                      join_res=res)
+  def _join_response(code, message: str, res, use_bitmap: bool = False) -> data_join_pb2.JoinResponse:
+    status = common_pb2.Status(code=code, message=message)
+    if use_bitmap:
+      return data_join_pb2.JoinResponse(status=status, join_bitmap=utils.pack_existence(res))
+    if isinstance(res, np.ndarray):
+      res = res.tolist()
+    return data_join_pb2.JoinResponse(status=status, join_res=res)
 
   def set_is_ready(self, value: bool):
     self._ready = value
+    SERVER_STATE.set(int(value), bucket=self._bucket_id)
 
   def get_is_ready(self):
     return self._ready
@@ -61,6 +154,47 @@ class DataJoinServer(data_join_pb2_grpc.DataJoinServiceServicer):
   def get_final_result(self):
     return self._joined_res
 
+  def iter_joined_res(self, timeout: float = None):
+    '''
+    yield joined id batches in check sum order as soon as they are confirmed, until FinishJoin succeeds.
+    Only for servers created with `stream_result`, handed out batches are not kept by the server.
+    @param timeout: seconds to wait for the whole join, iteration stops when it is exceeded.
+    '''
+    assert self._stream_result, "iter_joined_res requires a server created with stream_result=True"
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+      try:
+        res = self._joined_res_queue.get(timeout=None if deadline is None else max(0., deadline - time.time()))
+      except queue.Empty:
+        log.warning("Server for bucket {} is not finished in {}s".format(self._bucket_id, timeout))
+        return
+      if res is None:
+        return
+      yield res
+
+  def _add_joined_res(self, res_ids, check_ids=None):
+    # must be called with _joined_res_lock held, batches are added in check sum order
+    self._check_sum.add_list(res_ids if check_ids is None else check_ids)
+    if self._stream_result:
+      self._joined_res_queue.put(res_ids)
+    else:
+      self._joined_res.append(res_ids)
+
+  def _exists(self, ids, store=None):
+    store = self._sample_kv_store if store is None else store
+    start = time.perf_counter()
+    res = np.asarray(store.exists(ids), dtype=np.bool_)
+    STORE_SECONDS.inc(time.perf_counter() - start, bucket=self._bucket_id, op='exists')
+    STORE_KEYS.inc(len(ids), bucket=self._bucket_id, op='exists')
+    return res
+
+  def _count_join(self, ids_num, hit_num):
+    self._all_cnt += ids_num
+    self._hit_cnt += hit_num
+    SERVER_IDS.inc(ids_num, bucket=self._bucket_id)
+    SERVER_HIT_IDS.inc(hit_num, bucket=self._bucket_id)
+    SERVER_BATCH_IDS.observe(ids_num, bucket=self._bucket_id)
+
   def print_result_statistic(self):
     log.info("Join result, reuqest cnt: {}, ids cnt: {}, ids hit cnt: {}"
              .format(self._request_cnt, self._all_cnt, self._hit_cnt))
@@ -75,12 +209,20 @@ class DataJoinServer(data_join_pb2_grpc.DataJoinServiceServicer):
     if self._finished.isSet():
       return common_pb2.Status(code=common_pb2.INTERNAL, message='Server has finished!')
 
-    if self._check_sum.get_check_sum() != request.check_sum:
-      log.error("CheckSum Error, request :%d, Server :%d", request.check_sum, self._check_sum.get_check_sum())
+    with self._joined_res_lock:
+      if self._async_total_batch_num is not None and self._async_next_idx != self._async_total_batch_num:
+        log.error("Async join batches missing, expect %d, got %d",
+                  self._async_total_batch_num, self._async_next_idx + len(self._async_res))
+        return common_pb2.Status(code=common_pb2.INTERNAL, message='AsyncJoin batches missing, Join Failed')
+      check_sum = self._check_sum.get_check_sum()
+    if check_sum != request.check_sum:
+      log.error("CheckSum Error, request :%d, Server :%d", request.check_sum, check_sum)
       return common_pb2.Status(code=common_pb2.INTERNAL, message='CheckSumError, Join Failed')
     log.info("CheckSum check ok, value is {}. Finish Server for bucket:{} !".format(request.check_sum, self._bucket_id))
     self.print_result_statistic()
+    SERVER_STATE.set(2, bucket=self._bucket_id)
     self._finished.set()
+    self._joined_res_queue.put(None)
     return common_pb2.Status(code=common_pb2.OK, message='')
 
   def SyncJoin(self, request: data_join_pb2.JoinRequest, context) -> data_join_pb2.JoinResponse:
@@ -92,28 +234,77 @@ class DataJoinServer(data_join_pb2_grpc.DataJoinServiceServicer):
       if self._bucket_id != request.bucket_id:
         return self._join_response(common_pb2.INVALID_ARGUMENT,
             'bucket id not match, expect {}, got {}'.format(self._bucket_id, request.bucket_id), [])
-      res = self._sample_kv_store.exists(request.ids)
-      self._all_cnt += len(request.ids)
-      self._hit_cnt += sum(res)
+      res = self._exists(request.ids)
+      self._count_join(len(request.ids), int(np.count_nonzero(res)))
+      tmp_res = utils.gather_res(request.ids, res)
       with self._joined_res_lock:
-        tmp_res = utils.gather_res(request.ids, res)
-        self._joined_res.append(tmp_res)
-        self._check_sum.add_list(tmp_res)
-      return self._join_response(common_pb2.OK, '', res)
+        self._add_joined_res(tmp_res)
+      return self._join_response(common_pb2.OK, '', res, request.accept_bitmap)
 
-  def AsyncJoin(self, request: data_join_pb2.AsyncJoinRequest, context) -> data_join_pb2.JoinResponse:
-    raise NotImplementedError('Method not implemented!')
+  def StreamJoin(self, request_iterator, context):
+    # requests of one stream are handled one by one, so the joined result and
+    # the check sum keep the order in which the client sent the batches.
+    for request in request_iterator:
+      response = self.SyncJoin(request, context)
+      response.batch_idx = request.batch_idx
+      yield response
 
-  def GetBloomFilter(self, request, context):
-    raise NotImplementedError('Method not implemented!')
+  def AsyncJoin(self, request: data_join_pb2.AsyncJoinRequest, context) -> data_join_pb2.JoinResponse:
+    # batches may arrive in any order and on any server thread, only the bookkeeping is locked.
+    if not self._ready:
+      return self._join_response(common_pb2.NOT_READY, '', [])
+    if self._bucket_id != request.bucket_id:
+      return self._join_response(common_pb2.INVALID_ARGUMENT,
+          'bucket id not match, expect {}, got {}'.format(self._bucket_id, request.bucket_id), [])
+    if not 0 <= request.batch_idx < request.total_batch_num:
+      return self._join_response(common_pb2.INVALID_ARGUMENT,
+          'batch idx {} out of range, total batch num {}'.format(request.batch_idx, request.total_batch_num), [])
+    res = self._exists(request.ids)
+    tmp_res = utils.gather_res(request.ids, res)
+    with self._joined_res_lock:
+      if self._async_total_batch_num is None:
+        self._async_total_batch_num = request.total_batch_num
+      elif self._async_total_batch_num != request.total_batch_num:
+        return self._join_response(common_pb2.INVALID_ARGUMENT,
+            'total batch num not match, expect {}, got {}'.format(self._async_total_batch_num, request.total_batch_num), [])
+      # a retried batch is answered again but counted only once
+      if request.batch_idx >= self._async_next_idx and request.batch_idx not in self._async_res:
+        self._request_cnt += 1
+        self._count_join(len(request.ids), len(tmp_res))
+        self._async_res[request.batch_idx] = tmp_res
+        while self._async_next_idx in self._async_res:
+          self._add_joined_res(self._async_res.pop(self._async_next_idx))
+          self._async_next_idx += 1
+    response = self._join_response(common_pb2.OK, '', res, request.accept_bitmap)
+    response.batch_idx = request.batch_idx
+    return response
+
+  def GetBloomFilter(self, request: data_join_pb2.BucketIdRequest, context) -> data_join_pb2.BloomFilter:
+    if not self._ready:
+      return data_join_pb2.BloomFilter(status=common_pb2.Status(code=common_pb2.NOT_READY, message='not_ready'))
+    if self._bucket_id != request.bucket_id:
+      return data_join_pb2.BloomFilter(status=common_pb2.Status(code=common_pb2.INVALID_ARGUMENT,
+          message='bucket id not match, expect {}, got {}'.format(self._bucket_id, request.bucket_id)))
+    # the sample store does not change after server is ready, build the filter once.
+    with self._bloom_filter_lock:
+      if self._bloom_filter is None:
+        self._bloom_filter = BloomFilter.from_store(self._sample_kv_store,
+                                                    error_rate=self._bloom_filter_error_rate).to_bytes()
+        log.info("Build bloom filter for bucket {}, size: {} bytes".format(self._bucket_id, len(self._bloom_filter)))
+    return data_join_pb2.BloomFilter(status=common_pb2.Status(code=common_pb2.OK, message=''),
+                                     object=self._bloom_filter)
 
 
 class PsiDataJoinServer(DataJoinServer):
-  def __init__(self, sample_kv_store: SampleKvStore, bucket_id, rsa_signer, is_async_join=False):
-    super().__init__(sample_kv_store, bucket_id, is_async_join)
+  def __init__(self, sample_kv_store: SampleKvStore, bucket_id, rsa_signer, is_async_join=False, stream_result=False):
+    super().__init__(sample_kv_store, bucket_id, is_async_join, stream_result=stream_result)
     assert rsa_signer is not None, "rsa signer should not be None!"
     self.rsa_signer_ = rsa_signer
 
+  def GetBloomFilter(self, request, context):
+    return data_join_pb2.BloomFilter(status=common_pb2.Status(code=common_pb2.UNIMPLEMENTED,
+                                                              message='bloom filter is not supported in psi join'))
+
   def GetRsaPublicKey(self, request, context):
     return data_join_pb2.RsaKey(status=common_pb2.Status(code=common_pb2.OK, message=''),
                                 key=self.rsa_signer_.get_public_key_bytes())
@@ -122,6 +313,10 @@ class PsiDataJoinServer(DataJoinServer):
     if not self._ready:
       return data_join_pb2.PsiSignResponse(status=common_pb2.Status(code=common_pb2.NOT_READY, message=''),
                                            signed_ids=[])
+    elif request.accept_packed:
+      packed_signed_ids = self.rsa_signer_.sign_blinded_ids_packed(request.ids)
+      return data_join_pb2.PsiSignResponse(status=common_pb2.Status(code=common_pb2.OK, message=''),
+                                           packed_signed_ids=packed_signed_ids)
     else:
       signed_ids = self.rsa_signer_.sign_blinded_ids_from_client(request.ids)
       return data_join_pb2.PsiSignResponse(status=common_pb2.Status(code=common_pb2.OK, message=''),
@@ -136,8 +331,9 @@ class EcdhDataJoinServer(DataJoinServer):
       is_async_join=False,
       pending_max_size=1000,
       batch_size=2048,
-      signed_id_map: SampleKvStore=None):
-    super().__init__(sample_kv_store, bucket_id, is_async_join)
+      signed_id_map: SampleKvStore=None,
+      stream_result=False):
+    super().__init__(sample_kv_store, bucket_id, is_async_join, stream_result=stream_result)
     assert ecc_signer is not None, "ecc signer should not be None!"
     self._ecc_signer = ecc_signer
     self._cli_sign_lock = threading.Lock()
@@ -149,35 +345,44 @@ class EcdhDataJoinServer(DataJoinServer):
     self._server_data_exhausted = False
     self._signed_id_map = signed_id_map
 
+  def GetBloomFilter(self, request, context):
+    return data_join_pb2.BloomFilter(status=common_pb2.Status(code=common_pb2.UNIMPLEMENTED,
+                                                              message='bloom filter is not supported in psi join'))
+
+  def AsyncJoin(self, request, context):
+    return self._join_response(common_pb2.UNIMPLEMENTED, 'async join is not supported in ecdh psi join', [])
 
   def _fetch_a_batch(self):
-    batch = []
-    try:
-      for i in range(self._batch_size):
-        batch.append(next(self._data_it))
-    except StopIteration:
-      pass
-    if batch:
-      self._block_id += 1
-      return self._block_id, batch
-    else:
-      return None, None
+    # clients acquire blocks concurrently. a block turns pending in the same step it is fetched,
+    # so that exhausted data with no pending block really means all server data has been signed.
+    with self._cli_sign_lock:
+      batch = []
+      try:
+        for i in range(self._batch_size):
+          batch.append(next(self._data_it))
+      except StopIteration:
+        pass
+      if batch:
+        self._block_id += 1
+        self._data_pending_buffer[self._block_id] = batch
+        return self._block_id, batch
+      else:
+        self._server_data_exhausted = True
+        return None, None
 
   def _all_server_data_ready(self):
-    return self._server_data_exhausted and len(self._data_pending_buffer)==0
+    with self._cli_sign_lock:
+      return self._server_data_exhausted and len(self._data_pending_buffer)==0
 
   def AcquireServerData(self, option: data_join_pb2.RequestServerOptions, context) -> data_join_pb2.RequestServerRes:
     block_id, batch = self._fetch_a_batch()
     if block_id:
-      with self._cli_sign_lock:
-        self._data_pending_buffer[block_id] = batch
       return data_join_pb2.RequestServerRes(status=common_pb2.Status(code=common_pb2.OK, message=''),
             signed_ids=batch,
             block_id=block_id,
             real_batch_size=len(batch),
             is_finished=False)
     else:
-      self._server_data_exhausted = True
       return data_join_pb2.RequestServerRes(status=common_pb2.Status(code=common_pb2.OK, message=''),
             signed_ids=[],
             block_id=0,
@@ -187,24 +392,26 @@ class EcdhDataJoinServer(DataJoinServer):
   def SendServerSignedData(self, data_block: data_join_pb2.DataBlock, context) -> common_pb2.Status:
     block_id = data_block.block_id
     signed_ids = data_block.data
-    if block_id not in self._data_pending_buffer:
+    with self._cli_sign_lock:
+      buf = self._data_pending_buffer.get(block_id)
+    if buf is None:
       return common_pb2.Status(code=common_pb2.INVALID_ARGUMENT, message='unexpected block_id: %d'%block_id)
-    if len(signed_ids) != len(self._data_pending_buffer[block_id]):
+    if len(signed_ids) != len(buf):
       return common_pb2.Status(code=common_pb2.INVALID_ARGUMENT,
-          message='signed data length error, expected %d, got %d'%(len(self._data_pending_buffer),len(signed_ids)))
+          message='signed data length error, expected %d, got %d'%(len(buf),len(signed_ids)))
     #update sample store keys
-    buf = self._data_pending_buffer[block_id]
     for i,k in enumerate(signed_ids):
       self._signed_id_map.put(k,buf[i])
+    # a block sent again by a retry may have been removed by the first call, its puts are the same
     with self._cli_sign_lock:
-      del self._data_pending_buffer[block_id]
+      self._data_pending_buffer.pop(block_id, None)
     return common_pb2.Status(code=common_pb2.OK)
 
   def SyncJoin(self, request: data_join_pb2.JoinRequest, context) -> data_join_pb2.JoinResponse:
     if not self._ready:
       return self._join_response(common_pb2.NOT_READY, '', [])
 
-    elif not self._all_server_data_ready:
+    elif not self._all_server_data_ready():
       return self._join_response(common_pb2.NOT_READY, 'there is still server data not signed by client', [])
     else:
       self._request_cnt += 1
@@ -212,14 +419,12 @@ class EcdhDataJoinServer(DataJoinServer):
         return self._join_response(common_pb2.INVALID_ARGUMENT,
             'bucket id not match, expect {}, got {}'.format(self._bucket_id, request.bucket_id), [])
       #in ecdh, ids should be signed before Join
-      signed_ids = [self._ecc_signer.sign(x) for x in request.ids]
-      res = self._signed_id_map.exists(signed_ids)
-      self._all_cnt += len(request.ids)
-      self._hit_cnt += sum(res)
+      signed_ids = self._ecc_signer.sign_batch(request.ids)
+      res = self._exists(signed_ids, self._signed_id_map)
+      self._count_join(len(request.ids), int(np.count_nonzero(res)))
       with self._joined_res_lock:
-        self._joined_res.append(utils.gather_res(signed_ids, res))
-        self._check_sum.add_list(utils.gather_res(request.ids, res))
-      return self._join_response(common_pb2.OK, '', res)
+        self._add_joined_res(utils.gather_res(signed_ids, res), utils.gather_res(request.ids, res))
+      return self._join_response(common_pb2.OK, '', res, request.accept_bitmap)
 
 class K8sResourceHandler(object):
 
@@ -272,25 +477,32 @@ def create_data_join_server(bucket_id,
                             use_psi=False,
                             signer=None,
                             psi_server_type='rsa', #rsa or ecdh
-                            ecdh_id_map: SampleKvStore = None
+                            ecdh_id_map: SampleKvStore = None,
+                            bloom_filter_error_rate=0.001,
+                            stream_result=False
                             ):
-  rpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+  rpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=10),
+                           interceptors=(MetricsInterceptor(bucket_id),))
   if use_psi:
     if psi_server_type == 'rsa':
       data_join_server = PsiDataJoinServer(
           sample_kv_store=sample_kv_store,
           bucket_id=bucket_id,
-          rsa_signer=signer)
+          rsa_signer=signer,
+          stream_result=stream_result)
     elif psi_server_type == 'ecdh':
       data_join_server = EcdhDataJoinServer(
           sample_kv_store=sample_kv_store,
           bucket_id=bucket_id,
           ecc_signer=signer,
-          signed_id_map=ecdh_id_map)
+          signed_id_map=ecdh_id_map,
+          stream_result=stream_result)
     else:
       raise RuntimeError('unsupported psi server type: %s'%psi_server_type)
   else:
-    data_join_server = DataJoinServer(sample_kv_store=sample_kv_store, bucket_id=bucket_id)
+    data_join_server = DataJoinServer(sample_kv_store=sample_kv_store, bucket_id=bucket_id,
+                                      bloom_filter_error_rate=bloom_filter_error_rate,
+                                      stream_result=stream_result)
 
   data_join_pb2_grpc.add_DataJoinServiceServicer_to_server(data_join_server, rpc_server)
   address = '[::]:{}'.format(str(port))